@@ -7,16 +7,22 @@ sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
 # Try to import from src directly
 try:
-    from flask import Flask, request, jsonify, render_template, redirect, url_for
-    from src.config.config import UPLOAD_FOLDER, PANDOC_INPUT_FORMATS, PANDOC_OUTPUT_FORMATS
+    from flask import Flask, request, jsonify, redirect, url_for
+    from src.config.config import UPLOAD_FOLDER, MAX_CONTENT_LENGTH, DEBUG, PORT, ASSETS_BUILD
     from src.config.swagger import setup_swagger
     from src.routes.main_routes import register_main_routes
     from src.routes.api_routes import register_api_routes
     from src.routes.conversion_routes import register_conversion_routes
-    from src.utils.conversion import process_file_conversion, convert_document
-    from src.utils.history import add_to_history
-    import base64
-    import tempfile
+    from src.routes.job_routes import register_job_routes
+    from src.routes.upload_routes import register_upload_routes
+    from src.routes.metrics_routes import register_metrics_routes
+    from src.utils.conversion import convert_document
+    from src.utils.governor import ServerBusy
+    from src.utils.ingest import IngestRequest
+    from src.utils.capabilities import capabilities
+    from src.utils.assets import assets
+    from src.utils.compression import compress_response
+    from src.utils.history import issue_client_token
 except ImportError as e:
     print(f"Error importing modules: {e}")
     print(f"Current directory: {os.getcwd()}")
@@ -35,11 +41,13 @@ def create_app():
         static_folder='src/static',
         template_folder='src/templates'
     )
+    # Stream uploads to disk (and hash them) while the request body is parsed
+    app.request_class = IngestRequest
     
     # Configure app
     app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
     app.config['TIMESTAMP'] = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-    app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
+    app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH  # MAX_UPLOAD_MB, 50MB by default
     app.config['RESULT_FOLDER'] = 'src/results'
     
     # Configure Swagger before registering routes
@@ -49,10 +57,26 @@ def create_app():
         'specs_route': '/docs/'
     }
     
+    # Probe pandoc/ImageMagick once, before any request needs to know what is installed
+    capabilities.probe()
+    
+    # Minify, fingerprint and precompress the page's CSS/JS (unchanged files are not rewritten)
+    if ASSETS_BUILD:
+        try:
+            assets.build()
+        except OSError as e:
+            print(f"Could not build static assets, serving them unprocessed: {e}")
+    
     # Register routes
     register_main_routes(app)
     register_api_routes(app)
     register_conversion_routes(app)
+    register_job_routes(app)
+    register_upload_routes(app)
+    register_metrics_routes(app)
+    # after_request hooks run in reverse order: compress before the metrics count the bytes sent
+    app.after_request(compress_response)
+    app.after_request(issue_client_token)
     
     # Setup Swagger after routes are registered
     swagger = setup_swagger(app)
@@ -67,11 +91,20 @@ def create_app():
     def legacy_docs_redirect():
         return redirect('/docs/')
     
+    @app.errorhandler(ServerBusy)
+    def server_busy(e):
+        response = jsonify({'error': str(e), 'retryAfter': e.retry_after})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+
     # Additional routes for file operations
     @app.route('/convert', methods=['POST'])
     def root_convert_function():
         try:
             return convert_document(request, app.config)
+        except ServerBusy:
+            raise
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
@@ -87,4 +120,5 @@ def create_app():
 
 if __name__ == "__main__":
     app = create_app()
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # Development server only; see gunicorn.conf.py / SERVER_MODE=production for serving
+    app.run(debug=DEBUG, host='0.0.0.0', port=PORT)
@@ -0,0 +1,373 @@
+"""
+Generate the benchmark corpus.
+
+Everything is built from a fixed random seed, so the same command produces
+the same bytes on every machine:
+
+    python benchmarks/corpus.py --out benchmarks/corpus
+
+Documents come in four sizes (tiny, small, medium, large) as Markdown, HTML
+and DOCX. DOCX files are written directly as Office Open XML, so no pandoc
+or python-docx is needed to build them; the equation documents embed WMF and
+EMF pictures the way MathType/Equation Editor objects appear in Word files,
+with some pictures repeated. Raster images (PNG and JPEG) need Pillow.
+"""
+import argparse
+import json
+import os
+import random
+import struct
+import sys
+import zipfile
+from xml.sax.saxutils import escape
+
+SEED = 20240601
+
+# Approximate number of paragraphs-worth of blocks per document size
+DOCUMENT_SIZES = {
+    'tiny': 3,
+    'small': 60,
+    'medium': 1500,
+    'large': 15000,
+}
+
+# (equations, distinct pictures) for the DOCX equation documents
+EQUATION_DOCUMENTS = {
+    'eq20': (20, 12),
+    'eq200': (200, 80),
+}
+
+IMAGE_SIZES = {
+    'small': (320, 240),
+    'medium': (1600, 1200),
+    'large': (4000, 3000),
+}
+
+WORDS = (
+    'conversion document format pandoc image table equation section paragraph list value result '
+    'server worker process cache request response latency throughput memory output input render '
+    'markdown html docx layout figure caption reference footnote heading content style metadata'
+).split()
+
+def _sentence(rng, words=12):
+    text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(words // 2, words)))
+    return text[0].upper() + text[1:] + '.'
+
+def _paragraph(rng):
+    return ' '.join(_sentence(rng) for _ in range(rng.randint(2, 5)))
+
+def _blocks(rng, count):
+    """
+    Abstract document blocks shared by the Markdown, HTML and DOCX writers.
+
+    Yields:
+        tuple: (kind, payload) with kind one of heading, paragraph, list, table, code, math
+    """
+    for index in range(count):
+        if index % 20 == 0:
+            yield 'heading', f'Section {index // 20 + 1}: {_sentence(rng, 5)[:-1]}'
+        roll = rng.random()
+        if roll < 0.65:
+            yield 'paragraph', _paragraph(rng)
+        elif roll < 0.78:
+            yield 'list', [_sentence(rng, 8) for _ in range(rng.randint(2, 6))]
+        elif roll < 0.88:
+            columns = rng.randint(2, 5)
+            yield 'table', [[rng.choice(WORDS) if row else f'Column {c + 1}' for c in range(columns)]
+                            for row in range(rng.randint(2, 8))]
+        elif roll < 0.95:
+            yield 'code', '\n'.join(f'{rng.choice(WORDS)} = {rng.randint(0, 999)}' for _ in range(rng.randint(2, 8)))
+        else:
+            yield 'math', f'x_{index} = \\frac{{{rng.randint(1, 99)}}}{{{rng.randint(1, 99)}}} + \\sqrt{{{rng.randint(2, 50)}}}'
+
+def write_markdown(blocks):
+    out = []
+    for kind, payload in blocks:
+        if kind == 'heading':
+            out.append(f'## {payload}')
+        elif kind == 'paragraph':
+            out.append(payload)
+        elif kind == 'list':
+            out.append('\n'.join(f'- {item}' for item in payload))
+        elif kind == 'table':
+            header, rows = payload[0], payload[1:]
+            lines = ['| ' + ' | '.join(header) + ' |', '|' + '---|' * len(header)]
+            lines += ['| ' + ' | '.join(row) + ' |' for row in rows]
+            out.append('\n'.join(lines))
+        elif kind == 'code':
+            out.append(f'```\n{payload}\n```')
+        else:
+            out.append(f'$${payload}$$')
+    return '# Benchmark document\n\n' + '\n\n'.join(out) + '\n'
+
+def write_html(blocks):
+    out = ['<!DOCTYPE html>', '<html>', '<head><meta charset="utf-8"><title>Benchmark document</title></head>',
+           '<body>', '<h1>Benchmark document</h1>']
+    for kind, payload in blocks:
+        if kind == 'heading':
+            out.append(f'<h2>{escape(payload)}</h2>')
+        elif kind == 'paragraph':
+            out.append(f'<p>{escape(payload)}</p>')
+        elif kind == 'list':
+            out.append('<ul>' + ''.join(f'<li>{escape(item)}</li>' for item in payload) + '</ul>')
+        elif kind == 'table':
+            rows = ''.join(
+                '<tr>' + ''.join(f'<{tag}>{escape(cell)}</{tag}>' for cell in row) + '</tr>'
+                for tag, row in (('th' if i == 0 else 'td', row) for i, row in enumerate(payload))
+            )
+            out.append(f'<table>{rows}</table>')
+        elif kind == 'code':
+            out.append(f'<pre><code>{escape(payload)}</code></pre>')
+        else:
+            out.append(f'<p><span class="math display">\\[{escape(payload)}\\]</span></p>')
+    out += ['</body>', '</html>']
+    return '\n'.join(out) + '\n'
+
+# --- Metafiles ---------------------------------------------------------------
+
+def make_wmf(rng, width=1200, height=400):
+    """A placeable WMF drawing a frame and a polyline, like a small equation picture"""
+    def record(function, *params):
+        return struct.pack('<IH', 3 + len(params), function) + struct.pack(f'<{len(params)}h', *params)
+
+    points = [(rng.randint(0, width), rng.randint(0, height)) for _ in range(rng.randint(4, 24))]
+    records = [
+        record(0x020B, 0, 0),                    # SETWINDOWORG
+        record(0x020C, height, width),           # SETWINDOWEXT
+        # CREATEPENINDIRECT: solid, width 8, black
+        struct.pack('<IHHhhI', 8, 0x02FA, 0, 8, 0, 0x000000),
+        record(0x012D, 0),                       # SELECTOBJECT
+        record(0x041B, height - 10, width - 10, 10, 10),  # RECTANGLE
+        record(0x0325, len(points), *[c for point in points for c in point]),  # POLYLINE
+        record(0x0000),                          # EOF
+    ]
+    body = b''.join(records)
+    max_record = max(len(r) for r in records) // 2
+    header = struct.pack('<HHHIHIH', 1, 9, 0x0300, (18 + len(body)) // 2, 1, max_record, 0)
+
+    placeable = struct.pack('<IHhhhhHI', 0x9AC6CDD7, 0, 0, 0, width, height, 1440, 0)
+    checksum = 0
+    for (word,) in struct.iter_unpack('<H', placeable):
+        checksum ^= word
+    return placeable + struct.pack('<H', checksum) + header + body
+
+def make_emf(rng, width=1200, height=400):
+    """An EMF with a rectangle and a polyline"""
+    points = [(rng.randint(0, width), rng.randint(0, height)) for _ in range(rng.randint(4, 24))]
+    bounds = struct.pack('<iiii', 0, 0, width, height)
+    records = [
+        struct.pack('<II', 43, 24) + struct.pack('<iiii', 10, 10, width - 10, height - 10),  # RECTANGLE
+        struct.pack('<II', 87, 28 + 4 * len(points)) + bounds + struct.pack('<I', len(points))
+        + b''.join(struct.pack('<hh', x, y) for x, y in points),  # POLYLINE16
+        struct.pack('<IIIII', 14, 20, 0, 16, 20),  # EOF
+    ]
+    total = 88 + sum(len(r) for r in records)
+    header = (struct.pack('<II', 1, 88) + bounds
+              + struct.pack('<iiii', 0, 0, width * 2540 // 96, height * 2540 // 96)
+              + struct.pack('<IIIIHHIIIiiii', 0x464D4520, 0x00010000, total, len(records) + 1, 1, 0, 0, 0, 0,
+                            1024, 768, 270, 203))
+    return header + b''.join(records)
+
+# --- DOCX --------------------------------------------------------------------
+
+NAMESPACES = (
+    'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships" '
+    'xmlns:wp="http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing" '
+    'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+    'xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture" '
+    'xmlns:m="http://schemas.openxmlformats.org/officeDocument/2006/math"'
+)
+
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Default Extension="wmf" ContentType="image/x-wmf"/>'
+    '<Default Extension="emf" ContentType="image/x-emf"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+
+PACKAGE_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+
+IMAGE_RELATIONSHIP = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/image'
+
+def _run(text):
+    return f'<w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r>'
+
+def _docx_paragraph(text, style=None):
+    props = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ''
+    return f'<w:p>{props}{_run(text)}</w:p>'
+
+def _docx_picture(index, rel_id, name):
+    cx, cy = 1143000, 381000  # 1.25 x 0.42 inches
+    return (
+        f'<w:r><w:drawing><wp:inline><wp:extent cx="{cx}" cy="{cy}"/><wp:docPr id="{index}" name="{name}"/>'
+        '<a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+        f'<pic:pic><pic:nvPicPr><pic:cNvPr id="{index}" name="{name}"/><pic:cNvPicPr/></pic:nvPicPr>'
+        f'<pic:blipFill><a:blip r:embed="{rel_id}"/><a:stretch><a:fillRect/></a:stretch></pic:blipFill>'
+        f'<pic:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm>'
+        '<a:prstGeom prst="rect"><a:avLst/></a:prstGeom></pic:spPr></pic:pic>'
+        '</a:graphicData></a:graphic></wp:inline></w:drawing></w:r>'
+    )
+
+def _omml(rng):
+    # A fraction in Office Math, which pandoc turns into TeX for MathJax
+    return (f'<m:oMath><m:f><m:num><m:r><m:t>{rng.randint(1, 99)}</m:t></m:r></m:num>'
+            f'<m:den><m:r><m:t>{rng.choice("xyzn")}</m:t></m:r></m:den></m:f></m:oMath>')
+
+def write_docx(path, blocks, pictures=(), rng=None):
+    """
+    Write a DOCX file.
+
+    Args:
+        blocks: Document blocks from _blocks()
+        pictures: (extension, bytes) per picture reference, in document order;
+            identical bytes share one media part, as Word stores them
+    """
+    body = []
+    for kind, payload in blocks:
+        if kind == 'heading':
+            body.append(_docx_paragraph(payload, 'Heading2'))
+        elif kind == 'list':
+            body.extend(_docx_paragraph(f'• {item}') for item in payload)
+        elif kind == 'table':
+            rows = ''.join('<w:tr>' + ''.join(f'<w:tc><w:p>{_run(cell)}</w:p></w:tc>' for cell in row) + '</w:tr>'
+                           for row in payload)
+            body.append(f'<w:tbl>{rows}</w:tbl>')
+        elif kind == 'math' and rng is not None:
+            body.append(f'<w:p>{_omml(rng)}</w:p>')
+        else:
+            body.append(_docx_paragraph(payload))
+
+    media, rels = {}, []
+    for index, (extension, data) in enumerate(pictures, start=1):
+        if data not in media:
+            media[data] = (f'rId{len(media) + 10}', f'media/image{len(media) + 1}.{extension}')
+            rels.append(f'<Relationship Id="{media[data][0]}" Type="{IMAGE_RELATIONSHIP}" Target="{media[data][1]}"/>')
+        rel_id, target = media[data]
+        body.append(f'<w:p>{_run(f"Equation ({index}): ")}{_docx_picture(index, rel_id, os.path.basename(target))}</w:p>')
+
+    document = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><w:document {NAMESPACES}><w:body>'
+                + ''.join(body) + '<w:sectPr/></w:body></w:document>')
+    document_rels = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                     '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                     + ''.join(rels) + '</Relationships>')
+
+    # Fixed timestamps keep the archive bytes reproducible
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in [('[Content_Types].xml', CONTENT_TYPES), ('_rels/.rels', PACKAGE_RELS),
+                           ('word/document.xml', document), ('word/_rels/document.xml.rels', document_rels)]:
+            archive.writestr(zipfile.ZipInfo(name, (2024, 1, 1, 0, 0, 0)), data)
+        for data, (_, target) in media.items():
+            archive.writestr(zipfile.ZipInfo(f'word/{target}', (2024, 1, 1, 0, 0, 0)), data)
+
+# --- Raster images -----------------------------------------------------------
+
+def write_image(path, size, rng):
+    """A gradient with random shapes: compresses like a photo-ish graphic, not like a flat fill"""
+    from PIL import Image, ImageDraw
+
+    width, height = size
+    gradient = Image.linear_gradient('L').resize(size)
+    img = Image.merge('RGB', (gradient, gradient.rotate(90).resize(size), gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(max(20, width * height // 20000)):
+        x, y = rng.randrange(width), rng.randrange(height)
+        r = rng.randint(4, max(5, width // 12))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rng.randrange(256) for _ in range(3)))
+    if path.endswith('.jpg'):
+        img.save(path, 'JPEG', quality=90)
+    else:
+        img.save(path, 'PNG')
+
+# --- Entry point -------------------------------------------------------------
+
+def generate(out_dir, sizes=None, images=True):
+    """
+    Build the corpus in out_dir; files that already exist are kept.
+
+    Returns:
+        dict: Manifest mapping corpus names to file info
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {}
+
+    def add(name, filename, **info):
+        path = os.path.join(out_dir, filename)
+        manifest[name] = dict(info, file=filename, bytes=os.path.getsize(path))
+
+    for size, count in DOCUMENT_SIZES.items():
+        if sizes and size not in sizes:
+            continue
+        blocks = list(_blocks(random.Random(f'{SEED}-{size}'), count))
+        for fmt, writer in (('md', write_markdown), ('html', write_html)):
+            filename = f'{size}.{fmt}'
+            path = os.path.join(out_dir, filename)
+            if not os.path.exists(path):
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(writer(blocks))
+            add(f'{fmt}-{size}', filename, format='markdown' if fmt == 'md' else 'html', size=size)
+
+        filename = f'{size}.docx'
+        if not os.path.exists(os.path.join(out_dir, filename)):
+            write_docx(os.path.join(out_dir, filename), blocks, rng=random.Random(f'{SEED}-{size}-math'))
+        add(f'docx-{size}', filename, format='docx', size=size)
+
+    for name, (equations, distinct) in EQUATION_DOCUMENTS.items():
+        filename = f'{name}.docx'
+        if not os.path.exists(os.path.join(out_dir, filename)):
+            rng = random.Random(f'{SEED}-{name}')
+            # Alternate WMF and EMF; equations reuse pictures like repeated symbols do in real documents
+            distinct_pictures = [('wmf', make_wmf(rng)) if i % 3 else ('emf', make_emf(rng)) for i in range(distinct)]
+            pictures = [distinct_pictures[i % distinct] for i in range(equations)]
+            write_docx(os.path.join(out_dir, filename), list(_blocks(rng, equations // 2)), pictures, rng)
+        add(f'docx-{name}', filename, format='docx', equations=equations, distinct_pictures=distinct)
+
+    for ext in ('wmf', 'emf'):
+        filename = f'equation.{ext}'
+        path = os.path.join(out_dir, filename)
+        if not os.path.exists(path):
+            rng = random.Random(f'{SEED}-{ext}')
+            with open(path, 'wb') as f:
+                f.write(make_wmf(rng) if ext == 'wmf' else make_emf(rng))
+        add(f'image-{ext}', filename, format=ext)
+
+    if images:
+        for size, dimensions in IMAGE_SIZES.items():
+            for ext in ('png', 'jpg'):
+                filename = f'{size}.{ext}'
+                path = os.path.join(out_dir, filename)
+                if not os.path.exists(path):
+                    write_image(path, dimensions, random.Random(f'{SEED}-{size}-{ext}'))
+                add(f'image-{size}-{ext}', filename, format=ext, size=size, pixels=dimensions)
+
+    with open(os.path.join(out_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate the benchmark corpus')
+    parser.add_argument('--out', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus'),
+                        help='Output directory (default: benchmarks/corpus)')
+    parser.add_argument('--sizes', nargs='*', choices=sorted(DOCUMENT_SIZES),
+                        help='Document sizes to build (default: all)')
+    parser.add_argument('--no-images', action='store_true', help='Skip raster images (no Pillow needed)')
+    args = parser.parse_args(argv)
+
+    manifest = generate(args.out, args.sizes, images=not args.no_images)
+    for name, info in sorted(manifest.items()):
+        print(f"{name:24} {info['bytes']:>12,} bytes  {info['file']}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
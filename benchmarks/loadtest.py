@@ -0,0 +1,459 @@
+"""
+Load-test a running converter with a mix of concurrent requests.
+
+    gunicorn -c gunicorn.conf.py wsgi:app &
+    python benchmarks/loadtest.py --url http://127.0.0.1:5000 --concurrency 1,2,4,8,16 \\
+        --duration 30 --server-pid $(pgrep -o gunicorn)
+
+For each concurrency level, that many client threads send requests back to
+back for --duration seconds, each picking a request from the traffic mix by
+weight. The default mix (see DEFAULT_MIX) covers /convert with file, text
+and base64 input and /convert/image; --mix selects a subset with new weights
+(e.g. `text=4,file=3,image=1`) and --mix-file loads a JSON list of entries
+in the same shape as DEFAULT_MIX. Inputs come from the benchmark corpus
+(corpus.py), which is generated if missing.
+
+Reported per level: throughput, latency percentiles overall and per request
+type, error and 503 (server busy) rates. While the test runs, a sampler
+records every --sample-interval seconds:
+
+- with --server-pid (same machine, Linux): CPU use and RSS of that process
+  and all its descendants (gunicorn workers, pandoc and ImageMagick
+  processes), and how many tool processes are running;
+- from /api/load: running and queued tool slots and pending jobs of the
+  worker that answered.
+
+Results, including the raw timeline, are written as JSON for plotting. A
+short summary at the end points out where throughput stopped growing and
+where p95 latency took off.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+from urllib.parse import urlsplit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORPUS = os.path.join(BENCH_DIR, 'corpus')
+DEFAULT_RESULTS = os.path.join(BENCH_DIR, 'results')
+
+# weight, request type, corpus input and conversion parameters
+DEFAULT_MIX = [
+    {'weight': 3, 'type': 'text', 'input': 'md-small', 'from_format': 'markdown', 'to_format': 'html'},
+    {'weight': 1, 'type': 'text', 'input': 'md-tiny', 'from_format': 'markdown', 'to_format': 'html'},
+    {'weight': 2, 'type': 'file', 'input': 'docx-small', 'from_format': 'docx', 'to_format': 'html'},
+    {'weight': 1, 'type': 'file', 'input': 'md-medium', 'from_format': 'markdown', 'to_format': 'docx'},
+    {'weight': 1, 'type': 'file', 'input': 'html-small', 'from_format': 'html', 'to_format': 'markdown'},
+    {'weight': 1, 'type': 'file', 'input': 'docx-eq20', 'from_format': 'docx', 'to_format': 'html'},
+    {'weight': 1, 'type': 'base64', 'input': 'docx-small', 'from_format': 'docx', 'to_format': 'markdown'},
+    {'weight': 2, 'type': 'image', 'input': 'image-medium-png', 'to_format': 'jpg'},
+    {'weight': 1, 'type': 'image', 'input': 'image-small-jpg', 'to_format': 'png', 'resize': '50%'},
+    {'weight': 1, 'type': 'image', 'input': 'image-wmf', 'to_format': 'png'},
+]
+
+TOOL_NAMES = {'pandoc', 'convert', 'magick', 'rsvg-convert', 'wmf2svg'}
+
+def percentile(values, q):
+    """Linearly interpolated percentile (q in 0-100) of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+# --- Requests ----------------------------------------------------------------
+
+def _multipart(fields, files):
+    """Encode a multipart/form-data body; files maps field name to (filename, bytes)"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8'))
+    for name, (filename, data) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode('utf-8') + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+def build_request(entry, corpus, manifest, use_cache):
+    """
+    Pre-encode the HTTP request for a mix entry, so the client spends no time on it during the test.
+
+    Returns:
+        tuple: (path, body bytes, content type)
+    """
+    info = manifest[entry['input']]
+    with open(os.path.join(corpus, info['file']), 'rb') as f:
+        data = f.read()
+    filename = info['file']
+    fields = {'cache': 'true' if use_cache else 'false', 'to_format': entry['to_format']}
+    if entry['type'] == 'image':
+        for key in ('quality', 'resize', 'engine'):
+            if entry.get(key):
+                fields[key] = entry[key]
+        body, content_type = _multipart(fields, {'image': (filename, data)})
+        return '/convert/image', body, content_type
+
+    fields.update(conversion_type=entry['type'], from_format=entry['from_format'])
+    if entry.get('options'):
+        fields['options'] = entry['options']
+    if entry['type'] == 'file':
+        body, content_type = _multipart(fields, {'file': (filename, data)})
+    else:
+        # text and base64 go as JSON, like API clients send them
+        if entry['type'] == 'text':
+            fields['text'] = data.decode('utf-8')
+        else:
+            import base64
+            fields['base64_data'] = base64.b64encode(data).decode('ascii')
+        body, content_type = json.dumps(fields).encode('utf-8'), 'application/json'
+    return '/convert', body, content_type
+
+class Client:
+    """One keep-alive HTTP connection, reopened after errors"""
+
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        self.https = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.https else 80)
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.conn = None
+
+    def request(self, method, path, body=None, content_type=None):
+        """Return (status, response bytes); raises OSError/HTTPException on connection problems"""
+        if self.conn is None:
+            cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            self.conn = cls(self.host, self.port, timeout=self.timeout)
+        headers = {'Content-Type': content_type} if content_type else {}
+        try:
+            self.conn.request(method, self.prefix + path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            payload = response.read()
+            if response.getheader('Connection', '').lower() == 'close':
+                self.close()
+            return response.status, payload
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+# --- Server sampling ---------------------------------------------------------
+
+def _read_proc(pid):
+    """Return (ppid, comm, cpu ticks incl. reaped children, rss bytes) for a pid, or None"""
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as f:
+            stat = f.read().decode('utf-8', 'replace')
+        with open(f'/proc/{pid}/statm', 'rb') as f:
+            resident = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    # comm may contain spaces; fields after it are space separated
+    comm = stat[stat.index('(') + 1:stat.rindex(')')]
+    fields = stat[stat.rindex(')') + 2:].split()
+    ppid = int(fields[1])
+    ticks = sum(int(value) for value in fields[11:15])  # utime, stime, cutime, cstime
+    return ppid, comm, ticks, resident * os.sysconf('SC_PAGE_SIZE')
+
+def process_tree(root_pid):
+    """Snapshot of root_pid and its descendants: {pid: (comm, cpu ticks, rss bytes)}"""
+    processes = {}
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            info = _read_proc(int(name))
+            if info:
+                processes[int(name)] = info
+    tree, frontier = {}, [root_pid]
+    while frontier:
+        pid = frontier.pop()
+        if pid not in processes or pid in tree:
+            continue
+        ppid, comm, ticks, rss = processes[pid]
+        tree[pid] = (comm, ticks, rss)
+        frontier.extend(child for child, info in processes.items() if info[0] == pid)
+    return tree
+
+class Sampler(threading.Thread):
+    """Records server resource use and limiter state until stopped"""
+
+    def __init__(self, url, server_pid, interval, timeout):
+        super().__init__(name='loadtest-sampler', daemon=True)
+        self.client = Client(url, timeout)
+        self.server_pid = server_pid
+        self.interval = interval
+        self.samples = []
+        self.level = None
+        self._done = threading.Event()
+        self._ticks = {}
+        self._sampled = None
+        self._hz = os.sysconf('SC_CLK_TCK') if server_pid else None
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+    def _server_usage(self):
+        tree = process_tree(self.server_pid)
+        if not tree:
+            return {'server_alive': False}
+        # CPU since the previous sample. A child that exited in between shows up again in its
+        # parent's cutime/cstime once reaped, so the part of it already counted is taken off.
+        now = time.monotonic()
+        ticks = {pid: total for pid, (_, total, _) in tree.items()}
+        cpu_ticks = sum(total - self._ticks.get(pid, 0) for pid, total in ticks.items())
+        cpu_ticks -= sum(total for pid, total in self._ticks.items() if pid not in ticks)
+        elapsed = now - self._sampled if self._sampled else None
+        self._ticks, self._sampled = ticks, now
+        if not elapsed:
+            return {'server_alive': True}
+        return {
+            'server_alive': True,
+            'cpu_percent': round(max(cpu_ticks, 0) / self._hz / elapsed * 100, 1),
+            'rss_mb': round(sum(rss for _, _, rss in tree.values()) / (1024 * 1024), 1),
+            'processes': len(tree),
+            'tool_processes': sum(1 for comm, _, _ in tree.values() if comm in TOOL_NAMES),
+        }
+
+    def run(self):
+        if self.server_pid:
+            self._server_usage()  # baseline for CPU deltas
+        while not self._done.wait(self.interval):
+            sample = {'t': time.time(), 'level': self.level}
+            if self.server_pid:
+                sample.update(self._server_usage())
+            try:
+                status, payload = self.client.request('GET', '/api/load')
+                load = json.loads(payload) if status == 200 else {}
+                for tool, stats in load.get('tools', {}).items():
+                    sample[f'{tool}_active'] = stats.get('active')
+                    sample[f'{tool}_queued'] = stats.get('queued')
+                sample['jobs_pending'] = load.get('jobs', {}).get('pending')
+            except (OSError, ValueError, http.client.HTTPException):
+                sample['load_error'] = True
+            self.samples.append(sample)
+
+# --- Load generation ---------------------------------------------------------
+
+def run_level(url, concurrency, duration, requests, weights, timeout, think_time, seed):
+    """
+    Drive one concurrency level.
+
+    Returns:
+        list: One record per request: (type, start time, latency seconds, status or None, error)
+    """
+    records = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(index):
+        rng = random.Random(f'{seed}-{concurrency}-{index}')
+        client = Client(url, timeout)
+        try:
+            while time.monotonic() < deadline:
+                entry, (path, body, content_type) = rng.choices(requests, weights)[0]
+                started = time.time()
+                t0 = time.monotonic()
+                status, error = None, None
+                try:
+                    status, payload = client.request('POST', path, body, content_type)
+                    if status >= 400:
+                        error = payload[:200].decode('utf-8', 'replace')
+                except (OSError, http.client.HTTPException) as e:
+                    error = f'{type(e).__name__}: {e}'
+                with lock:
+                    records.append((entry['type'], started, time.monotonic() - t0, status, error))
+                if think_time:
+                    time.sleep(rng.expovariate(1 / think_time))
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=worker, args=(i,), name=f'loadtest-{i}') for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return records
+
+def summarize(records, elapsed):
+    """Latency distribution and error rates of one level, overall and per request type"""
+    def stats(rows):
+        latencies = [row[2] for row in rows]
+        ok = [row[2] for row in rows if row[3] is not None and row[3] < 400]
+        busy = sum(1 for row in rows if row[3] == 503)
+        errors = sum(1 for row in rows if row[3] is None or row[3] >= 400)
+        return {
+            'requests': len(rows),
+            'throughput_rps': round(len(ok) / elapsed, 3) if elapsed else None,
+            'error_rate': round(errors / len(rows), 4) if rows else 0.0,
+            'busy_rate': round(busy / len(rows), 4) if rows else 0.0,
+            'p50': percentile(ok, 50),
+            'p90': percentile(ok, 90),
+            'p95': percentile(ok, 95),
+            'p99': percentile(ok, 99),
+            'max': max(latencies) if latencies else None,
+        }
+
+    summary = stats(records)
+    summary['by_type'] = {kind: stats([row for row in records if row[0] == kind])
+                          for kind in sorted({row[0] for row in records})}
+    errors = {}
+    for row in records:
+        if row[4]:
+            key = f'{row[3] or "connection"}: {row[4][:80]}'
+            errors[key] = errors.get(key, 0) + 1
+    summary['errors'] = dict(sorted(errors.items(), key=lambda item: -item[1])[:10])
+    return summary
+
+def _resources(samples, level):
+    rows = [s for s in samples if s.get('level') == level]
+    result = {}
+    for key in ('cpu_percent', 'rss_mb', 'tool_processes', 'pandoc_queued', 'imagemagick_queued'):
+        values = [s[key] for s in rows if s.get(key) is not None]
+        if values:
+            result[f'{key}_avg'] = round(sum(values) / len(values), 1)
+            result[f'{key}_max'] = max(values)
+    return result
+
+def _ms(seconds):
+    return f'{seconds * 1000:8.0f}' if seconds is not None else '       -'
+
+def print_report(levels):
+    print(f"{'conc':>5} {'reqs':>6} {'rps':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'err %':>6} {'503 %':>6}"
+          f" {'cpu %':>6} {'rss MB':>7} {'tools':>5} {'queued':>6}")
+    for level in levels:
+        s, r = level['summary'], level['resources']
+        queued = max(r.get('pandoc_queued_max', 0), r.get('imagemagick_queued_max', 0))
+        print(f"{level['concurrency']:5} {s['requests']:6} {s['throughput_rps'] or 0:7.2f} {_ms(s['p50'])} {_ms(s['p95'])}"
+              f" {_ms(s['p99'])} {s['error_rate'] * 100:6.1f} {s['busy_rate'] * 100:6.1f}"
+              f" {r.get('cpu_percent_avg', float('nan')):6.0f} {r.get('rss_mb_max', float('nan')):7.0f}"
+              f" {r.get('tool_processes_max', '-'):>5} {queued:6}")
+
+    # Where adding clients stopped paying off
+    for previous, current in zip(levels, levels[1:]):
+        before, after = previous['summary'], current['summary']
+        if before['throughput_rps'] and after['throughput_rps'] is not None \
+                and after['throughput_rps'] < before['throughput_rps'] * 1.05:
+            print(f"Throughput plateaus at concurrency {previous['concurrency']} "
+                  f"(~{before['throughput_rps']:.2f} req/s); more clients only add latency")
+            break
+    first = levels[0]['summary']['p95'] if levels else None
+    for level in levels[1:]:
+        if first and level['summary']['p95'] and level['summary']['p95'] > 3 * first:
+            print(f"p95 latency exceeds 3x its single-client value from concurrency {level['concurrency']}")
+            break
+
+def _parse_mix(text, mix):
+    weights = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        weights[kind.strip()] = float(weight or 1)
+    unknown = set(weights) - {entry['type'] for entry in mix}
+    if unknown:
+        raise SystemExit(f"Unknown request types in --mix: {', '.join(sorted(unknown))}")
+    # Keep the relative weights of the entries within each type
+    selected = []
+    for kind, weight in weights.items():
+        entries = [entry for entry in mix if entry['type'] == kind]
+        total = sum(entry['weight'] for entry in entries)
+        selected += [dict(entry, weight=weight * entry['weight'] / total) for entry in entries if weight > 0]
+    return selected
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load-test a running document converter')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='Base URL of the server')
+    parser.add_argument('--concurrency', default='1,2,4,8,16', help='Comma-separated client counts (default: 1,2,4,8,16)')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds per concurrency level (default: 30)')
+    parser.add_argument('--mix', help='Request types and weights, e.g. text=4,file=3,base64=1,image=2')
+    parser.add_argument('--mix-file', help='JSON list of mix entries (see DEFAULT_MIX)')
+    parser.add_argument('--cache', action='store_true', help='Allow cached results (default: cache=false)')
+    parser.add_argument('--think-time', type=float, default=0, help='Mean pause between a client\'s requests (s)')
+    parser.add_argument('--server-pid', type=int, help='Server (gunicorn master) pid to sample CPU/RSS from /proc')
+    parser.add_argument('--sample-interval', type=float, default=1.0)
+    parser.add_argument('--cooldown', type=float, default=5, help='Idle seconds between levels (default: 5)')
+    parser.add_argument('--timeout', type=float, default=600, help='Per-request timeout in seconds')
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Result file (default: benchmarks/results/load-<timestamp>.json)')
+    args = parser.parse_args(argv)
+
+    mix = DEFAULT_MIX
+    if args.mix_file:
+        with open(args.mix_file, encoding='utf-8') as f:
+            mix = json.load(f)
+    if args.mix:
+        mix = _parse_mix(args.mix, mix)
+    if args.server_pid and not os.path.exists(f'/proc/{args.server_pid}'):
+        raise SystemExit(f'No process {args.server_pid} in /proc (server sampling needs Linux and the same host)')
+
+    sys.path.insert(0, BENCH_DIR)
+    from corpus import DOCUMENT_SIZES, generate
+    sizes = {entry['input'].rsplit('-', 1)[-1] for entry in mix} & set(DOCUMENT_SIZES)
+    manifest = generate(args.corpus, sizes=sizes, images=any(entry['type'] == 'image' for entry in mix))
+    missing = sorted({entry['input'] for entry in mix} - set(manifest))
+    if missing:
+        raise SystemExit(f"Unknown corpus inputs in the mix: {', '.join(missing)}")
+    requests = [(entry, build_request(entry, args.corpus, manifest, args.cache)) for entry in mix]
+    weights = [entry['weight'] for entry in mix]
+
+    status, _ = Client(args.url, 10).request('GET', '/api/load')
+    if status != 200:
+        raise SystemExit(f'{args.url}/api/load answered {status}; is the converter running?')
+
+    sampler = Sampler(args.url, args.server_pid, args.sample_interval, args.timeout)
+    sampler.start()
+    levels = []
+    try:
+        for concurrency in [int(value) for value in args.concurrency.split(',')]:
+            print(f'concurrency {concurrency}: {args.duration:.0f}s', flush=True)
+            sampler.level = concurrency
+            started = time.monotonic()
+            records = run_level(args.url, concurrency, args.duration, requests, weights,
+                                args.timeout, args.think_time, args.seed)
+            elapsed = time.monotonic() - started
+            sampler.level = None
+            levels.append({
+                'concurrency': concurrency,
+                'elapsed': elapsed,
+                'summary': summarize(records, elapsed),
+                'resources': _resources(sampler.samples, concurrency),
+                'requests': [{'type': r[0], 't': r[1], 'latency': r[2], 'status': r[3]} for r in records],
+            })
+            if args.cooldown:
+                time.sleep(args.cooldown)
+    finally:
+        sampler.stop()
+
+    report = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'url': args.url,
+        'settings': {key: value for key, value in vars(args).items() if key != 'output'},
+        'mix': mix,
+        'levels': levels,
+        'timeline': sampler.samples,
+    }
+    output = args.output or os.path.join(DEFAULT_RESULTS, f"load-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+
+    print()
+    print_report(levels)
+    print(f'\nResults written to {output}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,438 @@
+"""
+Benchmark the conversion functions and routes.
+
+    python benchmarks/run.py                          # everything, results in benchmarks/results/
+    python benchmarks/run.py --quick                  # tiny/small inputs, 3 iterations
+    python benchmarks/run.py --filter docx-eq --mode direct
+    python benchmarks/run.py --baseline benchmarks/results/before.json --threshold 0.1
+    python benchmarks/run.py compare before.json after.json
+
+Each scenario converts one corpus file (see corpus.py, generated on first
+run) either by calling process_*_conversion directly or by posting it to the
+app through the Flask test client. Scenarios run one at a time, each in a
+fresh Python process, so peak RSS is measured per scenario: `peak_rss_mb` is
+the benchmark process itself and `tool_peak_rss_mb` the largest pandoc or
+ImageMagick child (as reported by the kernel, a child never looks smaller
+than the benchmark process it was forked from). The result cache is off
+unless --cache is given, and history, jobs and the cache live in a
+temporary directory.
+
+Results are written as JSON. Given a baseline, the run exits with status 1
+if any scenario's latency (--metric, p50 by default) or peak RSS grew by
+more than --threshold.
+"""
+import argparse
+import base64
+import io
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+DEFAULT_CORPUS = os.path.join(BENCH_DIR, 'corpus')
+DEFAULT_RESULTS = os.path.join(BENCH_DIR, 'results')
+
+SIZES = ('tiny', 'small', 'medium', 'large')
+QUICK_SIZES = ('tiny', 'small')
+
+def _scenarios():
+    """
+    Every benchmark scenario.
+
+    Returns:
+        list: dicts with name, kind (text, file, base64, image), input (corpus name),
+        from_format, to_format and optional image settings
+    """
+    scenarios = []
+    for size in SIZES:
+        scenarios += [
+            {'kind': 'text', 'input': f'md-{size}', 'from_format': 'markdown', 'to_format': 'html', 'size': size},
+            {'kind': 'file', 'input': f'md-{size}', 'from_format': 'markdown', 'to_format': 'docx', 'size': size},
+            {'kind': 'file', 'input': f'html-{size}', 'from_format': 'html', 'to_format': 'markdown', 'size': size},
+            {'kind': 'file', 'input': f'docx-{size}', 'from_format': 'docx', 'to_format': 'html', 'size': size},
+            {'kind': 'file', 'input': f'docx-{size}', 'from_format': 'docx', 'to_format': 'markdown', 'size': size},
+        ]
+    scenarios += [
+        {'kind': 'base64', 'input': 'docx-small', 'from_format': 'docx', 'to_format': 'markdown', 'size': 'small'},
+        {'kind': 'file', 'input': 'docx-eq20', 'from_format': 'docx', 'to_format': 'html', 'size': 'small'},
+        {'kind': 'file', 'input': 'docx-eq200', 'from_format': 'docx', 'to_format': 'html', 'size': 'medium'},
+        {'kind': 'image', 'input': 'image-wmf', 'to_format': 'png', 'size': 'tiny'},
+        {'kind': 'image', 'input': 'image-emf', 'to_format': 'png', 'size': 'tiny'},
+    ]
+    for size in ('small', 'medium', 'large'):
+        scenarios += [
+            {'kind': 'image', 'input': f'image-{size}-png', 'to_format': 'jpg', 'size': size},
+            {'kind': 'image', 'input': f'image-{size}-png', 'to_format': 'jpg', 'engine': 'imagemagick', 'size': size},
+            {'kind': 'image', 'input': f'image-{size}-jpg', 'to_format': 'webp', 'resize': '50%', 'size': size},
+        ]
+    for scenario in scenarios:
+        name = f"{scenario['kind']} {scenario['input']} -> {scenario['to_format']}"
+        if scenario.get('resize'):
+            name += f" resize={scenario['resize']}"
+        if scenario.get('engine'):
+            name += f" engine={scenario['engine']}"
+        scenario['name'] = name
+    return scenarios
+
+def percentile(values, q):
+    """Linearly interpolated percentile (q in 0-100) of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+def _max_rss_mb(who):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(who).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+# --- Worker: runs one scenario in its own process ----------------------------
+
+class _Quiet:
+    """Send stdout/stderr of this process and its children to /dev/null (conversions print a lot)"""
+
+    def __enter__(self):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self._saved = [os.dup(1), os.dup(2)]
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        os.close(devnull)
+        return self
+
+    def __exit__(self, *exc):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for fd, saved in zip((1, 2), self._saved):
+            os.dup2(saved, fd)
+            os.close(saved)
+
+def _direct_call(scenario, path, data, use_cache):
+    """Build a function converting the scenario's input with process_*_conversion"""
+    from src.utils.conversion import (
+        process_text_conversion, process_file_conversion, process_base64_conversion, process_image_conversion
+    )
+    from src.utils.workspace import create_workspace
+
+    kind = scenario['kind']
+    if kind == 'text':
+        text = data.decode('utf-8')
+        return lambda: process_text_conversion(text, scenario['from_format'], scenario['to_format'], '',
+                                               use_cache=use_cache)
+    if kind == 'base64':
+        encoded = base64.b64encode(data).decode('ascii')
+        return lambda: process_base64_conversion(encoded, scenario['from_format'], scenario['to_format'], '',
+                                                 use_cache=use_cache)
+
+    def run():
+        # Each call gets its own workspace, like a request; copying the input is part of the measurement
+        workspace = create_workspace()
+        try:
+            target = os.path.join(workspace, os.path.basename(path))
+            shutil.copyfile(path, target)
+            if kind == 'image':
+                return process_image_conversion(target, scenario['to_format'], resize=scenario.get('resize'),
+                                                engine=scenario.get('engine'))
+            return process_file_conversion(target, scenario['from_format'], scenario['to_format'], '',
+                                           use_cache=use_cache)
+        finally:
+            shutil.rmtree(workspace, ignore_errors=True)
+    return run
+
+def _client_call(scenario, path, data, use_cache):
+    """Build a function posting the scenario's input through the Flask test client"""
+    from app import create_app
+    from src.utils.responses import output_path_for
+
+    client = create_app().test_client()
+    filename = os.path.basename(path)
+    kind = scenario['kind']
+    fields = {'from_format': scenario.get('from_format'), 'to_format': scenario['to_format'],
+              'cache': 'true' if use_cache else 'false'}
+
+    def run():
+        if kind == 'image':
+            form = {'image': (io.BytesIO(data), filename), 'to_format': scenario['to_format']}
+            for key in ('resize', 'engine'):
+                if scenario.get(key):
+                    form[key] = scenario[key]
+            response = client.post('/convert/image', data=form, content_type='multipart/form-data')
+        elif kind == 'file':
+            form = dict(fields, conversion_type='file', file=(io.BytesIO(data), filename))
+            response = client.post('/convert', data=form, content_type='multipart/form-data')
+        elif kind == 'text':
+            response = client.post('/convert', data=dict(fields, conversion_type='text', text=data.decode('utf-8')))
+        else:
+            response = client.post('/convert', data=dict(fields, conversion_type='base64',
+                                                         base64_data=base64.b64encode(data).decode('ascii')))
+        result = response.get_json(silent=True) or {}
+        if response.status_code != 200:
+            result.setdefault('error', f'HTTP {response.status_code}')
+        if result.get('downloadUrl'):
+            output = output_path_for(result['downloadUrl'])
+            if output:
+                shutil.rmtree(os.path.dirname(output), ignore_errors=True)
+        return result
+    return run
+
+def run_worker(spec, result_path):
+    """Run one scenario and write its measurements to result_path"""
+    sys.path.insert(0, REPO_ROOT)
+    scenario, settings = spec['scenario'], spec['settings']
+    with open(os.path.join(settings['corpus'], 'manifest.json'), encoding='utf-8') as f:
+        info = json.load(f)[scenario['input']]
+    path = os.path.join(settings['corpus'], info['file'])
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    with _Quiet():
+        started = time.perf_counter()
+        build = _client_call if spec['mode'] == 'client' else _direct_call
+        call = build(scenario, path, data, settings['cache'])
+        import_seconds = time.perf_counter() - started
+        rss_before = _max_rss_mb(resource.RUSAGE_SELF)
+
+        errors, last_error, latencies = 0, None, []
+        for iteration in range(settings['warmup'] + settings['iterations']):
+            started = time.perf_counter()
+            try:
+                result = call()
+            except Exception as e:
+                result = {'error': f'{type(e).__name__}: {e}'}
+            elapsed = time.perf_counter() - started
+            if iteration < settings['warmup']:
+                continue
+            latencies.append(elapsed)
+            if not result.get('success'):
+                errors += 1
+                last_error = str(result.get('error'))[:300]
+
+    total = sum(latencies)
+    measurement = {
+        'mode': spec['mode'],
+        'kind': scenario['kind'],
+        'input': scenario['input'],
+        'input_bytes': len(data),
+        'iterations': len(latencies),
+        'errors': errors,
+        'last_error': last_error,
+        'mean': total / len(latencies) if latencies else None,
+        'min': min(latencies) if latencies else None,
+        'max': max(latencies) if latencies else None,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'throughput_per_s': len(latencies) / total if total else None,
+        'input_mb_per_s': len(data) * len(latencies) / total / (1024 * 1024) if total else None,
+        'setup_seconds': import_seconds,
+        'rss_after_setup_mb': rss_before,
+        'peak_rss_mb': _max_rss_mb(resource.RUSAGE_SELF),
+        'tool_peak_rss_mb': _max_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+    with open(result_path, 'w', encoding='utf-8') as f:
+        json.dump(measurement, f)
+
+# --- Runner ------------------------------------------------------------------
+
+def _tool_version(cmd):
+    try:
+        output = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=10).stdout
+        return output.decode('utf-8', 'replace').splitlines()[0].strip()
+    except (OSError, IndexError, subprocess.SubprocessError):
+        return None
+
+def _environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL).stdout.decode().strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'pandoc': _tool_version(['pandoc', '--version']),
+        'imagemagick': _tool_version(['convert', '-version']),
+    }
+
+def run_scenario(mode, scenario, settings):
+    """Run one scenario in a child process and return its measurements"""
+    env = dict(os.environ)
+    scratch = tempfile.mkdtemp(prefix='docconv-bench-')
+    # Keep the repo's cache, history and jobs untouched and the janitor out of the measurements
+    env.update({
+        'CACHE_FOLDER': os.path.join(scratch, 'cache'),
+        'HISTORY_FOLDER': os.path.join(scratch, 'history'),
+        'JOBS_FOLDER': os.path.join(scratch, 'jobs'),
+        'JANITOR_INTERVAL': '0',
+        'CACHE_ENABLED': '1' if settings['cache'] else '0',
+        'PROFILE_SLOW_REQUESTS': '0',
+    })
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    result_path = os.path.join(scratch, 'result.json')
+    spec = json.dumps({'mode': mode, 'scenario': scenario, 'settings': settings})
+    try:
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', spec, '--result', result_path],
+                                   env=env, cwd=REPO_ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   timeout=settings['timeout'])
+        if completed.returncode != 0 or not os.path.exists(result_path):
+            return {'mode': mode, 'error': completed.stderr.decode('utf-8', 'replace')[-1000:]}
+        with open(result_path, encoding='utf-8') as f:
+            return json.load(f)
+    except subprocess.TimeoutExpired:
+        return {'mode': mode, 'error': f"Timed out after {settings['timeout']}s"}
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+def _fmt_ms(seconds):
+    return f'{seconds * 1000:9.1f}' if seconds is not None else '        -'
+
+def print_table(results):
+    print(f"{'scenario':58} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ops/s':>8} {'MB/s':>8} {'rss MB':>7} {'tool MB':>7} err")
+    for name, r in results.items():
+        if 'p50' not in r:
+            print(f"{name:58} failed: {r.get('error', '').strip().splitlines()[-1:]}")
+            continue
+        print(f"{name:58} {_fmt_ms(r['p50'])} {_fmt_ms(r['p95'])} {_fmt_ms(r['p99'])} "
+              f"{r['throughput_per_s'] or 0:8.2f} {r['input_mb_per_s'] or 0:8.2f} "
+              f"{r['peak_rss_mb']:7.1f} {r['tool_peak_rss_mb']:7.1f} {r['errors']}")
+
+def compare(baseline, current, metric='p50', threshold=0.1, rss_threshold=None):
+    """
+    Compare two result files.
+
+    A scenario regresses when its latency metric or peak RSS grew by more
+    than the threshold (a fraction, 0.1 = 10%) relative to the baseline.
+
+    Returns:
+        list: Names of the regressed scenarios
+    """
+    rss_threshold = threshold if rss_threshold is None else rss_threshold
+    if baseline.get('environment', {}).get('platform') != current.get('environment', {}).get('platform'):
+        print('Warning: baseline was recorded on a different platform; differences may not mean much')
+
+    regressions = []
+    print(f"{'scenario':58} {'base ms':>9} {'now ms':>9} {'change':>8} {'base MB':>8} {'now MB':>8}")
+    for name, now in current['scenarios'].items():
+        base = baseline['scenarios'].get(name)
+        if not base or base.get(metric) is None or now.get(metric) is None:
+            print(f'{name:58} (no baseline)')
+            continue
+        change = now[metric] / base[metric] - 1 if base[metric] else 0.0
+        rss_change = now['peak_rss_mb'] / base['peak_rss_mb'] - 1 if base.get('peak_rss_mb') else 0.0
+        flags = []
+        if change > threshold:
+            flags.append('SLOWER')
+        if rss_change > rss_threshold:
+            flags.append('MORE MEMORY')
+        if flags:
+            regressions.append(name)
+        print(f"{name:58} {_fmt_ms(base[metric])} {_fmt_ms(now[metric])} {change:+8.1%} "
+              f"{base['peak_rss_mb']:8.1f} {now['peak_rss_mb']:8.1f} {' '.join(flags)}")
+    for name in baseline['scenarios']:
+        if name not in current['scenarios']:
+            print(f'{name:58} (not run)')
+    return regressions
+
+def _load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['compare']:
+        parser = argparse.ArgumentParser(prog='run.py compare', description='Compare two benchmark result files')
+        parser.add_argument('baseline')
+        parser.add_argument('current')
+        parser.add_argument('--metric', default='p50', choices=('mean', 'p50', 'p95', 'p99'))
+        parser.add_argument('--threshold', type=float, default=0.1)
+        parser.add_argument('--rss-threshold', type=float)
+        args = parser.parse_args(argv[1:])
+        regressions = compare(_load(args.baseline), _load(args.current), args.metric, args.threshold, args.rss_threshold)
+        print(f'{len(regressions)} regression(s)')
+        return 1 if regressions else 0
+
+    parser = argparse.ArgumentParser(description='Benchmark conversions')
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS, help='Corpus directory (generated if missing)')
+    parser.add_argument('--mode', choices=('direct', 'client', 'both'), default='both')
+    parser.add_argument('--filter', action='append', default=[],
+                        help='Only scenarios whose name contains this text (repeatable)')
+    parser.add_argument('--quick', action='store_true', help='Tiny and small inputs only, 3 iterations')
+    parser.add_argument('--iterations', type=int, help='Measured iterations per scenario (default: 5, quick: 3)')
+    parser.add_argument('--warmup', type=int, default=1, help='Unmeasured iterations first (default: 1)')
+    parser.add_argument('--cache', action='store_true', help='Leave the result cache on (measures cache hits)')
+    parser.add_argument('--timeout', type=int, default=1800, help='Seconds allowed per scenario')
+    parser.add_argument('--output', help='Result file (default: benchmarks/results/<timestamp>.json)')
+    parser.add_argument('--baseline', help='Compare against this result file')
+    parser.add_argument('--metric', default='p50', choices=('mean', 'p50', 'p95', 'p99'))
+    parser.add_argument('--threshold', type=float, default=0.1, help='Allowed slowdown as a fraction (default: 0.1)')
+    parser.add_argument('--rss-threshold', type=float, help='Allowed peak RSS growth (default: --threshold)')
+    parser.add_argument('--list', action='store_true', help='List scenarios and exit')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        run_worker(json.loads(args.worker), args.result)
+        return 0
+
+    scenarios = [s for s in _scenarios()
+                 if (not args.quick or s['size'] in QUICK_SIZES)
+                 and all(text in s['name'] for text in args.filter)]
+    modes = ('direct', 'client') if args.mode == 'both' else (args.mode,)
+    if args.list:
+        for scenario in scenarios:
+            print(scenario['name'])
+        return 0
+
+    from corpus import generate
+    print(f'Preparing corpus in {args.corpus}')
+    generate(args.corpus, sizes=QUICK_SIZES if args.quick else None)
+
+    settings = {
+        'corpus': os.path.abspath(args.corpus),
+        'iterations': args.iterations or (3 if args.quick else 5),
+        'warmup': args.warmup,
+        'cache': args.cache,
+        'timeout': args.timeout,
+    }
+    results = {}
+    for scenario in scenarios:
+        for mode in modes:
+            name = f"{mode}/{scenario['name']}"
+            print(f'  {name}', flush=True)
+            results[name] = run_scenario(mode, scenario, settings)
+
+    report = {'environment': _environment(), 'settings': settings, 'scenarios': results}
+    output = args.output or os.path.join(DEFAULT_RESULTS, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    print()
+    print_table(results)
+    print(f'\nResults written to {output}')
+
+    if args.baseline:
+        print()
+        regressions = compare(_load(args.baseline), report, args.metric, args.threshold, args.rss_threshold)
+        print(f'{len(regressions)} regression(s) beyond {args.threshold:.0%}')
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,249 @@
+"""
+Measure how long the converter takes to start.
+
+    python benchmarks/startup.py                      # 5 cold starts, results in benchmarks/results/
+    python benchmarks/startup.py --server --workers 2 # also time gunicorn until it answers
+    API_DOCS_ENABLED=0 python benchmarks/startup.py   # compare settings through the environment
+
+Every run starts a fresh Python process and records:
+
+- interpreter: from spawning the process to its first line of code
+- import: `import app` (Flask, the route modules and everything they import)
+- probe, assets: the toolchain probe and the static asset build done by create_app
+- create_app: the rest of create_app (routes, Swagger, ...)
+- first_page, first_conversion: GET / and a small Markdown to HTML /convert
+  through the test client, i.e. the work left for the first requests
+- ready: the sum, the time from spawning to the first conversion's response
+
+A separate `python -X importtime` run per repeat breaks the import down by
+package (self time, so the numbers add up), to show which dependencies are
+worth deferring. With --server, gunicorn itself is started from scratch and
+timed until /api/load answers over HTTP and until the first conversion
+returns.
+
+The medians over --repeat runs are printed and everything is saved as JSON.
+"""
+import time
+_STARTED = time.time()
+
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+DEFAULT_RESULTS = os.path.join(BENCH_DIR, 'results')
+
+PHASES = ('interpreter', 'import', 'probe', 'assets', 'create_app', 'first_page', 'first_conversion', 'ready')
+SERVER_PHASES = ('listening', 'first_conversion')
+
+SAMPLE_REQUEST = {
+    'conversion_type': 'text', 'from_format': 'markdown', 'to_format': 'html', 'cache': 'false',
+    'text': '# Start-up\n\nA *small* document with a [link](https://example.com) and a list:\n\n- one\n- two\n',
+}
+
+def _median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+
+def _env(scratch):
+    env = dict(os.environ)
+    # Fresh cache, history and jobs folders, so every run starts as cold as a new container.
+    # Static assets stay in ASSETS_FOLDER as in a built image, where only their check is timed.
+    env.update({
+        'CACHE_FOLDER': os.path.join(scratch, 'cache'),
+        'HISTORY_FOLDER': os.path.join(scratch, 'history'),
+        'JOBS_FOLDER': os.path.join(scratch, 'jobs'),
+        'JANITOR_INTERVAL': '0',
+        'PYTHONDONTWRITEBYTECODE': '1',
+    })
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    return env
+
+# --- In the measured process -------------------------------------------------
+
+def worker(spawned_at, result_path):
+    """Start the app phase by phase and write the timings to result_path"""
+    timings = {'interpreter': _STARTED - spawned_at}
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(REPO_ROOT)
+
+    def timed(name, function):
+        started = time.perf_counter()
+        value = function()
+        timings[name] = time.perf_counter() - started
+        return value
+
+    app_module = timed('import', lambda: __import__('app'))
+    from src.utils.capabilities import capabilities
+    from src.utils.assets import assets
+    timed('probe', capabilities.probe)
+    timed('assets', assets.build)
+    app = timed('create_app', app_module.create_app)
+    client = app.test_client()
+    page = timed('first_page', lambda: client.get('/'))
+    conversion = timed('first_conversion', lambda: client.post('/convert', json=SAMPLE_REQUEST))
+    timings['ready'] = time.time() - spawned_at
+    timings['status'] = [page.status_code, conversion.status_code]
+    with open(result_path, 'w', encoding='utf-8') as f:
+        json.dump(timings, f)
+
+# --- Driver ------------------------------------------------------------------
+
+def run_phases(scratch):
+    result_path = os.path.join(scratch, 'phases.json')
+    env = dict(_env(scratch), STARTUP_SPAWNED_AT=repr(time.time()))
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', result_path],
+                               env=env, cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if completed.returncode != 0:
+        raise SystemExit(f"Start-up failed:\n{completed.stderr.decode('utf-8', 'replace')[-2000:]}")
+    with open(result_path, encoding='utf-8') as f:
+        return json.load(f)
+
+def _package(module):
+    # Our own modules individually, third-party code per top-level package
+    parts = module.split('.')
+    return '.'.join(parts[:3]) if parts[0] == 'src' else parts[0]
+
+def run_importtime(scratch):
+    """Self import time in seconds of `import app`, per package"""
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], env=_env(scratch),
+                               cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    packages = {}
+    for line in completed.stderr.decode('utf-8', 'replace').splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        package = _package(name.strip())
+        packages[package] = packages.get(package, 0) + int(self_us) / 1e6
+    return packages
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _request(port, method, path, body=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+def run_server(scratch, workers, timeout):
+    """Start gunicorn and time it until it answers and until the first conversion returns"""
+    port = _free_port()
+    env = dict(_env(scratch), PORT=str(port), WEB_CONCURRENCY=str(workers))
+    spawned = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+                               env=env, cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        timings = {}
+        while 'listening' not in timings:
+            if process.poll() is not None:
+                raise SystemExit('gunicorn exited during start-up')
+            if time.perf_counter() - spawned > timeout:
+                raise SystemExit(f'gunicorn did not answer within {timeout}s')
+            try:
+                if _request(port, 'GET', '/api/load') == 200:
+                    timings['listening'] = time.perf_counter() - spawned
+            except OSError:
+                time.sleep(0.01)
+        status = _request(port, 'POST', '/convert', json.dumps(SAMPLE_REQUEST).encode('utf-8'))
+        timings['first_conversion'] = time.perf_counter() - spawned
+        timings['status'] = status
+        return timings
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def _summarize(runs, phases):
+    return {phase: {'median': _median([run[phase] for run in runs]),
+                    'min': min(run[phase] for run in runs),
+                    'max': max(run[phase] for run in runs)}
+            for phase in phases if all(phase in run for run in runs)}
+
+def _print_table(title, summary):
+    print(f"\n{title:<20} {'median ms':>10} {'min ms':>10} {'max ms':>10}")
+    for phase, stats in summary.items():
+        print(f"{phase:<20} {stats['median'] * 1000:10.1f} {stats['min'] * 1000:10.1f} {stats['max'] * 1000:10.1f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure converter start-up time')
+    parser.add_argument('--repeat', type=int, default=5, help='Cold starts to measure (default: 5)')
+    parser.add_argument('--top', type=int, default=15, help='Packages to list in the import breakdown')
+    parser.add_argument('--server', action='store_true', help='Also time a gunicorn start until it serves requests')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn workers for --server (default: 1)')
+    parser.add_argument('--timeout', type=float, default=120, help='Seconds to wait for gunicorn')
+    parser.add_argument('--output', help='Result file (default: benchmarks/results/startup-<timestamp>.json)')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        worker(float(os.environ['STARTUP_SPAWNED_AT']), args.worker)
+        return 0
+
+    sys.path.insert(0, BENCH_DIR)
+    from run import _environment
+
+    runs, imports, server_runs = [], [], []
+    for i in range(args.repeat):
+        scratch = tempfile.mkdtemp(prefix='docconv-startup-')
+        try:
+            runs.append(run_phases(scratch))
+            imports.append(run_importtime(scratch))
+            if args.server:
+                server_runs.append(run_server(scratch, args.workers, args.timeout))
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+        print(f"run {i + 1}/{args.repeat}: ready in {runs[-1]['ready'] * 1000:.0f} ms", flush=True)
+
+    phases = _summarize(runs, PHASES)
+    packages = {name: sum(run.get(name, 0) for run in imports) / len(imports)
+                for name in set().union(*imports)}
+    top = dict(sorted(packages.items(), key=lambda item: -item[1])[:args.top])
+    report = {
+        'environment': _environment(),
+        'settings': {'repeat': args.repeat, 'server': args.server, 'workers': args.workers,
+                     'API_DOCS_ENABLED': os.environ.get('API_DOCS_ENABLED')},
+        'phases': phases,
+        'imports': dict(sorted(packages.items(), key=lambda item: -item[1])),
+        'runs': runs,
+    }
+    if server_runs:
+        report['server'] = _summarize(server_runs, SERVER_PHASES)
+        report['server_runs'] = server_runs
+
+    _print_table('phase', phases)
+    print(f"\n{'import (self time)':<30} {'ms':>8} {'share':>7}")
+    total = sum(packages.values())
+    for name, seconds in top.items():
+        print(f"{name:<30} {seconds * 1000:8.1f} {seconds / total * 100:6.1f}%")
+    if server_runs:
+        _print_table(f'gunicorn ({args.workers}w)', report['server'])
+
+    output = args.output or os.path.join(DEFAULT_RESULTS, f"startup-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+    print(f'\nResults written to {output}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
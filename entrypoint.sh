@@ -33,6 +33,13 @@ else
     echo "ERROR: Application src directory not found!"
 fi
 
-# Run the application
-echo "Starting application"
-exec python /app/app.py 
\ No newline at end of file
+# Run the application: gunicorn in production, Flask's development server otherwise
+SERVER_MODE=${SERVER_MODE:-production}
+cd /app
+if [ "$SERVER_MODE" = "production" ]; then
+    echo "Starting application with gunicorn (SERVER_MODE=production)"
+    exec gunicorn -c /app/gunicorn.conf.py wsgi:app
+else
+    echo "Starting application with the Flask development server (SERVER_MODE=$SERVER_MODE)"
+    exec python /app/app.py
+fi 
\ No newline at end of file
@@ -0,0 +1,96 @@
+"""
+gunicorn settings for production serving (see entrypoint.sh, SERVER_MODE=production).
+
+Every value can be overridden through the environment:
+
+    WEB_CONCURRENCY            worker processes (default: one per available core)
+    GUNICORN_THREADS           threads per worker (default: 4)
+    GUNICORN_PRELOAD           load the app once in the master and fork it (default: true)
+    GUNICORN_MAX_REQUESTS      recycle a worker after this many requests, 0 disables (default: 1000)
+    GUNICORN_MAX_REQUESTS_JITTER  random spread so workers do not restart together (default: 100)
+    GUNICORN_KEEPALIVE         seconds to keep idle client connections open (default: 5)
+    GUNICORN_TIMEOUT           seconds a worker may stay silent before it is killed (default: 300)
+    GUNICORN_GRACEFUL_TIMEOUT  seconds to finish in-flight requests and jobs on restart (default: GUNICORN_TIMEOUT)
+    GUNICORN_LOG_LEVEL         log level (default: info)
+    PROMETHEUS_MULTIPROC_DIR   where workers write /metrics values (default: a new temporary directory)
+    PORT                       listen port (default: 5000)
+"""
+import os
+import tempfile
+
+def _cores():
+    # Respect CPU affinity (e.g. docker --cpuset-cpus) when the platform reports it
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def _env_int(name, default):
+    value = os.environ.get(name, '').strip()
+    return int(value) if value else default
+
+def _env_flag(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() not in ('0', 'false', 'no', 'off', '')
+
+bind = f"0.0.0.0:{_env_int('PORT', 5000)}"
+
+# Conversions spend most of their time waiting on pandoc/ImageMagick subprocesses,
+# so each worker serves several requests concurrently on threads.
+workers = _env_int('WEB_CONCURRENCY', _cores())
+threads = _env_int('GUNICORN_THREADS', 4)
+worker_class = 'gthread'
+# The app sizes its per-process thread pools (jobs, batches, media) by the number of workers
+os.environ['WEB_CONCURRENCY'] = str(workers)
+
+# Import the app in the master so workers share its memory copy-on-write.
+# Background threads, executors and database connections are created lazily
+# in each worker, so they are safe to preload.
+preload_app = _env_flag('GUNICORN_PRELOAD', True)
+
+# Replace workers periodically to contain leaks from subprocess-heavy work
+max_requests = _env_int('GUNICORN_MAX_REQUESTS', 1000)
+max_requests_jitter = _env_int('GUNICORN_MAX_REQUESTS_JITTER', 100)
+
+keepalive = _env_int('GUNICORN_KEEPALIVE', 5)
+# Large DOCX/PDF conversions can legitimately take minutes
+timeout = _env_int('GUNICORN_TIMEOUT', 300)
+# Exiting workers (restarts, max_requests recycling) first finish their background jobs,
+# which may run as long as a request
+graceful_timeout = _env_int('GUNICORN_GRACEFUL_TIMEOUT', timeout)
+
+# Worker heartbeats on tmpfs so a slow disk cannot get workers killed
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+# Workers are separate processes: each writes its metrics to files in this directory and
+# /metrics aggregates them. It must be empty at start-up, so use a fresh one per master.
+# Set before the app is imported (preload), since prometheus_client reads it at import time.
+if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='docconv-metrics-')
+else:
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+def worker_exit(server, worker):
+    # Runs in the exiting worker. The master stops waiting after graceful_timeout on shutdown
+    # and after timeout when the worker recycles itself, whichever applies.
+    try:
+        from src.utils.jobs import job_manager
+        if not job_manager.drain(min(graceful_timeout, timeout)):
+            server.log.warning('Worker %s exited with unfinished jobs; they are reported as failed', worker.pid)
+    except Exception as e:
+        server.log.warning('Could not finish the jobs of worker %s: %s', worker.pid, e)
+
+def child_exit(server, worker):
+    # Stop counting a dead worker's in-flight requests and busy tool slots
+    try:
+        from src.utils.metrics import mark_process_dead
+        mark_process_dead(worker.pid)
+    except Exception as e:
+        server.log.warning('Could not clean up metrics of worker %s: %s', worker.pid, e)
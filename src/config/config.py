@@ -1,21 +1,145 @@
 import os
+import tempfile
 
 # Author information
 APP_AUTHOR = "stop1love1"
 APP_VERSION = "1.0.0"
 
+# Project root directory
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Server processes sharing the host's cores; gunicorn.conf.py exports its worker count
+SERVER_PROCESSES = max(1, int(os.environ.get('WEB_CONCURRENCY') or 1))
+# Default size of per-process thread pools, so that all processes together use about one thread per core
+PROCESS_CORES = max(1, (os.cpu_count() or 2) // SERVER_PROCESSES)
+
+def _env_flag(name, default):
+    """Read a boolean flag from the environment"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() not in ('0', 'false', 'no', 'off', '')
+
+# Development server (python app.py); production uses gunicorn.conf.py
+DEBUG = _env_flag('FLASK_DEBUG', True)
+PORT = int(os.environ.get('PORT', 5000))
+
 # Configure upload folder
-UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'uploads')
+UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', os.path.join(BASE_DIR, 'uploads'))
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
+# Uploads are streamed here while the request is parsed, then renamed into place.
+# Keep it on the same filesystem as UPLOAD_FOLDER so the rename does not copy.
+INGEST_FOLDER = os.path.join(UPLOAD_FOLDER, '.incoming')
+MAX_CONTENT_LENGTH = int(os.environ.get('MAX_UPLOAD_MB', 50)) * 1024 * 1024
+
+# Chunked, resumable uploads (/api/uploads) for files larger than one request may be.
+# Chunks are written into a preallocated file per upload session; sessions idle for
+# UPLOAD_SESSION_TTL seconds are removed by the janitor.
+UPLOAD_SESSION_FOLDER = os.path.join(UPLOAD_FOLDER, '.sessions')
+UPLOAD_SESSION_MAX_BYTES = int(os.environ.get('RESUMABLE_UPLOAD_MAX_MB', 2048)) * 1024 * 1024
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_MB', 8)) * 1024 * 1024  # suggested to clients, at most MAX_UPLOAD_MB
+UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL', 24 * 3600))
+
+# Every conversion works in its own directory under UPLOAD_FOLDER. A janitor thread removes
+# directories unused for WORKSPACE_TTL seconds and, past WORKSPACE_MAX_MB, the least recently used.
+WORKSPACE_TTL = int(os.environ.get('WORKSPACE_TTL', 24 * 3600))
+WORKSPACE_MAX_BYTES = int(os.environ.get('WORKSPACE_MAX_MB', 2048)) * 1024 * 1024  # 0 disables the quota
+WORKSPACE_MIN_AGE = int(os.environ.get('WORKSPACE_MIN_AGE', 300))  # seconds a workspace is safe from quota eviction
+JANITOR_INTERVAL = int(os.environ.get('JANITOR_INTERVAL', 300))  # seconds between sweeps, 0 disables the janitor
+
+# Conversion result cache (content-addressed, on disk)
+CACHE_ENABLED = _env_flag('CACHE_ENABLED', True)
+CACHE_FOLDER = os.environ.get('CACHE_FOLDER', os.path.join(BASE_DIR, 'cache'))
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_MB', 512)) * 1024 * 1024
+CACHE_TTL = int(os.environ.get('CACHE_TTL', 7 * 24 * 3600))  # seconds, 0 disables expiry
+# PNG renderings of images extracted from documents (WMF/EMF equations etc.), keyed by content hash
+MEDIA_CACHE_FOLDER = os.path.join(CACHE_FOLDER, 'media')
+MEDIA_CACHE_MAX_BYTES = int(os.environ.get('MEDIA_CACHE_MAX_MB', 256)) * 1024 * 1024
+
+# Identical conversions submitted at the same time run once and share the result.
+# Workers coordinate through lock files in INFLIGHT_FOLDER and the result cache.
+COALESCE_ENABLED = _env_flag('COALESCE_ENABLED', True)
+INFLIGHT_FOLDER = os.path.join(CACHE_FOLDER, 'inflight')
+
+# Server-side conversion history; each entry keeps a copy of its output for history downloads
+HISTORY_FOLDER = os.environ.get('HISTORY_FOLDER', os.path.join(BASE_DIR, 'history'))
+HISTORY_MAX_ENTRIES = int(os.environ.get('HISTORY_MAX_ENTRIES', 1000))
+HISTORY_MAX_BYTES = int(os.environ.get('HISTORY_MAX_MB', 1024)) * 1024 * 1024  # stored outputs, 0 disables the quota
+
+# Asynchronous conversion jobs
+JOBS_FOLDER = os.environ.get('JOBS_FOLDER', os.path.join(BASE_DIR, 'jobs'))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', PROCESS_CORES))  # threads per server process
+JOB_MAX_PENDING = int(os.environ.get('JOB_MAX_PENDING', 100))
+JOB_TTL = int(os.environ.get('JOB_TTL', 24 * 3600))  # seconds a finished job stays queryable
+JOB_BUSY_TIMEOUT = int(os.environ.get('JOB_BUSY_TIMEOUT', 3600))  # seconds a job retries while the tools are saturated
+# Requests bigger than this run as a job when mode=auto
+JOB_ASYNC_THRESHOLD = int(os.environ.get('JOB_ASYNC_THRESHOLD_MB', 5)) * 1024 * 1024
+
+# Batch conversions (/convert/batch)
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', PROCESS_CORES))  # threads per server process
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', 500))
+BATCH_MAX_BYTES = int(os.environ.get('BATCH_MAX_MB', 1024)) * 1024 * 1024  # uncompressed size of an uploaded archive
+
+# Admission control for external tools. The limits hold for all server processes on the
+# host together: slots are lock files in TOOL_SLOT_FOLDER (per process where fcntl is missing).
+PANDOC_MAX_CONCURRENCY = int(os.environ.get('PANDOC_MAX_CONCURRENCY', os.cpu_count() or 2))
+IMAGEMAGICK_MAX_CONCURRENCY = int(os.environ.get('IMAGEMAGICK_MAX_CONCURRENCY', os.cpu_count() or 2))
+TOOL_SLOT_FOLDER = os.environ.get('TOOL_SLOT_FOLDER', os.path.join(tempfile.gettempdir(), 'docconv-slots'))
+TOOL_MAX_QUEUE = int(os.environ.get('TOOL_MAX_QUEUE', 32))  # callers allowed to wait for a slot, per process
+TOOL_QUEUE_TIMEOUT = float(os.environ.get('TOOL_QUEUE_TIMEOUT', 30))  # seconds before giving up on a slot
+# Threads converting extracted document media; ImageMagick calls are still bounded by the limit above
+MEDIA_WORKERS = int(os.environ.get('MEDIA_WORKERS', PROCESS_CORES))
+
+# Image engine: 'auto' converts common raster pairs in-process with Pillow and
+# everything else with ImageMagick; 'pillow' or 'imagemagick' force one engine
+IMAGE_ENGINE = os.environ.get('IMAGE_ENGINE', 'auto').strip().lower()
+
+# Pandoc engine for text and base64 conversions: 'cli' spawns pandoc per request,
+# 'server' sends them to a pool of long-lived pandoc server processes
+PANDOC_ENGINE = os.environ.get('PANDOC_ENGINE', 'cli').strip().lower()
+PANDOC_SERVER_COMMAND = os.environ.get('PANDOC_SERVER_COMMAND', 'pandoc server')  # 'pandoc-server' before pandoc 3
+PANDOC_SERVER_POOL_SIZE = int(os.environ.get('PANDOC_SERVER_POOL_SIZE', 2))
+PANDOC_SERVER_TIMEOUT = int(os.environ.get('PANDOC_SERVER_TIMEOUT', 30))  # seconds per conversion
+PANDOC_SERVER_HEALTH_INTERVAL = float(os.environ.get('PANDOC_SERVER_HEALTH_INTERVAL', 15))
+
+# Prometheus metrics at /metrics (needs prometheus_client). With several server processes,
+# set PROMETHEUS_MULTIPROC_DIR to an empty directory; gunicorn.conf.py does this by default.
+METRICS_ENABLED = _env_flag('METRICS_ENABLED', True)
+
+# Swagger UI at /docs/; turning it off skips importing flasgger and speeds up start-up
+API_DOCS_ENABLED = _env_flag('API_DOCS_ENABLED', True)
+
+# Stage timings (upload, pandoc, media, ...) of each request in a Server-Timing response header
+SERVER_TIMING_ENABLED = _env_flag('SERVER_TIMING_ENABLED', True)
+# cProfile requests and keep the profiles of those slower than this many seconds (0 disables)
+PROFILE_SLOW_REQUESTS = float(os.environ.get('PROFILE_SLOW_REQUESTS', 0))
+PROFILE_FOLDER = os.environ.get('PROFILE_FOLDER', os.path.join(BASE_DIR, 'profiles'))
+
+# Compress text responses (JSON with converted content, HTML, Markdown, ...) of at least
+# COMPRESSION_MIN_BYTES for clients that accept it. Encodings in order of preference;
+# br and zstd need the brotli and zstandard packages.
+COMPRESSION_ENABLED = _env_flag('COMPRESSION_ENABLED', True)
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', 1024))
+COMPRESSION_ENCODINGS = [name.strip() for name in os.environ.get('COMPRESSION_ENCODINGS', 'zstd,br,gzip').split(',')
+                         if name.strip()]
+
+# Static assets: minified, fingerprinted and precompressed copies served from /assets/
+# with long-lived caching (src/utils/assets.py). ASSETS_BUILD builds them at start-up.
+STATIC_FOLDER = os.path.join(BASE_DIR, 'src', 'static')
+ASSETS_FOLDER = os.environ.get('ASSETS_FOLDER', os.path.join(BASE_DIR, 'assets'))
+ASSETS_BUILD = _env_flag('ASSETS_BUILD', True)
+ASSETS_MAX_AGE = 365 * 24 * 3600
+
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'docx', 'md', 'html', 'odt', 'epub', 'latex', 'tex'}
 
 # Allowed image extensions for OMR scanning
 ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'tif', 'tiff', 'bmp'}
 
-# Pandoc supported formats
+# Pandoc formats, most used first. The formats offered are those the installed pandoc
+# reports (src/utils/capabilities.py), listed in this order; these lists are the fallback.
 PANDOC_INPUT_FORMATS = [
     'markdown', 'commonmark', 'gfm', 'markdown_mmd', 'markdown_phpextra', 'markdown_strict', 
     'docx', 'docbook', 'docbook4', 'docbook5', 'html', 'latex', 'odt', 'opml', 'org', 'rst', 
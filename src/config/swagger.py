@@ -1,27 +1,45 @@
-try:
-    from flasgger import Swagger
-    from markupsafe import Markup
-    
+"""
+API documentation with Flasgger.
+
+flasgger (with jsonschema, PyYAML and mistune) takes longer to import than
+Flask itself, so route modules decorate their views with the swag_from below,
+which only attaches the spec, and flasgger is imported in setup_swagger when
+API_DOCS_ENABLED is on.
+"""
+from src.config.config import API_DOCS_ENABLED
+
+def swag_from(specs, **kwargs):
+    """Attach an OpenAPI spec dict to a view, where flasgger.swag_from would put it"""
+    def decorator(function):
+        function.specs_dict = specs
+        return function
+    return decorator
+
+def _import_swagger():
     try:
-        import flask
-        if not hasattr(flask, 'Markup'):
-            flask.Markup = Markup
-    except:
-        pass
-    
-    SWAGGER_AVAILABLE = True
-except ImportError:
-    SWAGGER_AVAILABLE = False
-    print("Warning: Flasgger not available, API docs will not work")
-    # Define dummy Swagger class
-    class Swagger:
-        def __init__(self, *args, **kwargs):
+        from flasgger import Swagger
+        from markupsafe import Markup
+        
+        try:
+            import flask
+            if not hasattr(flask, 'Markup'):
+                flask.Markup = Markup
+        except:
             pass
+        
+        return Swagger
+    except ImportError:
+        print("Warning: Flasgger not available, API docs will not work")
+        return None
 
 def setup_swagger(app):
     """Configure Swagger documentation for the application"""
     
-    if not SWAGGER_AVAILABLE:
+    if not API_DOCS_ENABLED:
+        return None
+    
+    Swagger = _import_swagger()
+    if Swagger is None:
         # Add a route that provides an explanation when Swagger is unavailable
         @app.route('/docs')
         @app.route('/docs/')
@@ -1,19 +1,22 @@
-from flask import jsonify, request, send_file
-try:
-    from flasgger import swag_from
-    SWAGGER_AVAILABLE = True
-except ImportError:
-    SWAGGER_AVAILABLE = False
-    def swag_from(content, **kwargs):
-        def decorator(f):
-            return f
-        return decorator
-
-import json
-import tempfile
-import zipfile
-import io
-from src.config.config import PANDOC_INPUT_FORMATS, PANDOC_OUTPUT_FORMATS
+from flask import jsonify, request, Response
+from datetime import datetime
+from src.config.swagger import swag_from
+
+from src.utils.capabilities import capabilities
+from src.utils.cache import conversion_cache, media_cache
+from src.utils.governor import governor_stats
+from src.utils.jobs import job_manager
+from src.utils.engines import server_engine
+from src.utils.inflight import inflight
+from src.config.config import PANDOC_ENGINE
+from src.utils.history import (
+    get_history, get_entries, output_path as history_output_path, history_store, client_id, HISTORY_STATUSES
+)
+from src.utils.zipstream import ZipStream
+from src.utils.workspace import janitor
+
+# Formats only change when the server restarts with another toolchain
+FORMATS_MAX_AGE = 3600
 
 def register_api_routes(app):
     """Register API routes"""
@@ -22,7 +25,8 @@ def register_api_routes(app):
     @swag_from({
         'tags': ['Formats'],
         'summary': 'Get supported formats',
-        'description': 'Get list of supported input and output formats',
+        'description': 'Get the input and output formats of the installed pandoc and which conversion tools '
+                       'are available. Probed at start-up; send If-None-Match with the ETag to revalidate.',
         'produces': [
             'application/json'
         ],
@@ -41,23 +45,261 @@ def register_api_routes(app):
                             'type': 'array',
                             'items': {'type': 'string'},
                             'description': 'Supported output formats'
+                        },
+                        'tools': {
+                            'type': 'object',
+                            'description': 'Availability and version of pandoc, ImageMagick (convert), wmf2svg '
+                                           'and rsvg-convert'
                         }
                     }
                 }
+            },
+            '304': {
+                'description': 'Not modified'
             }
         }
     })
     def get_formats():
+        body, etag = capabilities.formats_document()
+        response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = f'public, max-age={FORMATS_MAX_AGE}'
+        return response.make_conditional(request)
+    
+    @app.route('/api/cache', methods=['GET'])
+    @swag_from({
+        'tags': ['Cache'],
+        'summary': 'Get conversion cache statistics',
+        'description': 'Hit/miss counters and size of the conversion result cache for this worker',
+        'produces': [
+            'application/json'
+        ],
+        'responses': {
+            '200': {
+                'description': 'Cache statistics',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'enabled': {'type': 'boolean'},
+                        'hits': {'type': 'integer'},
+                        'misses': {'type': 'integer'},
+                        'hit_ratio': {'type': 'number'},
+                        'evictions': {'type': 'integer'},
+                        'size_bytes': {'type': 'integer'},
+                        'max_bytes': {'type': 'integer'},
+                        'ttl_seconds': {'type': 'integer'},
+                        'media': {
+                            'type': 'object',
+                            'description': 'Same statistics for the cache of images rendered from document media'
+                        }
+                    }
+                }
+            }
+        }
+    })
+    def get_cache_stats():
+        return jsonify(dict(conversion_cache.stats(), media=media_cache.stats()))
+
+    @app.route('/api/cache', methods=['DELETE'])
+    @swag_from({
+        'tags': ['Cache'],
+        'summary': 'Clear the conversion cache',
+        'description': 'Remove every cached conversion result and rendered document image',
+        'produces': [
+            'application/json'
+        ],
+        'responses': {
+            '200': {
+                'description': 'Cache cleared'
+            }
+        }
+    })
+    def clear_cache():
+        conversion_cache.clear()
+        media_cache.clear()
+        return jsonify({'success': True})
+
+    @app.route('/api/load', methods=['GET'])
+    @swag_from({
+        'tags': ['Status'],
+        'summary': 'Get conversion load',
+        'description': 'Active and queued pandoc/ImageMagick processes, wait times and pending jobs for this worker',
+        'produces': [
+            'application/json'
+        ],
+        'responses': {
+            '200': {
+                'description': 'Current load',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'tools': {
+                            'type': 'object',
+                            'description': 'Per-tool limit, active, queued, rejected and wait-time figures'
+                        },
+                        'jobs': {
+                            'type': 'object',
+                            'description': 'Job worker pool size and pending jobs'
+                        },
+                        'pandoc_engine': {
+                            'type': 'object',
+                            'description': 'Configured pandoc engine and pandoc server pool state'
+                        },
+                        'coalescing': {
+                            'type': 'object',
+                            'description': 'Distinct conversions in flight and requests that shared an identical one'
+                        }
+                    }
+                }
+            }
+        }
+    })
+    def get_load():
         return jsonify({
-            'input_formats': PANDOC_INPUT_FORMATS,
-            'output_formats': PANDOC_OUTPUT_FORMATS
+            'tools': governor_stats(),
+            'jobs': job_manager.stats(),
+            'pandoc_engine': dict(server_engine.stats(), engine=PANDOC_ENGINE),
+            'coalescing': inflight.stats()
         })
-    
-    @app.route('/api/history/download', methods=['POST'])
+
+    @app.route('/api/storage', methods=['GET'])
+    @swag_from({
+        'tags': ['Status'],
+        'summary': 'Get upload storage usage',
+        'description': 'Size of the conversion workspaces in the upload folder, janitor evictions, free disk space '
+                       'and the size of the stored history outputs',
+        'produces': [
+            'application/json'
+        ],
+        'responses': {
+            '200': {
+                'description': 'Storage statistics',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'workspaces': {'type': 'integer'},
+                        'size_bytes': {'type': 'integer'},
+                        'max_bytes': {'type': 'integer'},
+                        'ttl_seconds': {'type': 'integer'},
+                        'evicted_ttl': {'type': 'integer'},
+                        'evicted_quota': {'type': 'integer'},
+                        'last_sweep': {'type': 'number'},
+                        'last_sweep_seconds': {'type': 'number'},
+                        'disk_free_bytes': {'type': 'integer'},
+                        'disk_total_bytes': {'type': 'integer'},
+                        'history': {
+                            'type': 'object',
+                            'properties': {
+                                'entries': {'type': 'integer'},
+                                'size_bytes': {'type': 'integer'},
+                                'max_entries': {'type': 'integer'},
+                                'max_bytes': {'type': 'integer'}
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    })
+    def get_storage():
+        return jsonify(dict(janitor.stats(), history=history_store.usage()))
+
+    @app.route('/api/history', methods=['GET'])
+    @swag_from({
+        'tags': ['History'],
+        'summary': 'List conversion history',
+        'description': 'Pages through the caller\'s conversions, newest first. Conversions belong to the client '
+                       'token sent in the X-Client-Token header or client_token cookie; a client without one gets '
+                       'a token with its first conversion. Pass the returned nextCursor as cursor to get the next page.',
+        'produces': [
+            'application/json'
+        ],
+        'parameters': [
+            {'name': 'X-Client-Token', 'in': 'header', 'type': 'string', 'required': False,
+             'description': 'Client token (or the client_token cookie)'},
+            {'name': 'status', 'in': 'query', 'type': 'string', 'required': False, 'enum': ['success', 'failed']},
+            {'name': 'kind', 'in': 'query', 'type': 'string', 'required': False,
+             'enum': ['file', 'text', 'base64', 'image']},
+            {'name': 'from_format', 'in': 'query', 'type': 'string', 'required': False},
+            {'name': 'to_format', 'in': 'query', 'type': 'string', 'required': False},
+            {'name': 'since', 'in': 'query', 'type': 'string', 'required': False,
+             'description': 'Only entries created at or after this time (ISO 8601 or Unix time)'},
+            {'name': 'until', 'in': 'query', 'type': 'string', 'required': False,
+             'description': 'Only entries created before this time (ISO 8601 or Unix time)'},
+            {'name': 'limit', 'in': 'query', 'type': 'integer', 'required': False, 'default': 50,
+             'description': 'Page size (at most 200)'},
+            {'name': 'cursor', 'in': 'query', 'type': 'integer', 'required': False,
+             'description': 'nextCursor from the previous page'}
+        ],
+        'responses': {
+            '200': {
+                'description': 'One page of history entries',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'items': {'type': 'array', 'items': {'type': 'object'}},
+                        'nextCursor': {'type': 'integer'}
+                    }
+                }
+            },
+            '400': {
+                'description': 'Invalid filter'
+            }
+        }
+    })
+    def list_history():
+        args = request.args
+        try:
+            since = _parse_time(args.get('since'))
+            until = _parse_time(args.get('until'))
+            limit = int(args.get('limit', 50))
+            cursor = int(args['cursor']) if args.get('cursor') else None
+        except ValueError:
+            return jsonify({'error': 'Invalid since, until, limit or cursor'}), 400
+        status = args.get('status')
+        if status and status not in HISTORY_STATUSES:
+            return jsonify({'error': f'Invalid status. Allowed statuses: {", ".join(HISTORY_STATUSES)}'}), 400
+
+        return jsonify(get_history(client_id(), status=status, kind=args.get('kind'), from_format=args.get('from_format'),
+                                   to_format=args.get('to_format'), since=since, until=until,
+                                   limit=limit, cursor=cursor))
+
+    @app.route('/api/history/<entry_id>', methods=['GET'])
+    @swag_from({
+        'tags': ['History'],
+        'summary': 'Get a conversion history entry',
+        'description': 'Only entries of the caller\'s client token are found',
+        'produces': [
+            'application/json'
+        ],
+        'parameters': [
+            {'name': 'entry_id', 'in': 'path', 'type': 'string', 'required': True,
+             'description': 'historyId returned by a conversion endpoint'},
+            {'name': 'X-Client-Token', 'in': 'header', 'type': 'string', 'required': False,
+             'description': 'Client token (or the client_token cookie)'}
+        ],
+        'responses': {
+            '200': {
+                'description': 'History entry'
+            },
+            '404': {
+                'description': 'Unknown history id'
+            }
+        }
+    })
+    def get_history_entry(entry_id):
+        entries = get_entries([entry_id], client_id())
+        if not entries:
+            return jsonify({'error': 'History entry not found'}), 404
+        return jsonify(entries[0])
+
+    @app.route('/api/history/download', methods=['GET', 'POST'])
     @swag_from({
         'tags': ['History'],
         'summary': 'Download conversion history',
-        'description': 'Creates a ZIP file containing all conversion results from history',
+        'description': 'Streams a ZIP file with the stored output and metadata of each requested history entry. '
+                       'Ids are the historyId values returned by the conversion endpoints; entries of other '
+                       'client tokens are reported as missing.',
         'consumes': [
             'application/json'
         ],
@@ -65,23 +307,31 @@ def register_api_routes(app):
             'application/zip'
         ],
         'parameters': [
+            {
+                'name': 'ids',
+                'in': 'query',
+                'type': 'string',
+                'required': False,
+                'description': 'Comma-separated history ids (GET)'
+            },
+            {
+                'name': 'X-Client-Token',
+                'in': 'header',
+                'type': 'string',
+                'required': False,
+                'description': 'Client token (or the client_token cookie)'
+            },
             {
                 'name': 'history',
                 'in': 'body',
-                'required': True,
+                'required': False,
+                'description': 'History ids (POST), as a list or as {"ids": [...]}',
                 'schema': {
-                    'type': 'array',
-                    'items': {
-                        'type': 'object',
-                        'properties': {
-                            'filename': {'type': 'string'},
-                            'fromFormat': {'type': 'string'},
-                            'toFormat': {'type': 'string'},
-                            'timestamp': {'type': 'string'},
-                            'content': {'type': 'string'},
-                            'downloadUrl': {'type': 'string'},
-                            'base64Result': {'type': 'string'},
-                            'isFile': {'type': 'boolean'}
+                    'type': 'object',
+                    'properties': {
+                        'ids': {
+                            'type': 'array',
+                            'items': {'type': 'string'}
                         }
                     }
                 }
@@ -96,72 +346,83 @@ def register_api_routes(app):
             },
             '400': {
                 'description': 'Bad request'
+            },
+            '404': {
+                'description': 'None of the ids are in the history'
             }
         }
     })
     # pylint: disable=unused-variable
     def download_history():
         try:
-            # Get history data from request
-            history_data = request.json
-            
-            if not history_data or not isinstance(history_data, list):
-                return jsonify({'error': 'Invalid history data'}), 400
-            
-            # Create a temporary directory to store files
-            with tempfile.TemporaryDirectory() as temp_dir:
-                # Create an in-memory file-like object for the ZIP
-                memory_file = io.BytesIO()
-                
-                # Create a ZIP file
-                with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-                    # Add history summary
-                    summary = {
-                        'total_conversions': len(history_data),
-                        'conversions': history_data
-                    }
-                    
-                    zf.writestr('history_summary.json', json.dumps(summary, indent=2))
-                    
-                    # Add each conversion result
-                    for i, item in enumerate(history_data):
-                        if item.get('isFile') and item.get('downloadUrl'):
-                            # For file conversions, include download URL info
-                            info = {
-                                'filename': item.get('filename', 'unknown'),
-                                'fromFormat': item.get('fromFormat', 'unknown'),
-                                'toFormat': item.get('toFormat', 'unknown'),
-                                'timestamp': item.get('timestamp', ''),
-                                'download_link': item.get('downloadUrl', '')
-                            }
-                            zf.writestr(f'conversion_{i+1}/info.json', json.dumps(info, indent=2))
-                        else:
-                            # For text or base64 conversions
-                            content = item.get('content', '') or item.get('base64Result', '')
-                            if content:
-                                filename = item.get('filename', f'conversion_{i+1}')
-                                safe_filename = "".join([c if c.isalnum() or c in "._- " else "_" for c in filename])
-                                zf.writestr(f'conversion_{i+1}/{safe_filename}.{item.get("toFormat", "txt")}', content)
-                                
-                                # Add metadata
-                                info = {
-                                    'filename': item.get('filename', 'unknown'),
-                                    'fromFormat': item.get('fromFormat', 'unknown'),
-                                    'toFormat': item.get('toFormat', 'unknown'),
-                                    'timestamp': item.get('timestamp', '')
-                                }
-                                zf.writestr(f'conversion_{i+1}/info.json', json.dumps(info, indent=2))
-                
-                # Reset the file pointer
-                memory_file.seek(0)
-                
-                return send_file(
-                    memory_file,
-                    mimetype='application/zip',
-                    as_attachment=True,
-                    download_name=f'conversion_history_{app.config["TIMESTAMP"]}.zip'
-                )
-                
+            ids = _history_ids(request)
+            if not ids:
+                return jsonify({'error': 'Invalid history data, expected a list of history ids'}), 400
+
+            entries = get_entries(ids, client_id())
+            if not entries:
+                return jsonify({'error': 'No matching history entries'}), 404
+
+            found = {entry['id'] for entry in entries}
+            response = Response(_stream_history(entries, [i for i in ids if i not in found]),
+                                mimetype='application/zip')
+            response.headers['Content-Disposition'] = f'attachment; filename=conversion_history_{app.config["TIMESTAMP"]}.zip'
+            return response
+
         except Exception as e:
             app.logger.error(f"Error generating history zip: {str(e)}")
-            return jsonify({'error': 'Failed to generate history ZIP file'}), 500 
\ No newline at end of file
+            return jsonify({'error': 'Failed to generate history ZIP file'}), 500
+
+def _parse_time(value):
+    """Parse an ISO 8601 or Unix timestamp into Unix time"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def _history_ids(request):
+    """Read history ids from ?ids=a,b, a JSON list, {"ids": [...]} or a list of history items"""
+    if request.method == 'GET':
+        return [i for i in request.args.get('ids', '').split(',') if i]
+
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('ids')
+    if not isinstance(data, list):
+        return []
+    ids = []
+    for item in data:
+        if isinstance(item, dict):
+            item = item.get('historyId') or item.get('id')
+        if isinstance(item, str) and item:
+            ids.append(item)
+    return ids
+
+def _stream_history(entries, missing):
+    """Yield a ZIP of history entries: a summary, then each entry's output file and info.json"""
+    zip_stream = ZipStream()
+    yield from zip_stream.add_json({
+        'total_conversions': len(entries),
+        'missing_ids': missing,
+        'conversions': entries
+    }, 'history_summary.json')
+
+    for i, entry in enumerate(entries):
+        folder = f'conversion_{i+1}'
+        path = history_output_path(entry)
+        if path:
+            yield from zip_stream.add_file(path, f'{folder}/{entry["output"]}')
+        yield from zip_stream.add_json({
+            'id': entry.get('id'),
+            'filename': entry.get('source_file') or 'unknown',
+            'fromFormat': entry.get('from_format') or 'unknown',
+            'toFormat': entry.get('target_format') or 'unknown',
+            'timestamp': entry.get('timestamp', ''),
+            'status': entry.get('status'),
+            'error': entry.get('error_message'),
+            'output': entry.get('output') if path else None
+        }, f'{folder}/info.json')
+
+    yield from zip_stream.close()
@@ -1,19 +1,129 @@
-from flask import request, jsonify
-try:
-    from flasgger import swag_from
-    SWAGGER_AVAILABLE = True
-except ImportError:
-    SWAGGER_AVAILABLE = False
-    def swag_from(content, **kwargs):
-        def decorator(f):
-            return f
-        return decorator
+from flask import request, jsonify, Response
+from src.config.swagger import swag_from
 
 from werkzeug.utils import secure_filename
 import os
-from src.config.config import allowed_file, UPLOAD_FOLDER
+from src.config.config import allowed_file
 from src.utils.conversion import process_file_conversion, process_text_conversion, process_base64_conversion, process_image_conversion
-import base64
+from src.utils.cache import cache_requested
+from src.utils.jobs import job_manager, job_summary, wants_async, JOB_MODES
+from src.utils.governor import ServerBusy
+from src.utils.ingest import ingest_upload
+from src.utils.responses import response_mode, conversion_response, RESPONSE_MODES
+from src.utils.images import IMAGE_ENGINES
+from src.utils.batch import Batch, BatchError, stream_batch
+from src.utils.history import recorded
+from src.utils.workspace import create_workspace
+
+# Input and output formats accepted by /convert/image
+IMAGE_EXTENSIONS = [
+    'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp', 'tiff', 'svg', 'ico',
+    'heic', 'heif', 'avif', 'pdf', 'psd', 'ai', 'eps', 'raw', 'cr2', 'nef',
+    'arw', 'dng', 'orf', 'rw2', 'rwl', 'pcx', 'tga', 'xcf', 'pnm', 'pbm',
+    'pgm', 'ppm', 'xpm', 'xbm', 'jxr', 'wdp', 'hdp', 'jp2', 'j2k', 'jpf',
+    'jpx', 'jpm', 'djvu', 'jxl', 'wmf', 'emf'
+]
+
+def image_extension(filename):
+    """Lower-case extension of an image file name, '' if it has none"""
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+def image_options(values):
+    """
+    Read and validate the image conversion parameters.
+
+    Args:
+        values: Form fields or a JSON object (to_format, quality, resize, options, engine)
+
+    Returns:
+        tuple: (parameters dict, None) or (None, error message)
+    """
+    to_format = values.get('to_format')
+    if not to_format:
+        return None, 'Target format is required'
+    if to_format.lower() not in IMAGE_EXTENSIONS:
+        return None, f'Target format not supported. Allowed formats: {", ".join(IMAGE_EXTENSIONS)}'
+
+    quality = values.get('quality', 90)
+    try:
+        quality = int(quality)
+        if quality < 1 or quality > 100:
+            return None, 'Quality must be between 1 and 100'
+    except (TypeError, ValueError):
+        return None, 'Quality must be a number between 1 and 100'
+
+    engine = values.get('engine') or None
+    if engine and engine.lower() not in IMAGE_ENGINES:
+        return None, f'Invalid engine. Allowed engines: {", ".join(IMAGE_ENGINES)}'
+    return {
+        'to_format': to_format,
+        'quality': quality,
+        'resize': values.get('resize', None),
+        'options': values.get('options', None),
+        'engine': engine
+    }, None
+
+def run_file_conversion(filepath, filename, from_format, to_format, options, output_mode,
+                        run_async=False, use_cache=True, input_hash=None):
+    """
+    Convert a document already saved in its workspace and build the response.
+
+    The input file is removed when the conversion is done (by the job when
+    run_async), or right away if it cannot be started.
+
+    Returns:
+        The Flask response: the conversion result, or the job with status 202
+    """
+    embed_output = output_mode == 'json'
+    handed_off = False
+    try:
+        if run_async:
+            job = job_manager.submit('file', recorded(process_file_conversion, 'file', filename, from_format, to_format),
+                                     filepath, from_format, to_format, options,
+                                     use_cache=use_cache, input_hash=input_hash, include_content=embed_output,
+                                     cleanup=[filepath])
+            handed_off = True
+            return jsonify(job_summary(job)), 202
+
+        result = recorded(process_file_conversion, 'file', filename, from_format, to_format)(
+            filepath, from_format, to_format, options, use_cache=use_cache,
+            input_hash=input_hash, include_content=embed_output)
+    finally:
+        # Clean up the uploaded file unless a job now owns it
+        if not handed_off and os.path.exists(filepath):
+            os.remove(filepath)
+    return conversion_response(result, output_mode, to_format)
+
+def run_image_conversion(filepath, filename, params, output_mode, run_async=False, input_hash=None):
+    """
+    Convert an image already saved in its workspace and build the response.
+
+    Args:
+        params (dict): Validated parameters from image_options()
+
+    Returns:
+        The Flask response: the conversion result, or the job with status 202
+    """
+    ext = image_extension(filename)
+    to_format = params['to_format']
+    # Only embed base64 when the response is JSON
+    encode = output_mode == 'json'
+    handed_off = False
+    try:
+        if run_async:
+            job = job_manager.submit('image', recorded(process_image_conversion, 'image', filename, ext, to_format),
+                                     filepath, to_format, params['quality'], params['resize'], params['options'],
+                                     encode=encode, engine=params['engine'], input_hash=input_hash, cleanup=[filepath])
+            handed_off = True
+            return jsonify(job_summary(job)), 202
+
+        result = recorded(process_image_conversion, 'image', filename, ext, to_format)(
+            filepath, to_format, params['quality'], params['resize'], params['options'],
+            encode=encode, engine=params['engine'], input_hash=input_hash)
+    finally:
+        if not handed_off and os.path.exists(filepath):
+            os.remove(filepath)
+    return conversion_response(result, output_mode, to_format)
 
 def register_conversion_routes(app):
     """Register conversion-related routes"""
@@ -28,7 +138,8 @@ def register_conversion_routes(app):
             'multipart/form-data'
         ],
         'produces': [
-            'application/json'
+            'application/json',
+            'application/octet-stream'
         ],
         'parameters': [
             {
@@ -80,6 +191,32 @@ def register_conversion_routes(app):
                 'type': 'string',
                 'required': False,
                 'description': 'Base64 encoded content (required if conversion_type is "base64")',
+            },
+            {
+                'name': 'mode',
+                'in': 'formData',
+                'type': 'string',
+                'required': False,
+                'default': 'sync',
+                'enum': ['sync', 'async', 'auto'],
+                'description': 'sync converts inline; async returns a job id right away; auto runs inputs above JOB_ASYNC_THRESHOLD_MB as a job',
+            },
+            {
+                'name': 'response',
+                'in': 'formData',
+                'type': 'string',
+                'required': False,
+                'default': 'json',
+                'enum': ['json', 'url', 'raw'],
+                'description': 'json returns the result with embedded content; url returns only the download URL; raw streams the converted bytes with their Content-Type',
+            },
+            {
+                'name': 'cache',
+                'in': 'formData',
+                'type': 'boolean',
+                'required': False,
+                'default': True,
+                'description': 'Set to false to bypass the conversion result cache (same as sending Cache-Control: no-cache)',
             }
         ],
         'responses': {
@@ -103,10 +240,26 @@ def register_conversion_routes(app):
                         'result': {
                             'type': 'string',
                             'description': 'Converted result (for text and base64)'
+                        },
+                        'cached': {
+                            'type': 'boolean',
+                            'description': 'True when the result was served from the conversion cache'
                         }
                     }
                 }
             },
+            '202': {
+                'description': 'Conversion submitted as a background job (mode=async or auto)',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'jobId': {'type': 'string'},
+                        'status': {'type': 'string'},
+                        'statusUrl': {'type': 'string'},
+                        'resultUrl': {'type': 'string'}
+                    }
+                }
+            },
             '400': {
                 'description': 'Bad request',
                 'schema': {
@@ -119,6 +272,12 @@ def register_conversion_routes(app):
                     }
                 }
             },
+            '422': {
+                'description': 'Conversion failed (response=url or raw)'
+            },
+            '503': {
+                'description': 'Server saturated (too many queued conversions or jobs); retry after the number of seconds in the Retry-After header'
+            },
             '500': {
                 'description': 'Server error',
                 'schema': {
@@ -142,11 +301,16 @@ def register_conversion_routes(app):
                 from_format = data.get('from_format')
                 to_format = data.get('to_format')
                 options = data.get('options', '')
+                mode = data.get('mode', 'sync')
+                output_mode = response_mode(request, data)
             else:
                 conversion_type = request.form.get('conversion_type')
                 from_format = request.form.get('from_format')
                 to_format = request.form.get('to_format')
                 options = request.form.get('options', '')
+                mode = request.values.get('mode', 'sync')
+                output_mode = response_mode(request)
+            use_cache = cache_requested(request)
 
             # Validate required parameters
             if not conversion_type:
@@ -155,6 +319,12 @@ def register_conversion_routes(app):
                 return jsonify({'error': 'From format is required'}), 400
             if not to_format:
                 return jsonify({'error': 'To format is required'}), 400
+            if mode not in JOB_MODES:
+                return jsonify({'error': f'Invalid mode. Allowed modes: {", ".join(JOB_MODES)}'}), 400
+            if output_mode not in RESPONSE_MODES:
+                return jsonify({'error': f'Invalid response mode. Allowed modes: {", ".join(RESPONSE_MODES)}'}), 400
+            run_async = wants_async(mode, request.content_length)
+            embed_output = output_mode == 'json'
 
             if conversion_type == 'file':
                 if 'file' not in request.files:
@@ -167,25 +337,14 @@ def register_conversion_routes(app):
                 if not allowed_file(file.filename):
                     return jsonify({'error': 'File type not allowed'}), 400
                 
-                try:
-                    # Save uploaded file
-                    filename = secure_filename(file.filename)
-                    filepath = os.path.join(UPLOAD_FOLDER, filename)
-                    file.save(filepath)
-                    
-                    # Process file conversion
-                    result = process_file_conversion(filepath, from_format, to_format, options)
-                    
-                    # Clean up uploaded file if it exists
-                    if os.path.exists(filepath):
-                        os.remove(filepath)
-                    
-                    return jsonify(result)
-                except Exception as e:
-                    # Clean up uploaded file in case of error
-                    if 'filepath' in locals() and os.path.exists(filepath):
-                        os.remove(filepath)
-                    raise e
+                # Save uploaded file
+                filename = secure_filename(file.filename)
+                filepath = os.path.join(create_workspace(), filename)
+                input_hash = ingest_upload(file, filepath)
+
+                # Process file conversion
+                return run_file_conversion(filepath, filename, from_format, to_format, options, output_mode,
+                                           run_async=run_async, use_cache=use_cache, input_hash=input_hash)
                 
             elif conversion_type == 'text':
                 if request.is_json:
@@ -196,9 +355,16 @@ def register_conversion_routes(app):
                 if not text:
                     return jsonify({'error': 'Text is required'}), 400
                     
+                if run_async:
+                    job = job_manager.submit('text', recorded(process_text_conversion, 'text', None, from_format, to_format),
+                                             text, from_format, to_format, options,
+                                             use_cache=use_cache, save_output=not embed_output)
+                    return jsonify(job_summary(job)), 202
+
                 # Process text conversion
-                result = process_text_conversion(text, from_format, to_format, options)
-                return jsonify(result)
+                result = recorded(process_text_conversion, 'text', None, from_format, to_format)(
+                    text, from_format, to_format, options, use_cache=use_cache, save_output=not embed_output)
+                return conversion_response(result, output_mode, to_format)
                 
             elif conversion_type == 'base64':
                 if request.is_json:
@@ -209,13 +375,23 @@ def register_conversion_routes(app):
                 if not base64_data:
                     return jsonify({'error': 'Base64 data is required'}), 400
                     
+                if run_async:
+                    job = job_manager.submit('base64', recorded(process_base64_conversion, 'base64', None, from_format, to_format),
+                                             base64_data, from_format, to_format, options,
+                                             use_cache=use_cache, save_output=not embed_output)
+                    return jsonify(job_summary(job)), 202
+
                 # Process base64 conversion
-                result = process_base64_conversion(base64_data, from_format, to_format, options)
-                return jsonify(result)
+                result = recorded(process_base64_conversion, 'base64', None, from_format, to_format)(
+                    base64_data, from_format, to_format, options, use_cache=use_cache, save_output=not embed_output)
+                return conversion_response(result, output_mode, to_format)
                 
             else:
                 return jsonify({'error': 'Invalid conversion type'}), 400
                 
+        except ServerBusy:
+            # Rendered as 503 with Retry-After by the app-level error handler
+            raise
         except Exception as e:
             app.logger.error(f"Conversion error: {str(e)}")
             return jsonify({'error': str(e)}), 500
@@ -229,7 +405,8 @@ def register_conversion_routes(app):
             'multipart/form-data'
         ],
         'produces': [
-            'application/json'
+            'application/json',
+            'application/octet-stream'
         ],
         'parameters': [
             {
@@ -268,6 +445,32 @@ def register_conversion_routes(app):
                 'type': 'string',
                 'required': False,
                 'description': 'Additional ImageMagick options'
+            },
+            {
+                'name': 'engine',
+                'in': 'formData',
+                'type': 'string',
+                'required': False,
+                'enum': ['auto', 'pillow', 'imagemagick'],
+                'description': 'Image engine; auto (default, from IMAGE_ENGINE) uses Pillow for common raster conversions and ImageMagick otherwise'
+            },
+            {
+                'name': 'mode',
+                'in': 'formData',
+                'type': 'string',
+                'required': False,
+                'default': 'sync',
+                'enum': ['sync', 'async', 'auto'],
+                'description': 'sync converts inline; async returns a job id right away; auto runs inputs above JOB_ASYNC_THRESHOLD_MB as a job',
+            },
+            {
+                'name': 'response',
+                'in': 'formData',
+                'type': 'string',
+                'required': False,
+                'default': 'json',
+                'enum': ['json', 'url', 'raw'],
+                'description': 'json returns the result with embedded content; url returns only the download URL; raw streams the converted bytes with their Content-Type',
             }
         ],
         'responses': {
@@ -291,10 +494,26 @@ def register_conversion_routes(app):
                         'message': {
                             'type': 'string',
                             'description': 'Success message'
+                        },
+                        'engine': {
+                            'type': 'string',
+                            'description': 'Engine that produced the image (pillow or imagemagick)'
                         }
                     }
                 }
             },
+            '202': {
+                'description': 'Conversion submitted as a background job (mode=async or auto)',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'jobId': {'type': 'string'},
+                        'status': {'type': 'string'},
+                        'statusUrl': {'type': 'string'},
+                        'resultUrl': {'type': 'string'}
+                    }
+                }
+            },
             '400': {
                 'description': 'Bad request',
                 'schema': {
@@ -307,6 +526,12 @@ def register_conversion_routes(app):
                     }
                 }
             },
+            '422': {
+                'description': 'Conversion failed (response=url or raw)'
+            },
+            '503': {
+                'description': 'Server saturated (too many queued conversions or jobs); retry after the number of seconds in the Retry-After header'
+            },
             '500': {
                 'description': 'Server error',
                 'schema': {
@@ -332,64 +557,141 @@ def register_conversion_routes(app):
                 return jsonify({'error': 'No selected image'}), 400
                 
             # Check image extension
-            allowed_extensions = [
-                'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp', 'tiff', 'svg', 'ico',
-                'heic', 'heif', 'avif', 'pdf', 'psd', 'ai', 'eps', 'raw', 'cr2', 'nef',
-                'arw', 'dng', 'orf', 'rw2', 'rwl', 'pcx', 'tga', 'xcf', 'pnm', 'pbm',
-                'pgm', 'ppm', 'xpm', 'xbm', 'jxr', 'wdp', 'hdp', 'jp2', 'j2k', 'jpf',
-                'jpx', 'jpm', 'djvu', 'jxl', 'wmf', 'emf'
-            ]
-            ext = image.filename.rsplit('.', 1)[1].lower() if '.' in image.filename else ''
-            if ext not in allowed_extensions:
-                return jsonify({'error': f'Image format not supported. Allowed formats: {", ".join(allowed_extensions)}'}), 400
-                
-            # Get target format
-            to_format = request.form.get('to_format')
-            if not to_format:
-                return jsonify({'error': 'Target format is required'}), 400
-                
-            # Validate target format
-            if to_format.lower() not in allowed_extensions:
-                return jsonify({'error': f'Target format not supported. Allowed formats: {", ".join(allowed_extensions)}'}), 400
-                
-            # Get optional parameters
-            quality = request.form.get('quality', 90)
-            try:
-                quality = int(quality)
-                if quality < 1 or quality > 100:
-                    return jsonify({'error': 'Quality must be between 1 and 100'}), 400
-            except ValueError:
-                return jsonify({'error': 'Quality must be a number between 1 and 100'}), 400
-                
-            resize = request.form.get('resize', None)
-            options = request.form.get('options', None)
+            ext = image_extension(image.filename)
+            if ext not in IMAGE_EXTENSIONS:
+                return jsonify({'error': f'Image format not supported. Allowed formats: {", ".join(IMAGE_EXTENSIONS)}'}), 400
+
+            # Target format and optional parameters
+            params, error = image_options(request.form)
+            if error:
+                return jsonify({'error': error}), 400
+
+            mode = request.values.get('mode', 'sync')
+            if mode not in JOB_MODES:
+                return jsonify({'error': f'Invalid mode. Allowed modes: {", ".join(JOB_MODES)}'}), 400
+            output_mode = response_mode(request)
+            if output_mode not in RESPONSE_MODES:
+                return jsonify({'error': f'Invalid response mode. Allowed modes: {", ".join(RESPONSE_MODES)}'}), 400
                 
             # Save uploaded image
             filename = secure_filename(image.filename)
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            image.save(filepath)
-                
-            try:
-                # Process image conversion
-                result = process_image_conversion(filepath, to_format, quality, resize, options)
-                
-                # Add base64 encoding of the converted image
-                if 'output_path' in result and os.path.exists(result['output_path']):
-                    with open(result['output_path'], "rb") as image_file:
-                        encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-                        result['base64'] = encoded_string
-                
-                # Clean up uploaded file
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                    
-                return jsonify(result)
-            except Exception as e:
-                # Clean up uploaded file in case of error
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                raise e
+            filepath = os.path.join(create_workspace(), filename)
+            input_hash = ingest_upload(image, filepath)
+
+            # Process image conversion
+            return run_image_conversion(filepath, filename, params, output_mode, input_hash=input_hash,
+                                        run_async=wants_async(mode, request.content_length))
                 
+        except ServerBusy:
+            # Rendered as 503 with Retry-After by the app-level error handler
+            raise
         except Exception as e:
             app.logger.error(f"Image conversion error: {str(e)}")
-            return jsonify({'error': str(e)}), 500 
\ No newline at end of file
+            return jsonify({'error': str(e)}), 500 
+    @app.route('/convert/batch', methods=['POST'])
+    @swag_from({
+        'tags': ['Conversion'],
+        'summary': 'Convert many files in one request',
+        'description': 'Converts several uploaded files, or every file inside an uploaded ZIP archive, in parallel. '
+                       'The response is a ZIP archive streamed as conversions finish; manifest.json, written last, '
+                       'lists the status of every input. A file that fails to convert does not stop the batch; '
+                       'files that found the server busy for too long are listed as busy and retryable.',
+        'consumes': [
+            'multipart/form-data'
+        ],
+        'produces': [
+            'application/zip',
+            'application/json'
+        ],
+        'parameters': [
+            {
+                'name': 'files',
+                'in': 'formData',
+                'type': 'file',
+                'required': False,
+                'description': 'Files to convert (repeat the field for each file)'
+            },
+            {
+                'name': 'archive',
+                'in': 'formData',
+                'type': 'file',
+                'required': False,
+                'description': 'ZIP archive whose files should be converted'
+            },
+            {
+                'name': 'to_format',
+                'in': 'formData',
+                'type': 'string',
+                'required': True,
+                'description': 'Target format for every file (e.g., html, pdf, markdown)'
+            },
+            {
+                'name': 'from_format',
+                'in': 'formData',
+                'type': 'string',
+                'required': False,
+                'description': 'Source format for every file; inferred from each file extension when omitted'
+            },
+            {
+                'name': 'options',
+                'in': 'formData',
+                'type': 'string',
+                'required': False,
+                'description': 'Additional Pandoc options applied to every file'
+            },
+            {
+                'name': 'cache',
+                'in': 'formData',
+                'type': 'boolean',
+                'required': False,
+                'default': True,
+                'description': 'Set to false to bypass the conversion cache'
+            }
+        ],
+        'responses': {
+            '200': {
+                'description': 'ZIP archive with the converted files and manifest.json'
+            },
+            '400': {
+                'description': 'Invalid request (no files, invalid archive or batch limits exceeded)'
+            },
+            '500': {
+                'description': 'Server error'
+            }
+        }
+    })
+    def convert_batch():
+        batch = Batch()
+        try:
+            to_format = request.form.get('to_format')
+            from_format = request.form.get('from_format') or None
+            options = request.form.get('options', '')
+            use_cache = cache_requested(request)
+
+            if not to_format:
+                return jsonify({'error': 'To format is required'}), 400
+            files = [f for f in request.files.getlist('files') if f.filename]
+            archives = [f for f in request.files.getlist('archive') if f.filename]
+            if not files and not archives:
+                return jsonify({'error': 'No files or archive provided'}), 400
+
+            for file in files:
+                batch.add_upload(file, from_format)
+            for archive in archives:
+                batch.add_archive(archive, from_format)
+            if not batch.items:
+                batch.discard()
+                return jsonify({'error': 'No convertible files in batch', 'items': batch.rejected}), 400
+
+            # The generator owns the staged files from here and removes them when done
+            response = Response(stream_batch(batch, to_format, options, use_cache), mimetype='application/zip')
+            response.headers['Content-Disposition'] = f'attachment; filename=batch-{batch.id}.zip'
+            response.headers['X-Batch-Id'] = batch.id
+            return response
+        except BatchError as e:
+            batch.discard()
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            batch.discard()
+            app.logger.error(f"Batch conversion error: {str(e)}")
+            return jsonify({'error': str(e)}), 500
@@ -0,0 +1,115 @@
+from flask import jsonify, request
+from src.config.swagger import swag_from
+
+from src.utils.jobs import job_manager, job_summary
+from src.utils.responses import response_mode, conversion_response, RESPONSE_MODES
+
+def register_job_routes(app):
+    """Register routes for asynchronous conversion jobs"""
+
+    @app.route('/api/jobs/<job_id>', methods=['GET'])
+    @swag_from({
+        'tags': ['Jobs'],
+        'summary': 'Get conversion job status',
+        'description': 'Status and progress of a conversion submitted with mode=async (or mode=auto for large inputs)',
+        'produces': [
+            'application/json'
+        ],
+        'parameters': [
+            {
+                'name': 'job_id',
+                'in': 'path',
+                'type': 'string',
+                'required': True,
+                'description': 'Job id returned when the conversion was submitted'
+            }
+        ],
+        'responses': {
+            '200': {
+                'description': 'Job status',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'jobId': {'type': 'string'},
+                        'kind': {'type': 'string'},
+                        'status': {
+                            'type': 'string',
+                            'enum': ['queued', 'running', 'done', 'failed']
+                        },
+                        'progress': {
+                            'type': 'integer',
+                            'description': 'Progress in percent'
+                        },
+                        'downloadUrl': {
+                            'type': 'string',
+                            'description': 'URL of the converted file once the job is done'
+                        },
+                        'resultUrl': {
+                            'type': 'string',
+                            'description': 'URL returning the full conversion result'
+                        },
+                        'error': {'type': 'string'}
+                    }
+                }
+            },
+            '404': {
+                'description': 'Unknown job'
+            }
+        }
+    })
+    def get_job(job_id):
+        job = job_manager.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(job_summary(job))
+
+    @app.route('/api/jobs/<job_id>/result', methods=['GET'])
+    @swag_from({
+        'tags': ['Jobs'],
+        'summary': 'Get conversion job result',
+        'description': 'Returns the same payload as the synchronous conversion once the job has finished',
+        'produces': [
+            'application/json',
+            'application/octet-stream'
+        ],
+        'parameters': [
+            {
+                'name': 'job_id',
+                'in': 'path',
+                'type': 'string',
+                'required': True,
+                'description': 'Job id returned when the conversion was submitted'
+            },
+            {
+                'name': 'response',
+                'in': 'query',
+                'type': 'string',
+                'required': False,
+                'default': 'json',
+                'enum': ['json', 'url', 'raw'],
+                'description': 'json returns the stored result; url returns only the download URL; raw streams the converted file'
+            }
+        ],
+        'responses': {
+            '200': {
+                'description': 'Conversion result'
+            },
+            '202': {
+                'description': 'Job is still queued or running'
+            },
+            '404': {
+                'description': 'Unknown job'
+            }
+        }
+    })
+    def get_job_result(job_id):
+        job = job_manager.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        if job['status'] in ('queued', 'running'):
+            return jsonify(job_summary(job)), 202
+
+        output_mode = response_mode(request)
+        if output_mode not in RESPONSE_MODES:
+            return jsonify({'error': f'Invalid response mode. Allowed modes: {", ".join(RESPONSE_MODES)}'}), 400
+        return conversion_response(job['result'], output_mode)
@@ -1,23 +1,50 @@
-from flask import render_template, send_file
+from flask import render_template, send_file, abort, request
+from werkzeug.utils import safe_join
+import mimetypes
 import os
-from src.config.config import APP_AUTHOR, PANDOC_INPUT_FORMATS, PANDOC_OUTPUT_FORMATS, PANDOC_COMMON_OPTIONS, UPLOAD_FOLDER
+from src.config.config import APP_AUTHOR, PANDOC_COMMON_OPTIONS, UPLOAD_FOLDER, ASSETS_MAX_AGE
+from src.utils.assets import assets
+from src.utils.capabilities import capabilities
+from src.utils.workspace import touch
 
 def register_main_routes(app):
     """Register main application routes"""
     
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
     
+    # {{ asset_url('css/style.css') }} in templates
+    app.add_template_global(assets.url, 'asset_url')
+    
     @app.route('/')
     def index():
         return render_template('index.html', 
-                            input_formats=PANDOC_INPUT_FORMATS,
-                            output_formats=PANDOC_OUTPUT_FORMATS,
+                            input_formats=capabilities.input_formats,
+                            output_formats=capabilities.output_formats,
                             common_options=PANDOC_COMMON_OPTIONS,
                             author=APP_AUTHOR)
 
-    @app.route('/download/<filename>')
+    @app.route('/download/<path:filename>')
     def download_file(filename):
+        # Files live in per-conversion workspaces: /download/<workspace>/<name>
+        path = safe_join(UPLOAD_FOLDER, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        touch(path)
         return send_file(
-            os.path.join(UPLOAD_FOLDER, filename),
+            path,
             as_attachment=True
-        ) 
\ No newline at end of file
+        )
+
+    @app.route('/assets/<path:filename>')
+    def serve_asset(filename):
+        # Fingerprinted names change with the content, so browsers may keep them for good
+        found = assets.find(filename, request.accept_encodings)
+        if found is None:
+            abort(404)
+        path, encoding = found
+        response = send_file(path, mimetype=mimetypes.guess_type(filename)[0], max_age=ASSETS_MAX_AGE)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = f'public, max-age={ASSETS_MAX_AGE}, immutable'
+        return response
@@ -0,0 +1,122 @@
+import time
+from flask import jsonify, request, g, Response
+from src.config.swagger import swag_from
+
+from src.config.config import SERVER_TIMING_ENABLED, PROFILE_SLOW_REQUESTS
+from src.utils.metrics import (
+    METRICS_AVAILABLE, REQUEST_SECONDS, REQUEST_BYTES, RESPONSE_BYTES, REQUESTS_IN_FLIGHT, format_label, render
+)
+from src.utils.timing import RequestProfiler, server_timing, profiling_enabled
+
+def register_metrics_routes(app):
+    """
+    Register the Prometheus endpoint and the per-request instrumentation:
+    metrics, the Server-Timing header and slow-request profiling.
+    """
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.monotonic()
+        REQUESTS_IN_FLIGHT.inc()
+        REQUEST_BYTES.labels(_route()).inc(request.content_length or 0)
+        if profiling_enabled():
+            profiler = RequestProfiler()
+            if profiler.start():
+                g.profiler = profiler
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        elapsed = time.monotonic() - started
+        route = _route()
+        from_format, to_format = _format_pair()
+        REQUEST_SECONDS.labels(route, request.method, str(response.status_code),
+                               format_label(from_format), format_label(to_format)).observe(elapsed)
+        if SERVER_TIMING_ENABLED:
+            response.headers['Server-Timing'] = server_timing(g.get('stage_timings', {}), elapsed)
+        _finish_profile(elapsed)
+        if response.content_length is not None:
+            RESPONSE_BYTES.labels(route).inc(response.content_length)
+        elif response.is_streamed:
+            # Streamed bodies of unknown length (ZIPs) are counted as they are sent
+            response.response = _count_bytes(response.response, route)
+        else:
+            RESPONSE_BYTES.labels(route).inc(response.calculate_content_length() or 0)
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exc):
+        REQUESTS_IN_FLIGHT.dec()
+        # Requests that failed before after_request still need their profiler switched off
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.stop()
+
+    @app.route('/metrics', methods=['GET'])
+    @swag_from({
+        'tags': ['Monitoring'],
+        'summary': 'Prometheus metrics',
+        'description': 'Request latency by route and format pair, external tool wall/CPU time, bytes in/out, '
+                       'cache hits and misses, in-flight and queued conversions and conversion strategy outcomes, '
+                       'aggregated over all server processes',
+        'produces': [
+            'text/plain'
+        ],
+        'responses': {
+            '200': {
+                'description': 'Metrics in the Prometheus text exposition format'
+            },
+            '501': {
+                'description': 'prometheus_client is not installed or METRICS_ENABLED is off'
+            }
+        }
+    })
+    def metrics():
+        if not METRICS_AVAILABLE:
+            return jsonify({'error': 'Metrics are not available (install prometheus_client and set METRICS_ENABLED)'}), 501
+        body, content_type = render()
+        return Response(body, content_type=content_type)
+
+def _finish_profile(elapsed):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return
+    profiler.stop()
+    if elapsed >= PROFILE_SLOW_REQUESTS:
+        try:
+            path = profiler.dump(f'{request.method} {request.path}', elapsed)
+            print(f"Slow request {request.method} {request.path} took {elapsed:.2f}s, profile written to {path}")
+        except OSError as e:
+            print(f"Could not write request profile: {str(e)}")
+
+def _route():
+    # The URL rule, not the path, so /download/<path:filename> is one series
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+def _format_pair():
+    """Source and target format of a conversion request, from whatever the view already parsed"""
+    values = dict(request.args.items())
+    # Only look at form fields if the view parsed them; never read a body after the fact
+    if 'form' in request.__dict__:
+        values.update(request.form.items())
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            values.update((key, data[key]) for key in ('from_format', 'to_format') if isinstance(data.get(key), str))
+    from_format = values.get('from_format')
+    if not from_format and 'files' in request.__dict__ and request.files.get('image'):
+        # Image conversions take the source format from the file name
+        filename = request.files['image'].filename or ''
+        from_format = filename.rsplit('.', 1)[-1] if '.' in filename else None
+    return from_format, values.get('to_format')
+
+def _count_bytes(chunks, route):
+    try:
+        for chunk in chunks:
+            RESPONSE_BYTES.labels(route).inc(len(chunk))
+            yield chunk
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
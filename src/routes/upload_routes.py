@@ -0,0 +1,380 @@
+import os
+from flask import request, jsonify
+from src.config.swagger import swag_from
+
+from src.config.config import allowed_file, UPLOAD_CHUNK_SIZE, MAX_CONTENT_LENGTH
+from src.utils.cache import cache_requested
+from src.utils.jobs import wants_async, JOB_MODES
+from src.utils.governor import ServerBusy
+from src.utils.responses import response_mode, RESPONSE_MODES
+from src.utils.uploads import upload_manager, UploadError
+from src.routes.conversion_routes import (
+    IMAGE_EXTENSIONS, image_extension, image_options, run_file_conversion, run_image_conversion
+)
+
+# Bodies a PATCH may carry: the raw chunk bytes (tus uses the first)
+CHUNK_TYPES = ('application/offset+octet-stream', 'application/octet-stream')
+
+UPLOAD_STATE_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'id': {'type': 'string'},
+        'filename': {'type': 'string'},
+        'size': {'type': 'integer'},
+        'offset': {'type': 'integer', 'description': 'Bytes received without a gap from the start of the file'},
+        'received': {'type': 'integer', 'description': 'Bytes received in total'},
+        'complete': {'type': 'boolean'},
+        'missing': {
+            'type': 'array',
+            'description': 'Byte ranges [start, end) still to send',
+            'items': {'type': 'array', 'items': {'type': 'integer'}}
+        }
+    }
+}
+
+def _state_response(state, status=200):
+    response = jsonify(state)
+    response.status_code = status
+    response.headers['Upload-Offset'] = str(state['offset'])
+    response.headers['Upload-Length'] = str(state['size'])
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def _error_response(error):
+    return jsonify({'error': str(error), **error.details}), error.status
+
+def register_upload_routes(app):
+    """Register routes for chunked, resumable uploads"""
+
+    @app.route('/api/uploads', methods=['POST'])
+    @swag_from({
+        'tags': ['Uploads'],
+        'summary': 'Start a resumable upload',
+        'description': 'Creates an upload session for a large file. Send the file in chunks with PATCH '
+                       '/api/uploads/{upload_id}, in any order and in parallel, then convert it with '
+                       'POST /api/uploads/{upload_id}/convert.',
+        'consumes': [
+            'application/json'
+        ],
+        'parameters': [
+            {
+                'name': 'body',
+                'in': 'body',
+                'required': True,
+                'schema': {
+                    'type': 'object',
+                    'required': ['filename', 'size'],
+                    'properties': {
+                        'filename': {'type': 'string', 'description': 'Name of the file, its extension decides how it can be converted'},
+                        'size': {'type': 'integer', 'description': 'Exact file size in bytes'},
+                        'checksum': {'type': 'string', 'description': 'Optional SHA-256 hex digest of the whole file, verified before conversion'}
+                    }
+                }
+            }
+        ],
+        'responses': {
+            '201': {
+                'description': 'Upload created; its URL is in the Location header',
+                'schema': {
+                    'allOf': [
+                        UPLOAD_STATE_SCHEMA,
+                        {
+                            'type': 'object',
+                            'properties': {
+                                'chunkSize': {'type': 'integer', 'description': 'Suggested chunk size in bytes'},
+                                'maxChunkSize': {'type': 'integer', 'description': 'Largest chunk accepted in bytes'}
+                            }
+                        }
+                    ]
+                }
+            },
+            '400': {
+                'description': 'Missing name or size, unsupported file type or malformed checksum'
+            },
+            '413': {
+                'description': 'File larger than RESUMABLE_UPLOAD_MAX_MB'
+            },
+            '507': {
+                'description': 'Not enough disk space'
+            }
+        }
+    })
+    def create_upload():
+        data = request.get_json(silent=True) or {}
+        filename = data.get('filename') or ''
+        if not (allowed_file(filename) or image_extension(filename) in IMAGE_EXTENSIONS):
+            return jsonify({'error': 'File type not allowed'}), 400
+        try:
+            state = upload_manager.create(filename, data.get('size'), data.get('checksum'))
+        except UploadError as e:
+            return _error_response(e)
+        state.update({'chunkSize': min(UPLOAD_CHUNK_SIZE, MAX_CONTENT_LENGTH), 'maxChunkSize': MAX_CONTENT_LENGTH})
+        response = _state_response(state, 201)
+        response.headers['Location'] = f"/api/uploads/{state['id']}"
+        return response
+
+    @app.route('/api/uploads/<upload_id>', methods=['PATCH'])
+    @swag_from({
+        'tags': ['Uploads'],
+        'summary': 'Upload a chunk',
+        'description': 'Writes the request body at the given offset of the file. Chunks may be sent in any '
+                       'order and in parallel; a failed chunk is simply sent again.',
+        'consumes': [
+            'application/offset+octet-stream',
+            'application/octet-stream'
+        ],
+        'parameters': [
+            {
+                'name': 'upload_id',
+                'in': 'path',
+                'type': 'string',
+                'required': True
+            },
+            {
+                'name': 'Upload-Offset',
+                'in': 'header',
+                'type': 'integer',
+                'required': True,
+                'description': 'Byte offset of this chunk in the file'
+            },
+            {
+                'name': 'Upload-Checksum',
+                'in': 'header',
+                'type': 'string',
+                'required': False,
+                'description': 'Checksum of this chunk as "<algorithm> <base64 digest>", e.g. "sha256 47DEQpj8..."'
+            },
+            {
+                'name': 'body',
+                'in': 'body',
+                'required': True,
+                'schema': {'type': 'string', 'format': 'binary'}
+            }
+        ],
+        'responses': {
+            '200': {
+                'description': 'Chunk stored',
+                'schema': UPLOAD_STATE_SCHEMA
+            },
+            '400': {
+                'description': 'Missing offset or chunk cut short'
+            },
+            '404': {
+                'description': 'Unknown or expired upload'
+            },
+            '409': {
+                'description': 'Upload is being converted'
+            },
+            '411': {
+                'description': 'Content-Length missing'
+            },
+            '413': {
+                'description': 'Chunk larger than MAX_UPLOAD_MB'
+            },
+            '415': {
+                'description': 'Body is not application/offset+octet-stream'
+            },
+            '416': {
+                'description': 'Chunk extends past the end of the file'
+            },
+            '460': {
+                'description': 'Chunk checksum mismatch'
+            }
+        }
+    })
+    def upload_chunk(upload_id):
+        if request.mimetype not in CHUNK_TYPES:
+            return jsonify({'error': f'Chunks must be sent as {CHUNK_TYPES[0]}'}), 415
+        if request.content_length is None:
+            return jsonify({'error': 'Content-Length is required'}), 411
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+        except ValueError:
+            return jsonify({'error': 'Upload-Offset header is required'}), 400
+        try:
+            state = upload_manager.write_chunk(upload_id, offset, request.content_length, request.stream,
+                                               request.headers.get('Upload-Checksum'))
+        except UploadError as e:
+            return _error_response(e)
+        return _state_response(state)
+
+    @app.route('/api/uploads/<upload_id>', methods=['GET'])
+    @swag_from({
+        'tags': ['Uploads'],
+        'summary': 'Get upload progress',
+        'description': 'Which byte ranges have been received, to resume an interrupted upload. '
+                       'HEAD returns the same Upload-Offset and Upload-Length headers without a body.',
+        'parameters': [
+            {
+                'name': 'upload_id',
+                'in': 'path',
+                'type': 'string',
+                'required': True
+            }
+        ],
+        'responses': {
+            '200': {
+                'description': 'Upload state',
+                'schema': UPLOAD_STATE_SCHEMA
+            },
+            '404': {
+                'description': 'Unknown or expired upload'
+            }
+        }
+    })
+    def get_upload(upload_id):
+        try:
+            return _state_response(upload_manager.state(upload_id))
+        except UploadError as e:
+            return _error_response(e)
+
+    @app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+    @swag_from({
+        'tags': ['Uploads'],
+        'summary': 'Cancel an upload',
+        'parameters': [
+            {
+                'name': 'upload_id',
+                'in': 'path',
+                'type': 'string',
+                'required': True
+            }
+        ],
+        'responses': {
+            '204': {
+                'description': 'Upload deleted'
+            },
+            '404': {
+                'description': 'Unknown or expired upload'
+            }
+        }
+    })
+    def delete_upload(upload_id):
+        try:
+            upload_manager.discard(upload_id)
+        except UploadError as e:
+            return _error_response(e)
+        return '', 204
+
+    @app.route('/api/uploads/<upload_id>/convert', methods=['POST'])
+    @swag_from({
+        'tags': ['Uploads'],
+        'summary': 'Convert a finished upload',
+        'description': 'Verifies the assembled file and converts it like /convert (conversion_type=file) or '
+                       '/convert/image (conversion_type=image). The upload is removed once the conversion starts.',
+        'consumes': [
+            'application/json'
+        ],
+        'produces': [
+            'application/json',
+            'application/octet-stream'
+        ],
+        'parameters': [
+            {
+                'name': 'upload_id',
+                'in': 'path',
+                'type': 'string',
+                'required': True
+            },
+            {
+                'name': 'body',
+                'in': 'body',
+                'required': True,
+                'schema': {
+                    'type': 'object',
+                    'required': ['to_format'],
+                    'properties': {
+                        'conversion_type': {'type': 'string', 'enum': ['file', 'image'], 'default': 'file'},
+                        'from_format': {'type': 'string', 'description': 'Source format (file conversions)'},
+                        'to_format': {'type': 'string'},
+                        'options': {'type': 'string'},
+                        'quality': {'type': 'integer', 'description': 'Image quality (1-100)', 'default': 90},
+                        'resize': {'type': 'string', 'description': 'Resize parameter (e.g., 800x600, 50%)'},
+                        'engine': {'type': 'string', 'description': 'Image engine'},
+                        'mode': {'type': 'string', 'enum': list(JOB_MODES), 'default': 'sync'},
+                        'response': {'type': 'string', 'enum': list(RESPONSE_MODES), 'default': 'json'},
+                        'cache': {'type': 'boolean', 'default': True}
+                    }
+                }
+            }
+        ],
+        'responses': {
+            '200': {
+                'description': 'Conversion result, as returned by /convert or /convert/image'
+            },
+            '202': {
+                'description': 'Conversion submitted as a job (mode=async, or mode=auto for large files)'
+            },
+            '400': {
+                'description': 'Invalid parameters'
+            },
+            '404': {
+                'description': 'Unknown or expired upload'
+            },
+            '409': {
+                'description': 'Upload incomplete (the missing ranges are listed), chunks still being written, or already being converted'
+            },
+            '460': {
+                'description': 'The file does not match the checksum given at creation; the upload is discarded'
+            },
+            '503': {
+                'description': 'Server busy; the upload is kept, convert it again after the Retry-After delay'
+            }
+        }
+    })
+    def convert_upload(upload_id):
+        try:
+            data = request.get_json(silent=True) or {}
+            conversion_type = data.get('conversion_type', 'file')
+            mode = data.get('mode', 'sync')
+            output_mode = response_mode(request, data)
+            if mode not in JOB_MODES:
+                return jsonify({'error': f'Invalid mode. Allowed modes: {", ".join(JOB_MODES)}'}), 400
+            if output_mode not in RESPONSE_MODES:
+                return jsonify({'error': f'Invalid response mode. Allowed modes: {", ".join(RESPONSE_MODES)}'}), 400
+
+            # Validate everything before consuming the upload
+            filename = upload_manager.state(upload_id)['filename']
+            if conversion_type == 'file':
+                from_format = data.get('from_format')
+                to_format = data.get('to_format')
+                if not from_format:
+                    return jsonify({'error': 'From format is required'}), 400
+                if not to_format:
+                    return jsonify({'error': 'To format is required'}), 400
+                if not allowed_file(filename):
+                    return jsonify({'error': 'File type not allowed'}), 400
+            elif conversion_type == 'image':
+                if image_extension(filename) not in IMAGE_EXTENSIONS:
+                    return jsonify({'error': f'Image format not supported. Allowed formats: {", ".join(IMAGE_EXTENSIONS)}'}), 400
+                params, error = image_options(data)
+                if error:
+                    return jsonify({'error': error}), 400
+            else:
+                return jsonify({'error': 'Invalid conversion type'}), 400
+
+            filepath, filename, input_hash = upload_manager.finish(upload_id)
+            run_async = wants_async(mode, os.path.getsize(filepath))
+            busy = False
+            try:
+                if conversion_type == 'file':
+                    return run_file_conversion(filepath, filename, from_format, to_format, data.get('options', ''),
+                                               output_mode, run_async=run_async, use_cache=cache_requested(request),
+                                               input_hash=input_hash)
+                return run_image_conversion(filepath, filename, params, output_mode, run_async=run_async,
+                                            input_hash=input_hash)
+            except ServerBusy:
+                busy = True
+                raise
+            finally:
+                # A busy server keeps the upload, so the client can ask again after Retry-After without re-sending it
+                upload_manager.release(upload_id, keep=busy)
+
+        except UploadError as e:
+            return _error_response(e)
+        except ServerBusy:
+            # Rendered as 503 with Retry-After by the app-level error handler
+            raise
+        except Exception as e:
+            app.logger.error(f"Upload conversion error: {str(e)}")
+            return jsonify({'error': str(e)}), 500
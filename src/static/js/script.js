@@ -710,19 +710,20 @@ function downloadAllHistory() {
         return;
     }
     
-    // Create a JSON file with the history
-    const historyJson = JSON.stringify(history, null, 2);
-    const blob = new Blob([historyJson], { type: 'application/json' });
-    const url = URL.createObjectURL(blob);
-    
-    // Create a temporary link to download
+    // The server keeps the converted files; only send their ids and let the
+    // browser stream the ZIP straight to disk
+    const ids = history.map(item => item.historyId).filter(Boolean);
+    if (ids.length === 0) {
+        showToast('These conversions are no longer stored on the server', 'error');
+        return;
+    }
+
     const a = document.createElement('a');
-    a.href = url;
-    a.download = 'conversion_history.json';
+    a.href = '/api/history/download?ids=' + encodeURIComponent(ids.join(','));
+    a.download = 'conversion_history.zip';
     document.body.appendChild(a);
     a.click();
     document.body.removeChild(a);
-    URL.revokeObjectURL(url);
     
     showToast('History downloaded', 'success');
 }
@@ -808,11 +809,12 @@ function setupFormSubmission() {
                 return;
             }
             
-            showProgressBar();
+            const progress = showProgressBar();
+            const file = fileInput.files[0];
             
             // Create FormData to send file
             const formData = new FormData();
-            formData.append('file', fileInput.files[0]);
+            formData.append('file', file);
             formData.append('conversion_type', 'file');
             formData.append('from_format', fromFormat);
             formData.append('to_format', toFormat);
@@ -823,10 +825,24 @@ function setupFormSubmission() {
                 formData.append('options', options);
             }
             
-            fetch('/convert', {
-                method: 'POST',
-                body: formData
-            })
+            let request;
+            if (file.size >= CHUNKED_UPLOAD_THRESHOLD) {
+                // Large files go in resumable chunks; the bar shows the real upload progress
+                clearInterval(progress);
+                request = uploadInChunks(file, {
+                    conversion_type: 'file',
+                    from_format: fromFormat,
+                    to_format: toFormat,
+                    options: options || ''
+                });
+            } else {
+                request = fetch('/convert', {
+                    method: 'POST',
+                    body: formData
+                });
+            }
+            
+            request
             .then(response => {
                 if (!response.ok) {
                     throw new Error(`Server responded with ${response.status}`);
@@ -849,7 +865,8 @@ function setupFormSubmission() {
                     to: toFormat,
                     date: new Date().toISOString(),
                     isFile: true,
-                    downloadUrl: data.downloadUrl || data.download_url
+                    downloadUrl: data.downloadUrl || data.download_url,
+                    historyId: data.historyId
                 };
                 
                 addToHistory(historyItem);
@@ -885,10 +902,11 @@ function setupFormSubmission() {
             }
             
             // Show loading state
-            showLoadingOverlay('Converting image...');
+            const progress = showLoadingOverlay('Converting image...');
+            const image = imageInput.files[0];
             
             const formData = new FormData();
-            formData.append('image', imageInput.files[0]);
+            formData.append('image', image);
             
             // For regular image conversion
             formData.append('to_format', toFormat);
@@ -911,10 +929,22 @@ function setupFormSubmission() {
                 formData.append('options', optionsInput.value);
             }
             
-            fetch('/convert/image', {
-                method: 'POST',
-                body: formData
-            })
+            let request;
+            if (image.size >= CHUNKED_UPLOAD_THRESHOLD) {
+                clearInterval(progress);
+                // Same fields as the form, without the image itself
+                const conversion = Object.fromEntries(formData.entries());
+                delete conversion.image;
+                conversion.conversion_type = 'image';
+                request = uploadInChunks(image, conversion);
+            } else {
+                request = fetch('/convert/image', {
+                    method: 'POST',
+                    body: formData
+                });
+            }
+            
+            request
             .then(response => response.json())
             .then(data => {
                 hideLoadingOverlay();
@@ -993,7 +1023,8 @@ function setupFormSubmission() {
                     from: fromFormat,
                     to: toFormat,
                     date: new Date().toISOString(),
-                    content: data.result || data.content
+                    content: data.result || data.content,
+                    historyId: data.historyId
                 };
                 
                 addToHistory(historyItem);
@@ -1071,7 +1102,8 @@ function setupFormSubmission() {
                     date: new Date().toISOString(),
                     isFile: Boolean(data.downloadUrl || data.download_url),
                     downloadUrl: data.downloadUrl || data.download_url,
-                    content: data.result || data.content
+                    content: data.result || data.content,
+                    historyId: data.historyId
                 };
                 
                 addToHistory(historyItem);
@@ -1368,6 +1400,141 @@ function hideLoadingOverlay() {
     return hideProgressBar();
 }
 
+// Files at least this big are sent in chunks through /api/uploads, so a network
+// hiccup only costs the chunks in flight and an interrupted upload can resume
+const CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+const CHUNK_UPLOAD_CONCURRENCY = 3;
+const CHUNK_UPLOAD_RETRIES = 5;
+
+function sleep(ms) {
+    return new Promise(resolve => setTimeout(resolve, ms));
+}
+
+function setProgress(fraction) {
+    const progressBar = document.getElementById('progress-bar');
+    if (progressBar) {
+        progressBar.style.width = Math.min(100, fraction * 100) + '%';
+    }
+}
+
+async function uploadRequest(url, options) {
+    // Retry network errors and server-side failures with exponential backoff
+    for (let attempt = 0; ; attempt++) {
+        try {
+            const response = await fetch(url, options);
+            if (response.ok || (response.status < 500 && response.status !== 460)) {
+                return response;
+            }
+            if (attempt >= CHUNK_UPLOAD_RETRIES) {
+                return response;
+            }
+            const retryAfter = parseInt(response.headers.get('Retry-After'), 10);
+            await sleep(retryAfter > 0 ? retryAfter * 1000 : 500 * 2 ** attempt);
+        } catch (error) {
+            if (attempt >= CHUNK_UPLOAD_RETRIES) {
+                throw error;
+            }
+            await sleep(500 * 2 ** attempt);
+        }
+    }
+}
+
+async function chunkChecksum(blob) {
+    // crypto.subtle only exists on secure origins; the server then skips the per-chunk check
+    if (!window.crypto || !window.crypto.subtle) {
+        return null;
+    }
+    const digest = await window.crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+    return 'sha256 ' + btoa(String.fromCharCode(...new Uint8Array(digest)));
+}
+
+// Resume the upload session saved for this file, or start a new one
+async function openUploadSession(file, storageKey) {
+    const saved = JSON.parse(localStorage.getItem(storageKey) || 'null');
+    if (saved) {
+        const response = await fetch(`/api/uploads/${saved.id}`, { cache: 'no-store' });
+        if (response.ok) {
+            return Object.assign(await response.json(), { chunkSize: saved.chunkSize });
+        }
+        localStorage.removeItem(storageKey);
+    }
+    const response = await uploadRequest('/api/uploads', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ filename: file.name, size: file.size })
+    });
+    const session = await response.json();
+    if (!response.ok) {
+        throw new Error(session.error || `Server responded with ${response.status}`);
+    }
+    localStorage.setItem(storageKey, JSON.stringify({ id: session.id, chunkSize: session.chunkSize }));
+    return session;
+}
+
+/**
+ * Upload a file in parallel chunks, then convert it.
+ *
+ * @param {File} file - The file to upload
+ * @param {Object} conversion - Parameters of /api/uploads/<id>/convert (conversion_type, to_format, ...)
+ * @returns {Promise<Response>} The conversion response
+ */
+async function uploadInChunks(file, conversion) {
+    const storageKey = `upload:${file.name}:${file.size}:${file.lastModified}`;
+    const session = await openUploadSession(file, storageKey);
+    const uploadUrl = `/api/uploads/${session.id}`;
+
+    // Only the ranges the server does not have yet, cut to the suggested chunk size
+    const chunks = [];
+    session.missing.forEach(([start, end]) => {
+        for (let offset = start; offset < end; offset += session.chunkSize) {
+            chunks.push([offset, Math.min(end, offset + session.chunkSize)]);
+        }
+    });
+    let uploaded = session.received;
+    setProgress(uploaded / file.size);
+
+    async function sendChunks() {
+        while (chunks.length) {
+            const [start, end] = chunks.shift();
+            const blob = file.slice(start, end);
+            const headers = {
+                'Content-Type': 'application/offset+octet-stream',
+                'Upload-Offset': String(start)
+            };
+            const checksum = await chunkChecksum(blob);
+            if (checksum) {
+                headers['Upload-Checksum'] = checksum;
+            }
+            const response = await uploadRequest(uploadUrl, { method: 'PATCH', headers: headers, body: blob });
+            if (!response.ok) {
+                const data = await response.json().catch(() => ({}));
+                if (response.status === 404) {
+                    localStorage.removeItem(storageKey);
+                }
+                throw new Error(data.error || `Chunk upload failed with ${response.status}`);
+            }
+            uploaded += end - start;
+            setProgress(uploaded / file.size);
+        }
+    }
+    const workers = [];
+    for (let i = 0; i < CHUNK_UPLOAD_CONCURRENCY; i++) {
+        workers.push(sendChunks());
+    }
+    await Promise.all(workers);
+
+    // A busy server keeps the upload; uploadRequest waits for Retry-After and asks again
+    const response = await uploadRequest(`${uploadUrl}/convert`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(conversion)
+    });
+    if (response.status !== 503) {
+        localStorage.removeItem(storageKey);
+    }
+    return response;
+}
+
 // Show toast notification
 function showToast(message, type = 'info') {
     // Create toast container if it doesn't exist
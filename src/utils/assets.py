@@ -0,0 +1,204 @@
+"""
+Fingerprinted, precompressed static assets.
+
+The build minifies the page's stylesheet and script, names each copy after a
+hash of its content (css/style.3f2a9c1d04b7.css) and writes gzip and brotli
+variants next to it in ASSETS_FOLDER, along with a manifest.json mapping the
+source paths to the built ones. Because a changed file gets a new name,
+/assets/ URLs can be cached by browsers for a year without revalidation.
+
+The build runs at start-up (ASSETS_BUILD, once in the gunicorn master with
+preload) and only rewrites files whose source changed. It can also run ahead
+of deployment:
+
+    python -m src.utils.assets
+
+rjsmin/rcssmin minify when installed (otherwise CSS gets a simple comment and
+whitespace pass and JavaScript is only compressed) and brotli variants need
+the brotli package.
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+from werkzeug.utils import safe_join
+from src.config.config import ASSETS_FOLDER, STATIC_FOLDER
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Files under STATIC_FOLDER referenced by the templates through asset_url()
+ASSET_FILES = ('css/style.css', 'js/script.js')
+
+# Content-Encoding -> file suffix, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+MANIFEST_NAME = 'manifest.json'
+
+def _minify_css(text):
+    if rcssmin:
+        return rcssmin.cssmin(text)
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.DOTALL)
+    text = re.sub(r'\s+', ' ', text)
+    return re.sub(r'\s*([{};,>])\s*', r'\1', text).strip()
+
+def _minify_js(text):
+    # Without a real parser, leave the script alone rather than risk breaking it
+    return rjsmin.jsmin(text) if rjsmin else text
+
+MINIFIERS = {'.css': _minify_css, '.js': _minify_js}
+
+def _write_atomic(path, data):
+    # Workers may build concurrently without preload; never expose a half-written file
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def build_asset(source, static_folder=STATIC_FOLDER, assets_folder=ASSETS_FOLDER):
+    """
+    Minify, fingerprint and compress one static file.
+
+    Args:
+        source (str): Path relative to static_folder, e.g. 'css/style.css'
+
+    Returns:
+        str: Path of the built file relative to assets_folder
+    """
+    with open(os.path.join(static_folder, source), 'rb') as f:
+        data = f.read()
+    base, ext = os.path.splitext(source)
+    minify = MINIFIERS.get(ext)
+    if minify:
+        data = minify(data.decode('utf-8')).encode('utf-8')
+
+    built = f'{base}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+    path = os.path.join(assets_folder, built)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_atomic(path + '.gz', gzip.compress(data, 9, mtime=0))
+        if brotli:
+            _write_atomic(path + '.br', brotli.compress(data, quality=11))
+        # The plain file last: its presence marks the asset as complete
+        _write_atomic(path, data)
+    return built
+
+def build_assets(static_folder=STATIC_FOLDER, assets_folder=ASSETS_FOLDER, files=ASSET_FILES):
+    """
+    Build every asset and write the manifest.
+
+    Returns:
+        dict: Maps source paths to built paths
+    """
+    manifest = {source: build_asset(source, static_folder, assets_folder) for source in files}
+    _write_atomic(os.path.join(assets_folder, MANIFEST_NAME),
+                  json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    _remove_stale(assets_folder, manifest)
+    return manifest
+
+def _remove_stale(assets_folder, manifest):
+    """Delete builds of older versions, keeping the previous one for pages still open"""
+    for source, built in manifest.items():
+        folder = os.path.join(assets_folder, os.path.dirname(built))
+        base, ext = os.path.splitext(os.path.basename(source))
+        pattern = re.compile(rf'^{re.escape(base)}\.[0-9a-f]{{12}}{re.escape(ext)}$')
+        versions = sorted((entry for entry in os.scandir(folder) if pattern.match(entry.name)),
+                          key=lambda entry: entry.stat().st_mtime, reverse=True)
+        current = os.path.basename(built)
+        keep = {current, *[entry.name for entry in versions if entry.name != current][:1]}
+        for entry in versions:
+            if entry.name not in keep:
+                for suffix in ('', '.gz', '.br'):
+                    try:
+                        os.remove(entry.path + suffix)
+                    except OSError:
+                        pass
+
+class AssetRegistry:
+    """Maps asset names to their fingerprinted URLs and picks encoded variants to serve"""
+
+    def __init__(self, assets_folder=ASSETS_FOLDER):
+        self.assets_folder = assets_folder
+        self._manifest = None
+        self._lock = threading.Lock()
+
+    def build(self):
+        """Build the assets (see build_assets) and use the new manifest"""
+        with self._lock:
+            self._manifest = build_assets(assets_folder=self.assets_folder)
+            return self._manifest
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            with self._lock:
+                if self._manifest is None:
+                    try:
+                        with open(os.path.join(self.assets_folder, MANIFEST_NAME), encoding='utf-8') as f:
+                            self._manifest = json.load(f)
+                    except (OSError, ValueError):
+                        self._manifest = {}
+        return self._manifest
+
+    def url(self, source):
+        """URL of an asset: fingerprinted when built, the plain static file otherwise"""
+        built = self.manifest.get(source)
+        return f'/assets/{built}' if built else f'/static/{source}'
+
+    def find(self, filename, accept_encoding):
+        """
+        Pick the file to send for /assets/<filename>.
+
+        Args:
+            filename (str): Built path relative to the assets folder
+            accept_encoding: The request's Accept-Encoding header (werkzeug accept object)
+
+        Returns:
+            tuple: (path, content encoding or None), or None if there is no such asset
+        """
+        if filename == MANIFEST_NAME or filename.endswith(('.gz', '.br', '.tmp')):
+            return None
+        path = safe_join(self.assets_folder, filename)
+        if path is None or not os.path.isfile(path):
+            return None
+        for encoding, suffix in ENCODINGS:
+            if accept_encoding[encoding] and os.path.isfile(path + suffix):
+                return path + suffix, encoding
+        return path, None
+
+assets = AssetRegistry()
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Build fingerprinted, precompressed static assets')
+    parser.add_argument('--out', default=ASSETS_FOLDER, help=f'Output folder (default: {ASSETS_FOLDER})')
+    args = parser.parse_args(argv)
+
+    manifest = build_assets(assets_folder=args.out)
+    for source, built in manifest.items():
+        sizes = [os.path.getsize(os.path.join(STATIC_FOLDER, source)),
+                 os.path.getsize(os.path.join(args.out, built))]
+        sizes += [os.path.getsize(os.path.join(args.out, built + suffix))
+                  for _, suffix in reversed(ENCODINGS) if os.path.exists(os.path.join(args.out, built + suffix))]
+        print(f"{source} -> {built} ({' / '.join(f'{size:,}' for size in sizes)} bytes: source, minified, gzip, brotli)")
+    if not rjsmin or not rcssmin:
+        print('Install rjsmin and rcssmin for full minification')
+    if not brotli:
+        print('Install brotli to write brotli variants')
+
+if __name__ == '__main__':
+    main()
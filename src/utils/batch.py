@@ -0,0 +1,247 @@
+import hashlib
+import os
+import posixpath
+import shutil
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from werkzeug.utils import secure_filename
+from src.config.config import BATCH_WORKERS, BATCH_MAX_FILES, BATCH_MAX_BYTES, JOB_BUSY_TIMEOUT, allowed_file
+from src.utils.conversion import process_file_conversion
+from src.utils.governor import ServerBusy, wait_out_busy
+from src.utils.ingest import ingest_upload, copy_stream
+from src.utils.responses import output_path_for
+from src.utils.workspace import create_workspace
+from src.utils.zipstream import ZipStream
+
+# pandoc reader for each uploadable extension, used when no from_format is given
+EXTENSION_FORMATS = {
+    'docx': 'docx',
+    'odt': 'odt',
+    'epub': 'epub',
+    'md': 'markdown',
+    'txt': 'markdown',
+    'html': 'html',
+    'tex': 'latex',
+    'latex': 'latex',
+}
+
+class BatchError(ValueError):
+    """Raised when a batch request cannot be accepted as a whole"""
+
+def format_for(filename):
+    """Return the pandoc reader for a file name, or None if it cannot be inferred"""
+    return EXTENSION_FORMATS.get(os.path.splitext(filename)[1].lstrip('.').lower())
+
+def _safe_name(name):
+    """Sanitize a (possibly nested) archive member name, keeping its folders"""
+    parts = [secure_filename(part) for part in name.replace('\\', '/').split('/')]
+    parts = [part for part in parts if part]
+    return posixpath.join(*parts) if parts else ''
+
+class Batch:
+    """Files staged for one batch request, plus the ones rejected up front"""
+
+    def __init__(self):
+        self.workspace = create_workspace()
+        self.id = os.path.basename(self.workspace)[:12]
+        self.items = []
+        self.rejected = []
+
+    def _stage_path(self, name):
+        # The index keeps outputs apart when an archive holds the same name in several folders
+        return os.path.join(self.workspace, f'{len(self.items) + len(self.rejected)}-{os.path.basename(name)}')
+
+    def _accept(self, name, from_format):
+        """Check one input; returns its reader or None after recording the rejection"""
+        if not name:
+            self.rejected.append({'name': name, 'status': 'skipped', 'error': 'Empty file name'})
+            return None
+        if not allowed_file(name):
+            self.rejected.append({'name': name, 'status': 'skipped', 'error': 'File type not allowed'})
+            return None
+        reader = from_format or format_for(name)
+        if not reader:
+            self.rejected.append({'name': name, 'status': 'skipped', 'error': 'Cannot infer from_format'})
+            return None
+        if len(self.items) >= BATCH_MAX_FILES:
+            raise BatchError(f'Too many files in batch (maximum {BATCH_MAX_FILES})')
+        return reader
+
+    def add_upload(self, file_storage, from_format=None):
+        """Stage an uploaded file"""
+        name = secure_filename(file_storage.filename or '')
+        reader = self._accept(name, from_format)
+        if reader:
+            path = self._stage_path(name)
+            input_hash = ingest_upload(file_storage, path)
+            self.items.append({'name': name, 'path': path, 'from_format': reader, 'input_hash': input_hash})
+
+    def add_archive(self, file_storage, from_format=None):
+        """
+        Stage every member of an uploaded ZIP archive.
+
+        Raises:
+            BatchError: If the upload is not a ZIP archive or exceeds the batch limits
+        """
+        archive_path = os.path.join(self.workspace, 'archive.zip')
+        ingest_upload(file_storage, archive_path)
+        try:
+            try:
+                archive = zipfile.ZipFile(archive_path)
+            except zipfile.BadZipFile:
+                raise BatchError('Archive is not a valid ZIP file')
+
+            with archive:
+                members = [info for info in archive.infolist() if not info.is_dir()]
+                # Check declared sizes before extracting anything
+                if sum(info.file_size for info in members) > BATCH_MAX_BYTES:
+                    raise BatchError(f'Archive expands to more than {BATCH_MAX_BYTES // (1024 * 1024)} MB')
+
+                for info in members:
+                    # Skip hidden files and macOS resource forks
+                    raw_name = info.filename.replace('\\', '/')
+                    if posixpath.basename(raw_name).startswith('.') or raw_name.startswith('__MACOSX/'):
+                        continue
+                    name = _safe_name(raw_name)
+                    reader = self._accept(name, from_format)
+                    if not reader:
+                        continue
+                    path = self._stage_path(name)
+                    digest = hashlib.sha256()
+                    with archive.open(info) as source, open(path, 'wb') as target:
+                        copy_stream(source, target, digest)
+                    self.items.append({'name': name, 'path': path, 'from_format': reader, 'input_hash': digest.hexdigest()})
+        finally:
+            os.remove(archive_path)
+
+    def discard(self):
+        """Remove the batch workspace with its inputs and outputs"""
+        shutil.rmtree(self.workspace, ignore_errors=True)
+
+class BatchRunner:
+    """
+    Runs batch items on a worker pool shared by all batch requests.
+
+    The pool is sized by BATCH_WORKERS; each pandoc process still goes
+    through the admission limiter, so batches cannot starve other requests
+    of more than their share.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max(1, max_workers)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Executors do not survive fork(), so create one per server process
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='batch')
+                self._pid = os.getpid()
+            return self._executor
+
+    def run(self, items, to_format, options, use_cache=True):
+        """
+        Convert items in parallel.
+
+        Yields:
+            tuple: (item, result dict, seconds) in completion order
+        """
+        executor = self._get_executor()
+        stopped = threading.Event()
+        futures = {
+            executor.submit(_convert_item, item, to_format, options, use_cache, stopped): item
+            for item in items
+        }
+        try:
+            for future in as_completed(futures):
+                result, elapsed = future.result()
+                yield futures[future], result, elapsed
+        finally:
+            # The client went away: do not start what is still queued, nor keep waiting for a slot
+            stopped.set()
+            for future in futures:
+                future.cancel()
+
+def _convert_item(item, to_format, options, use_cache, stopped):
+    started = time.monotonic()
+    try:
+        # The response is already streaming and cannot turn into a 503, so wait for a slot as jobs do
+        result = wait_out_busy(
+            lambda: process_file_conversion(item['path'], item['from_format'], to_format, options,
+                                            use_cache=use_cache, input_hash=item['input_hash'],
+                                            include_content=False),
+            JOB_BUSY_TIMEOUT, stopped.is_set)
+    except ServerBusy as e:
+        result = {'error': f'Server busy: {str(e)}', 'busy': True}
+    except Exception as e:
+        result = {'error': str(e)}
+    return result, round(time.monotonic() - started, 3)
+
+def _output_name(name, to_format, used):
+    """Archive name for an item's output, unique within the batch"""
+    base = os.path.splitext(name)[0]
+    candidate = f'{base}.{to_format}'
+    counter = 1
+    while candidate in used:
+        counter += 1
+        candidate = f'{base}-{counter}.{to_format}'
+    used.add(candidate)
+    return candidate
+
+def stream_batch(batch, to_format, options, use_cache=True):
+    """
+    Convert a staged batch and stream a ZIP of the results.
+
+    Each output is added to the archive as soon as its conversion finishes.
+    Failed items do not stop the batch; they are listed in manifest.json,
+    written last, with the status of every input. Items that still found the
+    server busy after JOB_BUSY_TIMEOUT seconds are marked busy and retryable.
+
+    Yields:
+        bytes: Chunks of the ZIP archive
+    """
+    zip_stream = ZipStream()
+    manifest = list(batch.rejected)
+    used_names = set()
+    try:
+        for item, result, elapsed in batch_runner.run(batch.items, to_format, options, use_cache):
+            entry = {'name': item['name'], 'from_format': item['from_format'], 'seconds': elapsed}
+            output_path = output_path_for(result['downloadUrl']) if result.get('success') else None
+            if output_path and os.path.exists(output_path):
+                entry['output'] = _output_name(item['name'], to_format, used_names)
+                entry['status'] = 'done'
+                entry['cached'] = bool(result.get('cached'))
+                yield from zip_stream.add_file(output_path, entry['output'])
+                os.remove(output_path)
+            elif result.get('busy'):
+                # Nothing is wrong with the file; sending it again later should work
+                entry['status'] = 'busy'
+                entry['retryable'] = True
+                entry['error'] = result['error']
+            else:
+                entry['status'] = 'failed'
+                entry['error'] = result.get('error', 'Converted file is missing')
+            manifest.append(entry)
+            if os.path.exists(item['path']):
+                os.remove(item['path'])
+
+        statuses = [entry['status'] for entry in manifest]
+        yield from zip_stream.add_json({
+            'batchId': batch.id,
+            'to_format': to_format,
+            'total': len(manifest),
+            'done': statuses.count('done'),
+            'failed': statuses.count('failed'),
+            'busy': statuses.count('busy'),
+            'skipped': statuses.count('skipped'),
+            'items': manifest
+        }, 'manifest.json')
+        yield from zip_stream.close()
+    finally:
+        batch.discard()
+
+batch_runner = BatchRunner(BATCH_WORKERS)
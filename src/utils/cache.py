@@ -0,0 +1,258 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from src.config.config import (
+    CACHE_ENABLED, CACHE_FOLDER, CACHE_MAX_BYTES, CACHE_TTL, MEDIA_CACHE_FOLDER, MEDIA_CACHE_MAX_BYTES
+)
+from src.utils.metrics import CACHE_EVENTS
+
+CHUNK_SIZE = 1024 * 1024
+
+def hash_bytes(data):
+    """Return the SHA-256 hex digest of a bytes object"""
+    return hashlib.sha256(data).hexdigest()
+
+def hash_file(filepath):
+    """Return the SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def canonicalize_options(options):
+    """Normalize an options string so that whitespace differences share a cache entry.
+
+    Token order is kept as-is because pandoc options such as --filter are
+    order-sensitive.
+    """
+    if not options:
+        return ''
+    return ' '.join(options.split())
+
+def make_cache_key(kind, input_hash, from_format, to_format, options):
+    """
+    Build a cache key for a conversion.
+
+    Args:
+        kind (str): Conversion kind (file, text, base64), results differ in shape
+        input_hash (str): SHA-256 hex digest of the input bytes
+        from_format (str): Source format
+        to_format (str): Target format
+        options (str): Conversion options
+
+    Returns:
+        str: Hex digest identifying the conversion
+    """
+    parts = [
+        kind,
+        input_hash,
+        (from_format or '').strip().lower(),
+        (to_format or '').strip().lower(),
+        canonicalize_options(options),
+    ]
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+def cache_requested(request):
+    """Return False if the client asked to bypass the result cache.
+
+    Accepts a `cache=false` form/query/JSON field or a `Cache-Control: no-cache`
+    (or `no-store`) request header.
+    """
+    cache_control = request.headers.get('Cache-Control', '').lower()
+    if 'no-cache' in cache_control or 'no-store' in cache_control:
+        return False
+
+    value = request.values.get('cache')
+    if value is None and request.is_json:
+        data = request.get_json(silent=True) or {}
+        value = data.get('cache')
+    if value is None:
+        return True
+    return str(value).strip().lower() not in ('0', 'false', 'no', 'off')
+
+class ConversionCache:
+    """
+    Size-bounded on-disk store of conversion results.
+
+    Each entry is a `<key>.json` file holding the result dict and, optionally,
+    a `<key>.bin` file holding the output document. The JSON file's mtime is
+    bumped on every hit, so eviction removes the least recently used entries
+    first once the store grows past `max_bytes`. Entries older than `ttl`
+    seconds are treated as misses and removed.
+    """
+
+    def __init__(self, folder, max_bytes, ttl, enabled=True, name='result'):
+        self.name = name
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._size = None
+
+    def _paths(self, key):
+        return os.path.join(self.folder, f'{key}.json'), os.path.join(self.folder, f'{key}.bin')
+
+    def _expired(self, created):
+        return bool(self.ttl) and time.time() - created > self.ttl
+
+    def get(self, key):
+        """
+        Look up a cached conversion.
+
+        Returns:
+            tuple: (result dict, payload path or None), or None on a miss
+        """
+        if not self.enabled:
+            return None
+
+        meta_path, data_path = self._paths(key)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self._count('misses')
+            return None
+
+        payload = data_path if entry.get('has_payload') else None
+        if self._expired(entry.get('created', 0)) or (payload and not os.path.exists(payload)):
+            self._remove(key)
+            self._count('misses')
+            return None
+
+        try:
+            os.utime(meta_path, None)
+        except OSError:
+            pass
+        self._count('hits')
+        return entry['result'], payload
+
+    def put(self, key, result, payload_path=None):
+        """Store a successful conversion result, copying the output file if given"""
+        if not self.enabled:
+            return
+
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            meta_path, data_path = self._paths(key)
+            tmp_suffix = f'.{uuid.uuid4().hex}.tmp'
+            added = 0
+
+            if payload_path:
+                shutil.copyfile(payload_path, data_path + tmp_suffix)
+                os.replace(data_path + tmp_suffix, data_path)
+                added += os.path.getsize(data_path)
+
+            entry = {
+                'created': time.time(),
+                'has_payload': bool(payload_path),
+                'result': result
+            }
+            with open(meta_path + tmp_suffix, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(meta_path + tmp_suffix, meta_path)
+            added += os.path.getsize(meta_path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Failed to store conversion in cache: {str(e)}")
+            return
+
+        with self._lock:
+            if self._size is not None:
+                self._size += added
+            over_budget = self._size is None or self._size > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def evict(self):
+        """Remove expired entries, then least recently used ones until under budget"""
+        entries = []
+        total = 0
+        try:
+            scanned = list(os.scandir(self.folder))
+        except OSError:
+            return
+
+        for item in scanned:
+            if not item.name.endswith('.json'):
+                continue
+            key = item.name[:-len('.json')]
+            try:
+                stat = item.stat()
+            except OSError:
+                continue
+            size = stat.st_size
+            data_path = self._paths(key)[1]
+            if os.path.exists(data_path):
+                size += os.path.getsize(data_path)
+            # mtime is never older than the creation time, so this only drops expired entries
+            if self._expired(stat.st_mtime):
+                self._remove(key, evicted=True)
+                continue
+            entries.append((stat.st_mtime, key, size))
+            total += size
+
+        entries.sort()
+        while entries and total > self.max_bytes:
+            _, key, size = entries.pop(0)
+            self._remove(key, evicted=True)
+            total -= size
+
+        with self._lock:
+            self._size = total
+
+    def _remove(self, key, evicted=False):
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if evicted:
+            self._count('evictions')
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+        CACHE_EVENTS.labels(self.name, {'hits': 'hit', 'misses': 'miss', 'evictions': 'eviction'}[counter]).inc()
+
+    def clear(self):
+        """Remove every cached entry"""
+        try:
+            scanned = list(os.scandir(self.folder))
+        except OSError:
+            return
+        for item in scanned:
+            if item.name.endswith(('.json', '.bin')):
+                try:
+                    os.remove(item.path)
+                except OSError:
+                    pass
+        with self._lock:
+            self._size = 0
+
+    def stats(self):
+        """Return hit/miss counters and current store size"""
+        if self._size is None:
+            self.evict()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'size_bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl
+            }
+
+conversion_cache = ConversionCache(CACHE_FOLDER, CACHE_MAX_BYTES, CACHE_TTL, enabled=CACHE_ENABLED)
+media_cache = ConversionCache(MEDIA_CACHE_FOLDER, MEDIA_CACHE_MAX_BYTES, CACHE_TTL, enabled=CACHE_ENABLED, name='media')
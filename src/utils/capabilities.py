@@ -0,0 +1,174 @@
+"""
+What the installed toolchain can do, probed once per server process.
+
+At start-up (create_app, or the first use) the registry runs pandoc and
+ImageMagick once to record their versions, pandoc's input and output formats
+and ImageMagick's delegate libraries, and looks up the optional WMF helpers
+(wmf2svg, rsvg-convert). Conversions consult it to skip fallbacks whose tools
+are missing instead of spawning a process that is bound to fail, and
+/api/formats and the index page list the formats the installed pandoc really
+supports. With gunicorn's preload the probe runs once in the master.
+"""
+import hashlib
+import json
+import re
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.config.config import PANDOC_INPUT_FORMATS, PANDOC_OUTPUT_FORMATS
+
+PROBE_TIMEOUT = 10  # seconds per probe command
+
+# Any of these lets pandoc write PDF, which pandoc 2 does not list as an output format
+PDF_ENGINES = ('pdflatex', 'xelatex', 'lualatex', 'tectonic', 'wkhtmltopdf', 'weasyprint', 'pagedjs-cli')
+
+def _run(cmd):
+    """Return the stdout of a probe command, or None if it cannot run"""
+    try:
+        completed = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                   timeout=PROBE_TIMEOUT, check=True)
+        return completed.stdout.decode('utf-8', 'replace')
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def _order(preferred, available):
+    """Formats in `available`, those in `preferred` first in that order, the rest alphabetically"""
+    available = set(available)
+    return [fmt for fmt in preferred if fmt in available] + sorted(available.difference(preferred))
+
+def _probe_pandoc(executor):
+    info = {'available': False}
+    if not shutil.which('pandoc'):
+        return info, None, None
+    runs = [executor.submit(_run, ['pandoc', flag])
+            for flag in ('--version', '--list-input-formats', '--list-output-formats')]
+    version, inputs, outputs = (run.result() for run in runs)
+    if version is None:
+        return info, None, None
+    lines = version.splitlines()
+    info['available'] = True
+    info['version'] = lines[0].split()[-1] if lines else None
+    features = next((line for line in lines if line.startswith('Features:')), '')
+    info['features'] = [feature.lstrip('+') for feature in features.split()[1:] if feature.startswith('+')]
+
+    inputs = (inputs or '').split()
+    outputs = (outputs or '').split()
+    if outputs and 'pdf' not in outputs and any(shutil.which(engine) for engine in PDF_ENGINES):
+        outputs.append('pdf')
+    return info, inputs or None, outputs or None
+
+def _probe_imagemagick():
+    info = {'available': False}
+    version = _run(['convert', '-version']) if shutil.which('convert') else None
+    if version is None:
+        return info
+    info['available'] = True
+    match = re.search(r'ImageMagick (\S+)', version)
+    info['version'] = match.group(1) if match else None
+    # e.g. "Delegates (built-in): bzlib fontconfig freetype jpeg png rsvg tiff wmf zlib"
+    match = re.search(r'^Delegates[^:]*:(.*)$', version, re.MULTILINE)
+    info['delegates'] = match.group(1).split() if match else None
+    return info
+
+class Capabilities:
+    """Probed tool versions and formats of this server process (see module docstring)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tools = None
+        self._input_formats = list(PANDOC_INPUT_FORMATS)
+        self._output_formats = list(PANDOC_OUTPUT_FORMATS)
+        self._document = None
+        self._etag = None
+
+    def probe(self, force=False):
+        """Probe the toolchain unless already done; returns the tool information"""
+        with self._lock:
+            if self._tools is not None and not force:
+                return self._tools
+
+            # The probes are process start-ups; run them side by side to keep start-up short
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                imagemagick = executor.submit(_probe_imagemagick)
+                pandoc, inputs, outputs = _probe_pandoc(executor)
+                imagemagick = imagemagick.result()
+            tools = {
+                'pandoc': pandoc,
+                'convert': imagemagick,
+                'wmf2svg': {'available': bool(shutil.which('wmf2svg'))},
+                'rsvg-convert': {'available': bool(shutil.which('rsvg-convert'))},
+            }
+            # Without a usable pandoc keep the configured lists, so the page still renders
+            if inputs:
+                self._input_formats = _order(PANDOC_INPUT_FORMATS, inputs)
+            if outputs:
+                self._output_formats = _order(PANDOC_OUTPUT_FORMATS, outputs)
+
+            self._document = json.dumps({
+                'input_formats': self._input_formats,
+                'output_formats': self._output_formats,
+                'tools': tools
+            }, sort_keys=True).encode('utf-8')
+            self._etag = hashlib.sha256(self._document).hexdigest()[:32]
+            self._tools = tools
+
+            missing = [name for name, info in tools.items() if not info['available']]
+            print(f"Toolchain: pandoc {pandoc.get('version', 'missing')}, "
+                  f"ImageMagick {tools['convert'].get('version', 'missing')}"
+                  + (f"; not installed: {', '.join(missing)}" if missing else ''))
+            return tools
+
+    @property
+    def tools(self):
+        return self.probe()
+
+    def available(self, tool):
+        """Whether an external tool (pandoc, convert, wmf2svg, rsvg-convert) can be run"""
+        info = self.probe().get(tool)
+        return bool(info and info['available'])
+
+    def has_delegate(self, delegate):
+        """
+        Whether ImageMagick was built with a delegate library (e.g. 'wmf').
+
+        Returns:
+            bool: None when ImageMagick is installed but did not report its delegates
+        """
+        info = self.probe()['convert']
+        if not info['available']:
+            return False
+        if info.get('delegates') is None:
+            return None
+        return delegate in info['delegates']
+
+    def imagemagick_reads(self, filepath):
+        """Whether ImageMagick is worth trying on this input file"""
+        if not self.available('convert'):
+            return False
+        if filepath.lower().endswith('.wmf'):
+            # Reading WMF needs libwmf; unknown delegates get the benefit of the doubt
+            return self.has_delegate('wmf') is not False
+        return True
+
+    @property
+    def input_formats(self):
+        self.probe()
+        return self._input_formats
+
+    @property
+    def output_formats(self):
+        self.probe()
+        return self._output_formats
+
+    def formats_document(self):
+        """
+        The /api/formats response, serialized once.
+
+        Returns:
+            tuple: (JSON bytes, ETag)
+        """
+        self.probe()
+        return self._document, self._etag
+
+capabilities = Capabilities()
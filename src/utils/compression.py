@@ -0,0 +1,136 @@
+"""
+Response compression negotiated from Accept-Encoding.
+
+Converted documents come back as JSON with the whole output in `content`
+(and `result` for base64), often megabytes of HTML or Markdown that compress
+ten to one. compress_response() runs after every request and encodes text
+responses of at least COMPRESSION_MIN_BYTES with the best codec the client
+accepts: zstd (zstandard package), brotli (brotli package) or gzip.
+
+The body is compressed while it is sent, chunk by chunk, so a large response
+is never held in memory a second time in compressed form; the response is
+sent chunked without a Content-Length. Responses that are already compressed
+(ZIP, DOCX and other office formats, images, PDF) or already carry a
+Content-Encoding, such as precompressed /assets/, are left alone.
+"""
+import zlib
+from flask import request
+from src.config.config import COMPRESSION_ENABLED, COMPRESSION_MIN_BYTES, COMPRESSION_ENCODINGS
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 256 * 1024
+
+# Only these are worth compressing; everything else is binary and usually compressed already
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/javascript', 'application/xml', 'application/xhtml+xml',
+    'application/rtf', 'application/x-tex', 'application/x-latex', 'application/x-ndjson', 'image/svg+xml'
+}
+
+class _Encoder:
+    """Uniform compress()/finish() over the zlib, brotli and zstandard streaming APIs"""
+
+    def __init__(self, compress, finish):
+        self.compress = compress
+        self.finish = finish
+
+def _gzip():
+    stream = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    return _Encoder(stream.compress, stream.flush)
+
+def _brotli():
+    # Quality 5 keeps brotli about as fast as gzip -6 on dynamic content while compressing better
+    stream = brotli.Compressor(quality=5)
+    return _Encoder(stream.process, stream.finish)
+
+def _zstd():
+    stream = zstandard.ZstdCompressor(level=3).compressobj()
+    return _Encoder(stream.compress, stream.flush)
+
+ENCODERS = {'gzip': _gzip}
+if brotli:
+    ENCODERS['br'] = _brotli
+if zstandard:
+    ENCODERS['zstd'] = _zstd
+
+# Server preference among the codecs a client accepts with the same quality
+PREFERRED_ENCODINGS = [name for name in COMPRESSION_ENCODINGS if name in ENCODERS]
+
+def negotiate(accept_encodings):
+    """
+    Pick a content encoding.
+
+    Args:
+        accept_encodings: The request's Accept-Encoding header (werkzeug accept object)
+
+    Returns:
+        str: 'zstd', 'br', 'gzip' or None for no compression
+    """
+    best, best_quality = None, 0
+    for name in PREFERRED_ENCODINGS:
+        quality = accept_encodings.quality(name)
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+def compressible(response):
+    """Whether a response is worth compressing, ignoring the client's preferences"""
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return False
+    if 'Content-Encoding' in response.headers or 'no-transform' in response.headers.get('Cache-Control', ''):
+        return False
+    mimetype = response.mimetype or ''
+    if not (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+            or mimetype.endswith(('+json', '+xml'))):
+        return False
+    length = response.content_length
+    return length is None or length >= COMPRESSION_MIN_BYTES
+
+def _compress_chunks(chunks, encoder):
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = encoder.compress(chunk)
+            if data:
+                yield data
+        yield encoder.finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+def _slices(data):
+    for start in range(0, len(data), CHUNK_SIZE):
+        yield data[start:start + CHUNK_SIZE]
+
+def compress_response(response):
+    """after_request hook: encode the body for the client if it pays off (see module docstring)"""
+    if not COMPRESSION_ENABLED or request.method == 'HEAD' or not compressible(response):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        body = response.response
+    else:
+        # Already in memory (jsonify); compress it in slices as it is sent
+        body = _slices(response.get_data())
+    response.direct_passthrough = False
+    response.response = _compress_chunks(body, ENCODERS[encoding]())
+    response.headers['Content-Encoding'] = encoding
+    response.headers.pop('Content-Length', None)
+    # A strong ETag names one exact byte sequence; the encoded body is a different one
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
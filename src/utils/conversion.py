@@ -1,145 +1,144 @@
 import os
 import tempfile
 import base64
+import shutil
 import subprocess
 from src.config.config import UPLOAD_FOLDER
-from PIL import Image
+from src.utils.capabilities import capabilities
+from src.utils.cache import conversion_cache, make_cache_key, hash_bytes, hash_file, cache_requested
+from src.utils.governor import run_tool, ServerBusy
+from src.utils.engines import convert_bytes
+from src.utils.ingest import ingest_upload
+from src.utils.images import select_image_engine, convert_with_pillow
+from src.utils.inflight import inflight
+from src.utils.media import media_processor
+from src.utils.metrics import record_strategy
+from src.utils.timing import stage
+from src.utils.postprocess import image_sources, rewrite_html
+from src.utils.workspace import create_workspace, relative_path
+from werkzeug.utils import secure_filename
 from flask import jsonify
-from bs4 import BeautifulSoup
 
-def process_file_conversion(filepath, from_format, to_format, options):
-    """Process file conversion using pandoc"""
-    try:
-        output_filename = f"{os.path.splitext(os.path.basename(filepath))[0]}.{to_format}"
-        output_path = os.path.join(UPLOAD_FOLDER, output_filename)
+def process_file_conversion(filepath, from_format, to_format, options, use_cache=True, input_hash=None,
+                            include_content=True):
+    """Process file conversion using pandoc
+
+    Results are served from the conversion cache when the same input bytes were
+    already converted with the same formats and options. Pass use_cache=False to
+    force a fresh conversion; input_hash may be given when the caller already
+    hashed the file. With include_content=False the output is not read back
+    into the result, for callers that only need the download URL. Identical
+    conversions running at the same time are done once (see inflight).
+    """
+    # Output goes next to the input, in the conversion's workspace
+    output_path = os.path.join(os.path.dirname(filepath), f"{os.path.splitext(os.path.basename(filepath))[0]}.{to_format}")
+    output_filename = relative_path(output_path)
+    caching = use_cache and conversion_cache.enabled
+
+    cache_key = None
+    if caching or inflight.enabled:
+        kind = 'file' if include_content else 'file-url'
+        with stage('cache'):
+            cache_key = make_cache_key(kind, input_hash or hash_file(filepath), from_format, to_format, options)
+
+    def from_cache():
+        with stage('cache'):
+            cached = conversion_cache.get(cache_key)
+            if cached:
+                result, payload = cached
+                if payload:
+                    shutil.copyfile(payload, output_path)
+        if cached:
+            return dict(result, downloadUrl=f'/download/{output_filename}', cached=True), output_path
+        return None
+
+    if caching:
+        cached = from_cache()
+        if cached:
+            return cached[0]
+
+    def convert():
+        result = _convert_file(filepath, from_format, to_format, options, output_filename, output_path, include_content)
+        if not include_content:
+            result.pop('content', None)
+        if caching and result.get('success'):
+            with stage('cache'):
+                conversion_cache.put(cache_key, result, output_path)
+        return result, output_path
+
+    (result, _), _ = inflight.run(cache_key, convert, 'file', recheck=from_cache if caching else None,
+                                  share=_share_output(output_path))
+    # Callers add to the result (historyId); keep the shared one untouched for the other duplicates
+    return dict(result)
+
+def _share_output(output_path):
+    """
+    inflight share step: another request's (result, output path) for this request.
+
+    Runs before the other request returns, so its output file still exists;
+    it is linked (or copied) into this request's workspace.
+    """
+    def share(value):
+        result, produced = value
+        result = dict(result, coalesced=True)
+        if output_path and produced and produced != output_path:
+            try:
+                os.link(produced, output_path)
+            except OSError:
+                shutil.copyfile(produced, output_path)
+            result['downloadUrl'] = f'/download/{relative_path(output_path)}'
+        return result, output_path
+    return share
 
+def _convert_file(filepath, from_format, to_format, options, output_filename, output_path, include_content=True):
+    """Run pandoc for a file conversion and post-process DOCX to HTML output"""
+    try:
         is_docx_to_html = from_format.lower() == 'docx' and to_format.lower() in ['html', 'html4', 'html5']
 
         if is_docx_to_html:
             # Extract media so we can process WMF/EMF and enable MathJax so OMML -> LaTeX
-            media_dir = os.path.join(UPLOAD_FOLDER, f"{os.path.splitext(os.path.basename(filepath))[0]}_media")
+            media_dir = os.path.join(os.path.dirname(filepath), f"{os.path.splitext(os.path.basename(filepath))[0]}_media")
             os.makedirs(media_dir, exist_ok=True)
 
             cmd = ['pandoc', filepath, '-f', 'docx', '-t', 'html', f'--extract-media={media_dir}', '--mathjax']
             if options:
                 cmd.extend(options.split())
-            cmd.extend(['-o', output_path])
-
-            subprocess.run(cmd, check=True)
+            cmd.extend(['-o', '-'])
 
-            content = ""
+            # Read pandoc's output from stdout and write the post-processed HTML once
+            completed = run_tool(cmd, check=True, stdout=subprocess.PIPE)
             try:
-                with open(output_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
+                content = completed.stdout.decode('utf-8')
             except UnicodeDecodeError:
+                with open(output_path, 'wb') as f:
+                    f.write(completed.stdout)
                 content = "[Binary content - download to view]"
+            else:
+                # Post-process HTML: convert all images to PNG and embed as base64 data URIs
+                if content and '<img' in content:
+                    images = {}
+                    for src in image_sources(content):
+                        if not src or src.startswith('http://') or src.startswith('https://') or src.startswith('data:'):
+                            continue
 
-            # Post-process HTML: convert all images to PNG and embed as base64 data URIs
-            if content and '<img' in content:
-                soup = BeautifulSoup(content, 'html.parser')
-
-                def _to_png_data_uri(image_path):
-                    try:
-                        mime = 'image/png'
-                        with open(image_path, 'rb') as img_f:
-                            encoded = base64.b64encode(img_f.read()).decode('utf-8')
-                        return f"data:{mime};base64,{encoded}"
-                    except Exception:
-                        return None
-
-                def _convert_wmf_emf_to_png(image_path):
-                    try:
-                        target_path = os.path.splitext(image_path)[0] + '.png'
-                        # Prefer ImageMagick for vector formats, keep transparent background for formulas
-                        subprocess.run(['convert', '-density', '300', image_path, '-background', 'none', '-alpha', 'on', target_path], check=True)
-                        return target_path if os.path.exists(target_path) and os.path.getsize(target_path) > 0 else None
-                    except Exception:
-                        return None
-
-                def _convert_any_to_png(image_path):
-                    try:
-                        if not os.path.exists(image_path):
-                            return None
-                        if os.path.splitext(image_path)[1].lower() == '.png':
-                            return image_path
-                        target_path = os.path.splitext(image_path)[0] + '.png'
-                        subprocess.run(['convert', image_path, target_path], check=True)
-                        return target_path if os.path.exists(target_path) and os.path.getsize(target_path) > 0 else None
-                    except Exception:
-                        return None
-
-                for img in soup.find_all('img'):
-                    src = img.get('src')
-                    if not src or src.startswith('http://') or src.startswith('https://') or src.startswith('data:'):
-                        continue
-
-                    # Resolve filesystem path for extracted media
-                    abs_path = os.path.join(UPLOAD_FOLDER, src) if not os.path.isabs(src) else src
-                    if not os.path.exists(abs_path):
-                        # Try resolve relative to media_dir
-                        candidate = os.path.join(media_dir, os.path.basename(src))
-                        abs_path = candidate if os.path.exists(candidate) else abs_path
-
-                    ext = os.path.splitext(abs_path)[1].lower()
-                    converted = None
-                    if ext in ['.wmf', '.emf']:
-                        converted = _convert_wmf_emf_to_png(abs_path)
-                    else:
-                        converted = _convert_any_to_png(abs_path)
-
-                    if converted and os.path.exists(converted):
-                        data_uri = _to_png_data_uri(converted)
-                        if data_uri:
-                            img['src'] = data_uri
-                        else:
-                            rel = os.path.relpath(converted, UPLOAD_FOLDER)
-                            rel = rel.replace('\\', '/').lstrip('\\/')
-                            img['src'] = rel
-
-                new_content = str(soup)
-                # Ensure MathJax (LaTeX) renders crisply with transparent background using SVG renderer
-                try:
-                    soup_head = soup.head
-                    if soup_head is None and soup.html is not None:
-                        soup_head = soup.new_tag('head')
-                        soup.html.insert(0, soup_head)
-                    if soup_head is not None:
-                        # Remove any existing MathJax includes to avoid duplicates or CHTML renderer
-                        for script in soup_head.find_all('script'):
-                            src_attr = script.get('src', '')
-                            if 'mathjax' in src_attr.lower():
-                                script.decompose()
-                        # Inject MathJax v3 SVG configuration
-                        cfg = soup.new_tag('script')
-                        cfg.string = (
-                            "window.MathJax = {\n"
-                            "  tex: { inlineMath: [['$','$'], ['\\\\(','\\\\)']], displayMath: [['$$','$$'], ['\\\\[','\\\\]']] },\n"
-                            "  svg: { scale: 1.15, minScale: 1, fontCache: 'global' },\n"
-                            "  options: { skipHtmlTags: ['script','noscript','style','textarea','pre','code'] }\n"
-                            "};"
-                        )
-                        soup_head.append(cfg)
-                        # Add SVG renderer
-                        mj = soup.new_tag('script', src='https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-svg.js')
-                        soup_head.append(mj)
-                        # Tweak CSS for transparency and crisper rendering
-                        style_tag = soup.new_tag('style')
-                        style_tag.string = (
-                            'mjx-container { background: transparent !important; font-size: 110%; }\n'
-                            'mjx-container, math { -webkit-font-smoothing: antialiased; -moz-osx-font-smoothing: grayscale; }\n'
-                            'mjx-container[jax="SVG"] { direction: ltr; }'
-                        )
-                        soup_head.append(style_tag)
-                        new_content = str(soup)
-                except Exception:
-                    pass
-                try:
-                    with open(output_path, 'w', encoding='utf-8') as f:
-                        f.write(new_content)
-                    content = new_content
-                except Exception:
-                    # If we fail to write updated HTML, still return the original
-                    pass
+                        # Resolve filesystem path for extracted media
+                        abs_path = os.path.join(UPLOAD_FOLDER, src) if not os.path.isabs(src) else src
+                        if not os.path.exists(abs_path):
+                            # Try resolve relative to media_dir
+                            candidate = os.path.join(media_dir, os.path.basename(src))
+                            abs_path = candidate if os.path.exists(candidate) else abs_path
+                        images[src] = abs_path
+
+                    # Convert to PNG in parallel, once per distinct image, and embed as data URIs
+                    with stage('media'):
+                        embedded = media_processor.embed(list(images.values()))
+                    with stage('postprocess'):
+                        content = rewrite_html(content, {
+                            src: embedded[abs_path] for src, abs_path in images.items() if abs_path in embedded
+                        })
+
+                with open(output_path, 'w', encoding='utf-8') as f:
+                    f.write(content)
 
             return {
                 'success': True,
@@ -153,25 +152,45 @@ def process_file_conversion(filepath, from_format, to_format, options):
             cmd.extend(options.split())
         cmd.extend(['-o', output_path])
 
-        subprocess.run(cmd, check=True)
-
-        content = ""
-        try:
-            with open(output_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-        except UnicodeDecodeError:
-            content = "[Binary content - download to view]"
+        run_tool(cmd, check=True)
 
-        return {
+        result = {
             'success': True,
-            'downloadUrl': f'/download/{output_filename}',
-            'content': content
+            'downloadUrl': f'/download/{output_filename}'
         }
+        if include_content:
+            with stage('read'):
+                try:
+                    with open(output_path, 'r', encoding='utf-8') as f:
+                        result['content'] = f.read()
+                except UnicodeDecodeError:
+                    result['content'] = "[Binary content - download to view]"
+        return result
     except subprocess.CalledProcessError as e:
         return {'error': f'Conversion failed: {str(e)}'}
 
-def process_image_conversion(filepath, to_format, quality=100, resize=None, options=None):
-    """Process image conversion using ImageMagick
+def _image_result(output_path, output_filename, message, encode=True, engine='imagemagick'):
+    """Build the result of a successful image conversion, reading the output once if it must be embedded"""
+    result = {
+        'success': True,
+        'downloadUrl': f'/download/{output_filename}',
+        'message': message,
+        'engine': engine
+    }
+    if encode:
+        with stage('encode'), open(output_path, "rb") as image_file:
+            result['base64'] = base64.b64encode(image_file.read()).decode('utf-8')
+    return result
+
+def process_image_conversion(filepath, to_format, quality=100, resize=None, options=None, encode=True, engine=None,
+                             input_hash=None):
+    """Process image conversion using Pillow or ImageMagick
+
+    Common raster pairs (PNG, JPEG, GIF, WebP, BMP, TIFF) with only quality and
+    resize settings are converted in-process with Pillow; everything else, and
+    anything Pillow fails on, goes through ImageMagick. Identical conversions
+    running at the same time are done once (see inflight); images are not
+    cached, so this only works within a server process.
     
     Args:
         filepath (str): Path to the input image
@@ -179,30 +198,75 @@ def process_image_conversion(filepath, to_format, quality=100, resize=None, opti
         quality (int, optional): Image quality (1-100). Defaults to 100.
         resize (str, optional): Resize parameter (e.g., '800x600'). Defaults to None.
         options (str, optional): Additional ImageMagick options. Defaults to None.
+        encode (bool, optional): Include the output as base64. Defaults to True;
+            pass False when the caller streams the file or only needs its URL.
+        engine (str, optional): auto, pillow or imagemagick. Defaults to IMAGE_ENGINE.
+        input_hash (str, optional): SHA-256 of the input, when the caller already hashed it
     
     Returns:
         dict: Result of the conversion
     """
+    output_path = os.path.join(os.path.dirname(filepath), f"{os.path.splitext(os.path.basename(filepath))[0]}.{to_format}")
+    cache_key = None
+    if inflight.enabled:
+        with stage('cache'):
+            settings = f'quality={quality} resize={resize} engine={engine} {options or ""}'
+            cache_key = make_cache_key('image' if encode else 'image-url', input_hash or hash_file(filepath),
+                                       os.path.splitext(filepath)[1].lower(), to_format, settings)
+
+    def convert():
+        result = _convert_image(filepath, to_format, quality, resize, options, encode, engine)
+        return result, output_path if result.get('success') else None
+
+    (result, _), _ = inflight.run(cache_key, convert, 'image', share=_share_output(output_path))
+    return dict(result)
+
+def _convert_image(filepath, to_format, quality, resize, options, encode, engine):
+    """Convert an image with the first engine and strategy that works (see process_image_conversion)"""
     try:
-        output_filename = f"{os.path.splitext(os.path.basename(filepath))[0]}.{to_format}"
-        output_path = os.path.join(UPLOAD_FOLDER, output_filename)
+        output_path = os.path.join(os.path.dirname(filepath), f"{os.path.splitext(os.path.basename(filepath))[0]}.{to_format}")
+        output_filename = relative_path(output_path)
+
+        if select_image_engine(filepath, to_format, resize, options, engine) == 'pillow':
+            try:
+                convert_with_pillow(filepath, output_path, to_format, quality, resize)
+                record_strategy('image', 'pillow', True)
+                return _image_result(output_path, output_filename, f'Image successfully converted to {to_format}',
+                                     encode, engine='pillow')
+            except ServerBusy:
+                raise
+            except Exception as pil_e:
+                record_strategy('image', 'pillow', False)
+                if engine == 'pillow':
+                    return {'error': f'Image conversion failed: {str(pil_e)}'}
+                print(f"Pillow conversion failed, falling back to ImageMagick: {str(pil_e)}")
         
         is_wmf = filepath.lower().endswith(('.wmf', '.emf'))
+        # Fallbacks whose tools are not installed are skipped rather than spawned to fail
+        has_imagemagick = capabilities.imagemagick_reads(filepath)
         
         if is_wmf:
-            if to_format.lower() in ['png', 'svg']:
+            has_svg_route = capabilities.available('wmf2svg') or has_imagemagick
+            if to_format.lower() == 'png':
+                has_svg_route = has_svg_route and capabilities.available('rsvg-convert')
+            if to_format.lower() in ['png', 'svg'] and has_svg_route:
                 try:
-                    temp_svg = os.path.join(UPLOAD_FOLDER, f"{os.path.splitext(os.path.basename(filepath))[0]}_temp.svg")
+                    temp_svg = os.path.join(os.path.dirname(filepath), f"{os.path.splitext(os.path.basename(filepath))[0]}_temp.svg")
                     
-                    wmf2svg_cmd = ['wmf2svg', filepath, '-o', temp_svg]
-                    print(f"Trying wmf2svg: {' '.join(wmf2svg_cmd)}")
-                    
-                    try:
-                        subprocess.run(wmf2svg_cmd, check=True, stderr=subprocess.PIPE, text=True)
-                    except (subprocess.CalledProcessError, FileNotFoundError):
-                        print("wmf2svg not found or failed, trying direct ImageMagick conversion to SVG first")
+                    converted = False
+                    if capabilities.available('wmf2svg'):
+                        wmf2svg_cmd = ['wmf2svg', filepath, '-o', temp_svg]
+                        print(f"Trying wmf2svg: {' '.join(wmf2svg_cmd)}")
+                        try:
+                            run_tool(wmf2svg_cmd, check=True, stderr=subprocess.PIPE, text=True)
+                            record_strategy('wmf', 'wmf2svg', True)
+                            converted = True
+                        except (subprocess.CalledProcessError, FileNotFoundError):
+                            record_strategy('wmf', 'wmf2svg', False)
+                            print("wmf2svg failed, trying direct ImageMagick conversion to SVG first")
+                    if not converted and has_imagemagick:
                         img_to_svg_cmd = ['convert', filepath, temp_svg]
-                        subprocess.run(img_to_svg_cmd, check=True)
+                        run_tool(img_to_svg_cmd, check=True)
                     
                     if os.path.exists(temp_svg) and os.path.getsize(temp_svg) > 0:
                         if to_format.lower() == 'png':
@@ -219,27 +283,25 @@ def process_image_conversion(filepath, to_format, quality=100, resize=None, opti
                             
                             rsvg_cmd.extend(['-o', output_path, temp_svg])
                             print(f"Converting SVG to PNG with rsvg-convert: {' '.join(rsvg_cmd)}")
-                            subprocess.run(rsvg_cmd, check=True)
+                            run_tool(rsvg_cmd, check=True)
                         elif to_format.lower() == 'svg':
-                            import shutil
                             shutil.copy(temp_svg, output_path)
                         
                         if os.path.exists(temp_svg):
                             os.remove(temp_svg)
                         
                         if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-                            # Get base64 encoded image
-                            with open(output_path, "rb") as image_file:
-                                encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-                            
-                            return {
-                                'success': True,
-                                'downloadUrl': f'/download/{output_filename}',
-                                'base64': encoded_string,
-                                'message': f'Image successfully converted to {to_format} (using SVG)'
-                            }
+                            record_strategy('wmf', 'svg', True)
+                            return _image_result(output_path, output_filename, f'Image successfully converted to {to_format} (using SVG)', encode)
+                except ServerBusy:
+                    raise
                 except Exception as svg_e:
                     print(f"SVG conversion approach failed: {str(svg_e)}")
+                record_strategy('wmf', 'svg', False)
+            
+            if not has_imagemagick:
+                return {'error': f'Failed to convert WMF/EMF to {to_format}. '
+                                 f'Missing tools: {", ".join(_missing_wmf_tools())}.'}
             
             try:
                 cmd = ['convert']
@@ -261,43 +323,35 @@ def process_image_conversion(filepath, to_format, quality=100, resize=None, opti
                 cmd.append(output_path)
                 
                 print(f"Trying WMF conversion with ImageMagick: {' '.join(cmd)}")
-                subprocess.run(cmd, check=True, stderr=subprocess.PIPE, text=True)
+                run_tool(cmd, check=True, stderr=subprocess.PIPE, text=True)
                 
                 if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-                    # Get base64 encoded image
-                    with open(output_path, "rb") as image_file:
-                        encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-                    
-                    return {
-                        'success': True,
-                        'downloadUrl': f'/download/{output_filename}',
-                        'base64': encoded_string,
-                        'message': f'Image successfully converted to {to_format}'
-                    }
+                    record_strategy('wmf', 'imagemagick', True)
+                    return _image_result(output_path, output_filename, f'Image successfully converted to {to_format}', encode)
+            except ServerBusy:
+                raise
             except Exception as e:
                 print(f"ImageMagick WMF conversion failed: {str(e)}")
+            record_strategy('wmf', 'imagemagick', False)
             
             try:
                 alt_cmd = ['convert', filepath, output_path]
                 print(f"Trying simple conversion: {' '.join(alt_cmd)}")
-                subprocess.run(alt_cmd, check=True)
+                run_tool(alt_cmd, check=True)
                 
                 if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-                    # Get base64 encoded image
-                    with open(output_path, "rb") as image_file:
-                        encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-                    
-                    return {
-                        'success': True,
-                        'downloadUrl': f'/download/{output_filename}',
-                        'base64': encoded_string,
-                        'message': f'Image successfully converted to {to_format} (simple method)'
-                    }
+                    record_strategy('wmf', 'simple', True)
+                    return _image_result(output_path, output_filename, f'Image successfully converted to {to_format} (simple method)', encode)
+            except ServerBusy:
+                raise
             except Exception as alt_e:
                 print(f"Simple conversion also failed: {str(alt_e)}")
+            record_strategy('wmf', 'simple', False)
             
             return {'error': f'Failed to convert WMF/EMF to {to_format}. No approach succeeded.'}
         else:
+            if not has_imagemagick:
+                return {'error': 'Image conversion failed: ImageMagick is not installed'}
             cmd = ['convert', filepath]
             
             if to_format.lower() in ['jpg', 'jpeg', 'png', 'webp']:
@@ -312,138 +366,174 @@ def process_image_conversion(filepath, to_format, quality=100, resize=None, opti
             cmd.append(output_path)
         
             print(f"Executing command: {' '.join(cmd)}")
-            result = subprocess.run(cmd, check=True, stderr=subprocess.PIPE, text=True)
+            try:
+                result = run_tool(cmd, check=True, stderr=subprocess.PIPE, text=True)
+            except subprocess.CalledProcessError:
+                record_strategy('image', 'imagemagick', False)
+                raise
             
             if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+                record_strategy('image', 'imagemagick', False)
                 print(f"Error: Output file not created or empty. Command output: {result.stderr}")
                 alt_cmd = ['convert', filepath, output_path]
                 print(f"Trying alternative command: {' '.join(alt_cmd)}")
-                subprocess.run(alt_cmd, check=True)
+                try:
+                    run_tool(alt_cmd, check=True)
+                except subprocess.CalledProcessError:
+                    record_strategy('image', 'retry', False)
+                    raise
                 
                 if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+                    record_strategy('image', 'retry', False)
                     return {'error': f'Failed to convert {filepath} to {to_format}. Output file was not created.'}
+                record_strategy('image', 'retry', True)
+            else:
+                record_strategy('image', 'imagemagick', True)
         
-        # Get base64 encoded image
-        with open(output_path, "rb") as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-        
-        return {
-            'success': True,
-            'downloadUrl': f'/download/{output_filename}',
-            'base64': encoded_string,
-            'message': f'Image successfully converted to {to_format}'
-        }
+        return _image_result(output_path, output_filename, f'Image successfully converted to {to_format}', encode)
     except subprocess.CalledProcessError as e:
         error_message = e.stderr if hasattr(e, 'stderr') else str(e)
         print(f"Conversion error: {error_message}")
         
-        if filepath.lower().endswith(('.wmf', '.emf')):
+        if filepath.lower().endswith(('.wmf', '.emf')) and capabilities.imagemagick_reads(filepath):
             try:
                 alt_cmd = ['convert', '-density', '300', filepath, output_path]
                 print(f"Trying simple conversion: {' '.join(alt_cmd)}")
-                subprocess.run(alt_cmd, check=True)
+                run_tool(alt_cmd, check=True)
                 
                 if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-                    # Get base64 encoded image
-                    with open(output_path, "rb") as image_file:
-                        encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-                    
-                    return {
-                        'success': True,
-                        'downloadUrl': f'/download/{output_filename}',
-                        'base64': encoded_string,
-                        'message': f'Image successfully converted to {to_format} (alternative method)'
-                    }
+                    record_strategy('wmf', 'alternative', True)
+                    return _image_result(output_path, output_filename, f'Image successfully converted to {to_format} (alternative method)', encode)
+            except ServerBusy:
+                raise
             except Exception as alt_e:
                 print(f"Alternative conversion also failed: {str(alt_e)}")
+            record_strategy('wmf', 'alternative', False)
         
         return {'error': f'Image conversion failed: {error_message}'}
+    except ServerBusy:
+        raise
     except Exception as e:
         print(f"Unexpected error: {str(e)}")
         return {'error': f'Image conversion failed: {str(e)}'}
 
-def process_text_conversion(text, from_format, to_format, options):
-    """Process text conversion using pandoc"""
+def _missing_wmf_tools():
+    """Tools that would let WMF/EMF conversions succeed but are not installed"""
+    missing = [tool for tool in ('wmf2svg', 'rsvg-convert', 'convert') if not capabilities.available(tool)]
+    if capabilities.has_delegate('wmf') is False and 'convert' not in missing:
+        missing.append('ImageMagick WMF delegate (libwmf)')
+    return missing
+
+def process_text_conversion(text, from_format, to_format, options, use_cache=True, save_output=False):
+    """Process text conversion using pandoc, served from the cache when possible
+
+    With save_output=True the output is written to a new workspace and only its
+    download URL is returned instead of the converted content.
+    """
+    return _process_in_memory('text', text.encode('utf-8'), from_format, to_format, options,
+                              use_cache, save_output, _text_result)
+
+def _text_result(output):
     try:
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix=f'.{from_format}') as temp_in:
-            temp_in.write(text)
-            temp_in_path = temp_in.name
-        
-        temp_out_path = temp_in_path + f'.{to_format}'
-        
-        cmd = ['pandoc', temp_in_path, '-f', from_format, '-t', to_format]
-        if options:
-            cmd.extend(options.split())
-        cmd.extend(['-o', temp_out_path])
-        
-        subprocess.run(cmd, check=True)
-        
-        content = ""
-        try:
-            with open(temp_out_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-        except UnicodeDecodeError:
-            with open(temp_out_path, 'rb') as f:
-                content = "[Binary content]"
-        
-        os.unlink(temp_in_path)
-        os.unlink(temp_out_path)
-        
-        return {
-            'success': True,
-            'result': content,
-            'content': content
-        }
-    except subprocess.CalledProcessError as e:
-        return {'error': f'Conversion failed: {str(e)}'}
+        content = output.decode('utf-8')
+    except UnicodeDecodeError:
+        content = "[Binary content]"
 
-def process_base64_conversion(base64_data, from_format, to_format, options):
-    """Process base64 conversion using pandoc"""
+    return {
+        'success': True,
+        'result': content,
+        'content': content
+    }
+
+def process_base64_conversion(base64_data, from_format, to_format, options, use_cache=True, save_output=False):
+    """Process base64 conversion using pandoc, served from the cache when possible
+
+    With save_output=True the output is written to a new workspace and only its
+    download URL is returned, so binary output is never base64-encoded.
+    """
     try:
+        if ',' in base64_data:
+            base64_data = base64_data.split(',', 1)[1]
+
+        decoded_content = base64.b64decode(base64_data)
+    except:
+        return {'error': 'Invalid base64 content'}
+
+    return _process_in_memory('base64', decoded_content, from_format, to_format, options,
+                              use_cache, save_output, _base64_result)
+
+def _base64_result(output):
+    try:
+        content = output.decode('utf-8')
+    except UnicodeDecodeError:
+        content = "[Binary content - encoded as base64]"
+
+    return {
+        'success': True,
+        'result': base64.b64encode(output).decode('utf-8'),
+        'content': content
+    }
+
+def _process_in_memory(kind, data, from_format, to_format, options, use_cache, save_output, build_result):
+    """Convert in-memory input through the cache into a result dict or a saved output file"""
+    label = kind
+    if save_output:
+        kind = f'{kind}-file'
+
+    cache_key = None
+    output_path = None
+    if save_output or (use_cache and conversion_cache.enabled) or inflight.enabled:
+        cache_key = make_cache_key(kind, hash_bytes(data), from_format, to_format, options)
+    if save_output:
+        # Same input, formats and options give the same output, so the key doubles as a file name
+        output_path = os.path.join(create_workspace(), f'{cache_key[:16]}.{to_format}')
+        output_filename = relative_path(output_path)
+
+    def from_cache():
+        with stage('cache'):
+            cached = conversion_cache.get(cache_key)
+            if cached:
+                result, payload = cached
+                if payload:
+                    shutil.copyfile(payload, output_path)
+        if cached:
+            result = dict(result, cached=True)
+            if save_output:
+                # The cached URL points into the workspace of the request that filled the cache
+                result['downloadUrl'] = f'/download/{output_filename}'
+            return result, output_path
+        return None
+
+    if use_cache:
+        cached = from_cache()
+        if cached:
+            return cached[0]
+
+    def convert():
         try:
-            if ',' in base64_data:
-                base64_data = base64_data.split(',', 1)[1]
-            
-            decoded_content = base64.b64decode(base64_data)
-        except:
-            return {'error': 'Invalid base64 content'}
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{from_format}') as temp_in:
-            temp_in.write(decoded_content)
-            temp_in_path = temp_in.name
-        
-        temp_out_path = temp_in_path + f'.{to_format}'
-        
-        cmd = ['pandoc', temp_in_path, '-f', from_format, '-t', to_format]
-        if options:
-            cmd.extend(options.split())
-        cmd.extend(['-o', temp_out_path])
-        
-        subprocess.run(cmd, check=True)
-        
-        converted_content = None
-        content = ""
-        
-        try:
-            with open(temp_out_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-                converted_content = base64.b64encode(content.encode('utf-8')).decode('utf-8')
-        except UnicodeDecodeError:
-            with open(temp_out_path, 'rb') as f:
-                binary_content = f.read()
-                converted_content = base64.b64encode(binary_content).decode('utf-8')
-                content = "[Binary content - encoded as base64]"
-        
-        os.unlink(temp_in_path)
-        os.unlink(temp_out_path)
-        
-        return {
-            'success': True,
-            'result': converted_content,
-            'content': content
-        }
-    except subprocess.CalledProcessError as e:
-        return {'error': f'Conversion failed: {str(e)}'}
+            output = convert_bytes(data, from_format, to_format, options)
+        except subprocess.CalledProcessError as e:
+            return {'error': f'Conversion failed: {str(e)}'}, None
+
+        if save_output:
+            with open(output_path, 'wb') as f:
+                f.write(output)
+            result = {
+                'success': True,
+                'downloadUrl': f'/download/{output_filename}'
+            }
+        else:
+            with stage('encode'):
+                result = build_result(output)
+
+        if use_cache and cache_key:
+            with stage('cache'):
+                conversion_cache.put(cache_key, result, output_path)
+        return result, output_path
+
+    recheck = from_cache if use_cache and conversion_cache.enabled else None
+    (result, _), _ = inflight.run(cache_key, convert, label, recheck=recheck, share=_share_output(output_path))
+    return dict(result)
 
 def process_file_with_pandoc(input_file, output_format, options=None):
     """
@@ -461,7 +551,7 @@ def process_file_with_pandoc(input_file, output_format, options=None):
             cmd = ['pandoc', input_file, '-o', output_path]
             if options:
                 cmd.extend(options.split())
-            subprocess.run(cmd, check=True)
+            run_tool(cmd, check=True)
         else:
             raise ValueError(f"Unsupported output format: {output_format}")
 
@@ -473,6 +563,8 @@ def process_file_with_pandoc(input_file, output_format, options=None):
         os.unlink(output_path)
 
         return output_data
+    except ServerBusy:
+        raise
     except Exception as e:
         raise Exception(f"Error converting file: {str(e)}")
 
@@ -494,6 +586,7 @@ def convert_document(request, config):
         from_format = request.form.get('from_format', '')
         to_format = request.form.get('to_format', '')
         options = request.form.get('options', '')
+        use_cache = cache_requested(request)
         
         if not from_format or not to_format:
             return jsonify({'error': 'Source and target formats are required'}), 400
@@ -504,9 +597,9 @@ def convert_document(request, config):
             if file.filename == '':
                 return jsonify({'error': 'No file selected'}), 400
                 
-            filename = file.filename
-            filepath = os.path.join(config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
+            filename = secure_filename(file.filename)
+            filepath = os.path.join(create_workspace(), filename)
+            input_hash = ingest_upload(file, filepath)
             
             # Check if it's an image conversion
             if from_format in ['jpg', 'jpeg', 'png', 'gif', 'webp', 'svg', 'bmp', 'tiff', 'wmf', 'emf']:
@@ -514,21 +607,24 @@ def convert_document(request, config):
                 resize = request.form.get('resize', None)
                 result = process_image_conversion(filepath, to_format, quality, resize, options)
             else:
-                result = process_file_conversion(filepath, from_format, to_format, options)
+                result = process_file_conversion(filepath, from_format, to_format, options, use_cache=use_cache,
+                                                 input_hash=input_hash)
                 
             return jsonify(result)
             
         # Handle text input
         elif 'text' in request.form:
             text = request.form['text']
-            result = process_text_conversion(text, from_format, to_format, options)
+            result = process_text_conversion(text, from_format, to_format, options, use_cache=use_cache)
             return jsonify(result)
             
         # Handle base64 input (for images)
         elif 'base64' in request.form:
             base64_data = request.form['base64']
-            result = process_base64_conversion(base64_data, from_format, to_format, options)
+            result = process_base64_conversion(base64_data, from_format, to_format, options, use_cache=use_cache)
             return jsonify(result)
             
+    except ServerBusy:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500 
\ No newline at end of file
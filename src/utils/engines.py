@@ -0,0 +1,397 @@
+import atexit
+import base64
+import json
+import os
+import shlex
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from src.config.config import (
+    PANDOC_ENGINE, PANDOC_SERVER_COMMAND, PANDOC_SERVER_POOL_SIZE,
+    PANDOC_SERVER_TIMEOUT, PANDOC_SERVER_HEALTH_INTERVAL
+)
+from src.utils.governor import run_tool, limiters, ServerBusy
+from src.utils.metrics import observe_tool, record_strategy
+from src.utils.timing import stage
+
+# Formats pandoc reads or writes as zip/binary containers
+BINARY_INPUT_FORMATS = {'docx', 'odt', 'epub', 'pptx', 'xlsx'}
+BINARY_OUTPUT_FORMATS = {'docx', 'odt', 'epub', 'epub2', 'epub3', 'pptx', 'pdf'}
+
+# Command-line flags the server API can express, mapped to its JSON fields
+SERVER_FLAGS = {
+    '--standalone': ('standalone', True),
+    '-s': ('standalone', True),
+    '--toc': ('table-of-contents', True),
+    '--table-of-contents': ('table-of-contents', True),
+    '--number-sections': ('number-sections', True),
+    '-N': ('number-sections', True),
+    '--reference-links': ('reference-links', True),
+    '--section-divs': ('section-divs', True),
+    '--preserve-tabs': ('preserve-tabs', True),
+    '--ascii': ('ascii', True),
+    '--strip-comments': ('strip-comments', True),
+    '--mathjax': ('html-math-method', {'method': 'mathjax'}),
+    '--mathml': ('html-math-method', {'method': 'mathml'}),
+    '--katex': ('html-math-method', {'method': 'katex'}),
+    '--webtex': ('html-math-method', {'method': 'webtex'}),
+    '--gladtex': ('html-math-method', {'method': 'gladtex'}),
+}
+
+SERVER_VALUE_OPTIONS = {
+    '--columns': ('columns', int),
+    '--tab-stop': ('tab-stop', int),
+    '--toc-depth': ('toc-depth', int),
+    '--dpi': ('dpi', int),
+    '--shift-heading-level-by': ('shift-heading-level-by', int),
+    '--wrap': ('wrap', str),
+    '--highlight-style': ('highlight-style', str),
+    '--id-prefix': ('identifier-prefix', str),
+    '--top-level-division': ('top-level-division', str),
+    '--reference-location': ('reference-location', str),
+    '--eol': ('eol', str),
+}
+
+SERVER_MAP_OPTIONS = {
+    '--metadata': 'metadata',
+    '-M': 'metadata',
+    '--variable': 'variables',
+    '-V': 'variables',
+}
+
+class CliEngine:
+    """Runs one pandoc process per conversion
+
+    Text input is fed to pandoc over stdin and text output is read from stdout.
+    Temporary files are only used for formats pandoc reads or writes as
+    zip/binary containers (docx, odt, epub, pdf, ...), and they are removed
+    whether or not the conversion succeeds.
+    """
+
+    name = 'cli'
+
+    def convert(self, data, from_format, to_format, options):
+        """
+        Convert a document held in memory.
+
+        Args:
+            data (bytes): Input document
+            from_format (str): Source format
+            to_format (str): Target format
+            options (str): Additional pandoc options
+
+        Returns:
+            bytes: The converted document
+
+        Raises:
+            subprocess.CalledProcessError: If pandoc fails
+        """
+        temp_paths = []
+        try:
+            cmd = ['pandoc']
+            stdin_kwargs = {'input': data}
+            if from_format.lower() in BINARY_INPUT_FORMATS:
+                with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{from_format}') as temp_in:
+                    temp_paths.append(temp_in.name)
+                    temp_in.write(data)
+                cmd.append(temp_in.name)
+                stdin_kwargs = {'stdin': subprocess.DEVNULL}
+
+            cmd.extend(['-f', from_format, '-t', to_format])
+            if options:
+                cmd.extend(options.split())
+
+            temp_out_path = None
+            if to_format.lower() in BINARY_OUTPUT_FORMATS:
+                with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{to_format}') as temp_out:
+                    temp_out_path = temp_out.name
+                temp_paths.append(temp_out_path)
+                cmd.extend(['-o', temp_out_path])
+
+            completed = run_tool(cmd, check=True, stdout=subprocess.PIPE, **stdin_kwargs)
+
+            if temp_out_path:
+                with open(temp_out_path, 'rb') as f:
+                    return f.read()
+            return completed.stdout
+        finally:
+            for path in temp_paths:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+class PandocServerError(Exception):
+    """Raised when a pandoc server cannot perform a conversion"""
+
+class PandocServerProcess:
+    """One long-lived `pandoc server` process listening on a local port; not restarted, but replaced"""
+
+    def __init__(self, command, timeout):
+        self.command = command
+        self.timeout = timeout
+        self.port = None
+        self.process = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def start(self):
+        # Ask the OS for a free port, then hand it to pandoc
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(('127.0.0.1', 0))
+            self.port = sock.getsockname()[1]
+
+        cmd = shlex.split(self.command) + ['--port', str(self.port), '--timeout', str(self.timeout)]
+        self.process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                break
+            if self.healthy():
+                return True
+            time.sleep(0.1)
+        self.stop()
+        return False
+
+    def healthy(self):
+        """Return True if the process is running and answers /version"""
+        if self.process is None or self.process.poll() is not None:
+            return False
+        try:
+            with urllib.request.urlopen(f'{self.url}/version', timeout=2) as response:
+                return response.status == 200
+        except (OSError, urllib.error.URLError):
+            return False
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+class PandocServerEngine:
+    """
+    Sends conversions to a pool of long-lived pandoc server processes.
+
+    Avoids pandoc's process start-up cost, which dominates small text
+    conversions. Only conversions whose options map onto the server's JSON API
+    are accepted; anything else (templates, filters, CSS, PDF output, media
+    extraction) goes to the CLI engine. A background thread health-checks the
+    pool and replaces processes that died or stopped answering: the new
+    process is started first and swapped into the pool under the lock, so a
+    request always picks a server whose port does not change under it.
+    """
+
+    name = 'server'
+
+    def __init__(self, command, size, timeout, health_interval):
+        self.command = command
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.health_interval = health_interval
+        self.servers = []
+        self.available = None
+        self.restarts = 0
+        self._next = 0
+        self._pid = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Server processes and the health-check thread belong to the process that started them
+        with self._lock:
+            if self._pid == os.getpid():
+                return self.available
+            self._pid = os.getpid()
+            self.servers = []
+            for _ in range(self.size):
+                server = PandocServerProcess(self.command, self.timeout)
+                if server.start():
+                    self.servers.append(server)
+            self.available = bool(self.servers)
+            if not self.available:
+                print(f"pandoc server could not be started with '{self.command}', using the CLI engine")
+                return False
+
+            atexit.register(self.shutdown)
+            threading.Thread(target=self._health_loop, name='pandoc-server-health', daemon=True).start()
+            return True
+
+    def _health_loop(self):
+        while not self._stopped.wait(self.health_interval):
+            with self._lock:
+                servers = list(self.servers)
+            for server in servers:
+                if not server.healthy():
+                    print(f"pandoc server on port {server.port} is unhealthy, restarting")
+                    self._replace(server)
+
+    def _replace(self, server):
+        """Start a new server process and swap it into the pool in place of `server`"""
+        replacement = PandocServerProcess(self.command, self.timeout)
+        if not replacement.start():
+            print(f"pandoc server could not be restarted, trying again in {self.health_interval} seconds")
+            return
+        with self._lock:
+            if self._stopped.is_set() or server not in self.servers:
+                replacement.stop()
+                return
+            self.servers[self.servers.index(server)] = replacement
+            self.restarts += 1
+        server.stop()
+
+    def _pick(self):
+        with self._lock:
+            server = self.servers[self._next % len(self.servers)]
+            self._next += 1
+            return server
+
+    def translate_options(self, options):
+        """
+        Map a pandoc options string onto server request fields.
+
+        Returns:
+            dict: Request fields, or None if an option has no server equivalent
+        """
+        fields = {}
+        tokens = options.split() if options else []
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            name, has_value, value = token.partition('=')
+            if name in SERVER_FLAGS and not has_value:
+                key, flag_value = SERVER_FLAGS[name]
+                fields[key] = flag_value
+            elif name in SERVER_VALUE_OPTIONS or name in SERVER_MAP_OPTIONS:
+                if not has_value:
+                    i += 1
+                    if i >= len(tokens):
+                        return None
+                    value = tokens[i]
+                if name in SERVER_MAP_OPTIONS:
+                    key, _, item = value.partition('=' if '=' in value else ':')
+                    fields.setdefault(SERVER_MAP_OPTIONS[name], {})[key] = item or True
+                else:
+                    key, cast = SERVER_VALUE_OPTIONS[name]
+                    try:
+                        fields[key] = cast(value)
+                    except ValueError:
+                        return None
+            else:
+                return None
+            i += 1
+        return fields
+
+    def can_handle(self, from_format, to_format, options):
+        """Return True if the conversion can be sent to the server"""
+        if to_format.lower() == 'pdf':
+            return False
+        return self.translate_options(options) is not None
+
+    def convert(self, data, from_format, to_format, options):
+        """
+        Convert a document held in memory.
+
+        Raises:
+            PandocServerError: If no server is available or the conversion failed
+        """
+        fields = self.translate_options(options)
+        if fields is None:
+            raise PandocServerError('Options are not supported by pandoc server')
+        if not self._ensure_started():
+            raise PandocServerError('pandoc server is not available')
+
+        if from_format.lower() in BINARY_INPUT_FORMATS:
+            text = base64.b64encode(data).decode('ascii')
+        else:
+            try:
+                text = data.decode('utf-8')
+            except UnicodeDecodeError as e:
+                # The JSON API only takes UTF-8 text; the CLI lets pandoc report the problem
+                raise PandocServerError(f'Input is not UTF-8: {str(e)}')
+        payload = dict(fields, text=text, **{'from': from_format, 'to': to_format})
+
+        server = self._pick()
+        request = urllib.request.Request(
+            server.url,
+            data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json', 'Accept': 'application/json'},
+            method='POST'
+        )
+        with limiters['pandoc'].slot(), stage('pandoc'):
+            started = time.monotonic()
+            outcome = 'error'
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout + 5) as response:
+                    body = json.loads(response.read().decode('utf-8'))
+                outcome = 'ok'
+            except urllib.error.HTTPError as e:
+                raise PandocServerError(e.read().decode('utf-8', 'replace') or str(e))
+            except (OSError, ValueError) as e:
+                raise PandocServerError(str(e))
+            finally:
+                observe_tool('pandoc-server', time.monotonic() - started, outcome=outcome)
+
+        output = body.get('output', '')
+        if body.get('base64'):
+            return base64.b64decode(output)
+        return output.encode('utf-8')
+
+    def shutdown(self):
+        self._stopped.set()
+        with self._lock:
+            servers = list(self.servers)
+        for server in servers:
+            server.stop()
+
+    def stats(self):
+        """Return pool state for status endpoints"""
+        with self._lock:
+            return {
+                'available': self.available,
+                'size': len(self.servers),
+                'restarts': self.restarts
+            }
+
+cli_engine = CliEngine()
+server_engine = PandocServerEngine(PANDOC_SERVER_COMMAND, PANDOC_SERVER_POOL_SIZE,
+                                   PANDOC_SERVER_TIMEOUT, PANDOC_SERVER_HEALTH_INTERVAL)
+
+ENGINES = {
+    cli_engine.name: cli_engine,
+    server_engine.name: server_engine,
+}
+
+def convert_bytes(data, from_format, to_format, options, engine=None):
+    """
+    Convert an in-memory document with the configured pandoc engine.
+
+    The server engine is used when PANDOC_ENGINE (or `engine`) is 'server' and
+    the options are expressible through its API; if the server is missing or
+    fails, the conversion is retried with the CLI.
+
+    Returns:
+        bytes: The converted document
+    """
+    selected = ENGINES.get(engine or PANDOC_ENGINE, cli_engine)
+    if selected is server_engine and server_engine.can_handle(from_format, to_format, options):
+        try:
+            output = server_engine.convert(data, from_format, to_format, options)
+            record_strategy('pandoc', 'server', True)
+            return output
+        except ServerBusy:
+            raise
+        except PandocServerError as e:
+            record_strategy('pandoc', 'server', False)
+            print(f"pandoc server conversion failed, falling back to CLI: {str(e)}")
+    return cli_engine.convert(data, from_format, to_format, options)
@@ -0,0 +1,334 @@
+import math
+import os
+import signal
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from src.config.config import (
+    PANDOC_MAX_CONCURRENCY, IMAGEMAGICK_MAX_CONCURRENCY, TOOL_MAX_QUEUE, TOOL_QUEUE_TIMEOUT, TOOL_SLOT_FOLDER
+)
+from src.utils.metrics import TOOL_ACTIVE, TOOL_QUEUED, TOOL_WAIT_SECONDS, TOOL_REJECTED, observe_tool
+from src.utils.timing import stage, record_stage
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Seconds between looks for slots freed by other server processes
+SLOT_POLL_INTERVAL = 0.1
+
+# Executables that count against each limiter
+TOOL_GROUPS = {
+    'pandoc': 'pandoc',
+    'convert': 'imagemagick',
+    'magick': 'imagemagick',
+    'rsvg-convert': 'imagemagick',
+    'wmf2svg': 'imagemagick',
+}
+
+class ServerBusy(Exception):
+    """Raised when a conversion cannot be admitted because the server is saturated"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+class ToolLimiter:
+    """
+    Caps how many processes of one tool run at once.
+
+    Callers beyond `limit` wait in a queue of at most `max_queue` entries for
+    up to `timeout` seconds; anything past that raises ServerBusy so the
+    request can be rejected with a Retry-After hint instead of piling up more
+    processes on an already saturated machine.
+
+    With a `folder`, the limit holds for all server processes together: slot
+    N is the file `<folder>/N.slot`, held by keeping an exclusive flock() on
+    it, which the kernel also releases when a process dies. Without fcntl
+    (Windows) or a usable folder, the limit applies to each process.
+    Queue length and timeout are per process either way.
+    """
+
+    def __init__(self, name, limit, max_queue, timeout, folder=None):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.folder = folder if fcntl is not None else None
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.avg_hold = 1.0
+        self._held = {}  # slot index -> locked file descriptor (None without a folder)
+        self._folder_ready = False
+        self._cond = threading.Condition()
+
+    def _take(self):
+        """Take a free slot; returns its index, or None if all `limit` slots are in use"""
+        if len(self._held) >= self.limit:
+            return None
+        for index in range(self.limit):
+            if index in self._held:
+                continue
+            if self.folder is None:
+                self._held[index] = None
+                return index
+            try:
+                if not self._folder_ready:
+                    os.makedirs(self.folder, exist_ok=True)
+                    self._folder_ready = True
+                fd = os.open(os.path.join(self.folder, f'{index}.slot'), os.O_CREAT | os.O_RDWR, 0o600)
+            except OSError as e:
+                print(f"Could not use {self.folder} for {self.name} slots, limiting per process: {str(e)}")
+                self.folder = None
+                return self._take()
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Held by another server process
+                os.close(fd)
+                continue
+            self._held[index] = fd
+            return index
+        return None
+
+    def _give_back(self, index):
+        fd = self._held.pop(index)
+        if fd is not None:
+            # Closing the descriptor releases the lock
+            os.close(fd)
+
+    def _retry_after(self):
+        # Time for the current queue to drain through the available slots
+        return self.avg_hold * (self.waiting + 1) / self.limit
+
+    @contextmanager
+    def slot(self):
+        """Hold one slot for the duration of the with-block"""
+        start = time.monotonic()
+        with self._cond:
+            index = self._take()
+            if index is None:
+                if self.waiting >= self.max_queue:
+                    self.rejected += 1
+                    TOOL_REJECTED.labels(self.name).inc()
+                    raise ServerBusy(f'Too many {self.name} conversions in progress', self._retry_after())
+
+                self.waiting += 1
+                TOOL_QUEUED.labels(self.name).inc()
+                try:
+                    deadline = start + self.timeout
+                    while index is None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected += 1
+                            TOOL_REJECTED.labels(self.name).inc()
+                            raise ServerBusy(f'Timed out waiting for a free {self.name} slot', self._retry_after())
+                        # Woken when this process frees a slot; slots freed by other processes are polled for
+                        self._cond.wait(min(remaining, SLOT_POLL_INTERVAL) if self.folder else remaining)
+                        index = self._take()
+                finally:
+                    self.waiting -= 1
+                    TOOL_QUEUED.labels(self.name).dec()
+                    record_stage('queue', time.monotonic() - start)
+
+            self.active += 1
+            self.admitted += 1
+            waited = time.monotonic() - start
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        TOOL_WAIT_SECONDS.labels(self.name).observe(waited)
+        TOOL_ACTIVE.labels(self.name).inc()
+
+        acquired = time.monotonic()
+        try:
+            yield
+        finally:
+            TOOL_ACTIVE.labels(self.name).dec()
+            with self._cond:
+                self._give_back(index)
+                self.active -= 1
+                self.avg_hold = 0.8 * self.avg_hold + 0.2 * (time.monotonic() - acquired)
+                self._cond.notify()
+
+    def stats(self):
+        """Return current load and wait-time figures"""
+        with self._cond:
+            return {
+                'limit': self.limit,
+                'scope': 'host' if self.folder else 'process',
+                'active': self.active,
+                'queued': self.waiting,
+                'max_queue': self.max_queue,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'avg_wait_seconds': round(self.total_wait / self.admitted, 4) if self.admitted else 0.0,
+                'max_wait_seconds': round(self.max_wait, 4),
+                'avg_run_seconds': round(self.avg_hold, 4)
+            }
+
+limiters = {
+    'pandoc': ToolLimiter('pandoc', PANDOC_MAX_CONCURRENCY, TOOL_MAX_QUEUE, TOOL_QUEUE_TIMEOUT,
+                          os.path.join(TOOL_SLOT_FOLDER, 'pandoc')),
+    'imagemagick': ToolLimiter('imagemagick', IMAGEMAGICK_MAX_CONCURRENCY, TOOL_MAX_QUEUE, TOOL_QUEUE_TIMEOUT,
+                               os.path.join(TOOL_SLOT_FOLDER, 'imagemagick')),
+}
+
+def wait_out_busy(func, timeout, give_up=None):
+    """
+    Call func(), retrying while it raises ServerBusy, for work with no client to send a 503 to.
+
+    Args:
+        func: The conversion to run
+        timeout (float): Seconds to keep retrying
+        give_up: Optional callable; when it returns True the wait ends early
+
+    Raises:
+        ServerBusy: If the server is still busy after `timeout` seconds
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return func()
+        except ServerBusy as e:
+            if (give_up and give_up()) or time.monotonic() + e.retry_after > deadline:
+                raise
+            time.sleep(e.retry_after)
+
+def run_tool(cmd, **kwargs):
+    """
+    Run an external conversion tool once a slot for it is free.
+
+    Takes the same arguments as subprocess.run. Raises ServerBusy if no slot
+    becomes available in time. Wall and CPU time of the process are recorded
+    in the metrics.
+    """
+    tool = os.path.basename(cmd[0])
+    group = TOOL_GROUPS.get(tool)
+    if group is None:
+        with stage(tool):
+            return _run(tool, cmd, **kwargs)
+    with limiters[group].slot(), stage(group):
+        return _run(tool, cmd, **kwargs)
+
+def _run(tool, cmd, input=None, capture_output=False, timeout=None, check=False, **kwargs):
+    """subprocess.run() that records the run, with the child's CPU time where wait4() exists, in the tool metrics"""
+    if capture_output:
+        kwargs['stdout'] = subprocess.PIPE
+        kwargs['stderr'] = subprocess.PIPE
+
+    started = time.monotonic()
+    rusage = None
+    outcome = 'error'
+    try:
+        if hasattr(os, 'wait4') and hasattr(os, 'waitid'):
+            completed, rusage, timed_out = _run_reaped(cmd, input, timeout, **kwargs)
+            if timed_out:
+                raise subprocess.TimeoutExpired(completed.args, timeout, completed.stdout, completed.stderr)
+        else:
+            # wait4() and waitid() are POSIX only (waitid() is missing on macOS); elsewhere CPU time is not reported
+            completed = subprocess.run(cmd, input=input, timeout=timeout, **kwargs)
+        if check:
+            completed.check_returncode()
+        outcome = 'ok'
+        return completed
+    except FileNotFoundError:
+        outcome = 'missing'
+        raise
+    finally:
+        observe_tool(tool, time.monotonic() - started, rusage, outcome)
+
+def _run_reaped(cmd, input, timeout, **kwargs):
+    """
+    Start a tool with Popen and reap it with os.wait4() to get its resource usage.
+
+    Pipes are serviced by helper threads, as communicate() would, while this
+    thread waits for the exit with waitid(WNOWAIT), which leaves the process
+    unreaped, and then reaps it with wait4() under the same lock the timeout's
+    kill takes, so the kill can never hit a pid that was already reaped.
+
+    Returns:
+        tuple: (CompletedProcess, rusage, whether the timeout killed the process)
+    """
+    if input is not None:
+        kwargs['stdin'] = subprocess.PIPE
+    process = subprocess.Popen(cmd, **kwargs)
+    lock = threading.Lock()
+    reaped = killed = False
+    rusage = None
+
+    def kill():
+        nonlocal killed
+        # Not Popen.kill(): it polls, which could reap the process before wait4() does
+        with lock:
+            if not reaped:
+                killed = True
+                os.kill(process.pid, signal.SIGKILL)
+
+    captured = {}
+    threads = [threading.Thread(target=_drain, args=(pipe, captured, name), daemon=True)
+               for name, pipe in (('stdout', process.stdout), ('stderr', process.stderr)) if pipe is not None]
+    if input is not None:
+        threads.append(threading.Thread(target=_feed, args=(process.stdin, input), daemon=True))
+    timer = threading.Timer(timeout, kill) if timeout else None
+    try:
+        for thread in threads:
+            thread.start()
+        if timer:
+            timer.daemon = True
+            timer.start()
+        try:
+            os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+        except ChildProcessError:
+            pass
+        with lock:
+            try:
+                _, status, rusage = os.wait4(process.pid, 0)
+            except ChildProcessError:
+                # Same as Popen: the child was reaped elsewhere (e.g. SIGCHLD is ignored)
+                status = 0
+            reaped = True
+        process.returncode = os.waitstatus_to_exitcode(status)
+    finally:
+        if timer:
+            timer.cancel()
+        with lock:
+            if not reaped:
+                # Interrupted while waiting: do not leave the tool running
+                os.kill(process.pid, signal.SIGKILL)
+                process.wait()
+                reaped = True
+        for thread in threads:
+            thread.join()
+
+    for value in captured.values():
+        if isinstance(value, Exception):
+            raise value
+    completed = subprocess.CompletedProcess(process.args, process.returncode,
+                                            captured.get('stdout'), captured.get('stderr'))
+    return completed, rusage, killed
+
+def _drain(pipe, captured, name):
+    """Read one output pipe of a tool to the end (an error is kept for the caller to raise)"""
+    with pipe:
+        try:
+            captured[name] = pipe.read()
+        except Exception as e:
+            captured[name] = e
+
+def _feed(pipe, data):
+    """Write a tool's input and close its stdin; like communicate(), a tool that stops reading is not an error"""
+    try:
+        with pipe:
+            pipe.write(data)
+    except BrokenPipeError:
+        pass
+
+def governor_stats():
+    """Return limiter statistics keyed by tool group"""
+    return {name: limiter.stats() for name, limiter in limiters.items()}
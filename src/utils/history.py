@@ -1,47 +1,418 @@
-import json
+import base64
+import functools
+import hashlib
 import os
+import secrets
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
 from datetime import datetime
+from flask import g, has_request_context, request
+from src.config.config import HISTORY_FOLDER, HISTORY_MAX_ENTRIES, HISTORY_MAX_BYTES
+from src.utils.responses import output_path_for
+from src.utils.timing import stage
 
-HISTORY_FILE = 'conversion_history.json'
+HISTORY_DB = os.path.join(HISTORY_FOLDER, 'history.db')
+# JSON file used before the SQLite store, written to the working directory; imported once, then renamed
+LEGACY_HISTORY_FILE = os.path.abspath('conversion_history.json')
 
-def add_to_history(source_file, target_format, status, error_message=None):
+# Entries belong to the client that made the conversion, identified by a token it sends in
+# this header or, for browsers, a cookie set with the response to its first conversion
+CLIENT_HEADER = 'X-Client-Token'
+CLIENT_COOKIE = 'client_token'
+CLIENT_COOKIE_MAX_AGE = 365 * 24 * 3600
+MAX_TOKEN_LENGTH = 256
+
+HISTORY_COLUMNS = ('id', 'timestamp', 'kind', 'source_file', 'from_format', 'target_format',
+                   'status', 'error_message', 'output', 'size', 'cached')
+HISTORY_STATUSES = ('success', 'failed')
+MAX_PAGE_SIZE = 200
+# Trimming to HISTORY_MAX_ENTRIES runs once per this many inserts
+PRUNE_INTERVAL = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    created REAL NOT NULL,
+    timestamp TEXT NOT NULL,
+    kind TEXT,
+    source_file TEXT,
+    from_format TEXT,
+    target_format TEXT,
+    status TEXT NOT NULL,
+    error_message TEXT,
+    output TEXT,
+    size INTEGER NOT NULL DEFAULT 0,
+    cached INTEGER NOT NULL DEFAULT 0,
+    client TEXT
+);
+"""
+
+# After SCHEMA and the column migrations, which older databases need for these indexes
+INDEXES = """
+CREATE INDEX IF NOT EXISTS history_created ON history (created);
+CREATE INDEX IF NOT EXISTS history_status ON history (status, seq);
+CREATE INDEX IF NOT EXISTS history_formats ON history (from_format, target_format, seq);
+CREATE INDEX IF NOT EXISTS history_client ON history (client, seq);
+CREATE TABLE IF NOT EXISTS history_usage (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    bytes INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS history_usage_insert AFTER INSERT ON history
+BEGIN
+    UPDATE history_usage SET bytes = bytes + NEW.size;
+END;
+CREATE TRIGGER IF NOT EXISTS history_usage_delete AFTER DELETE ON history
+BEGIN
+    UPDATE history_usage SET bytes = bytes - OLD.size;
+END;
+INSERT OR IGNORE INTO history_usage (id, bytes) SELECT 1, COALESCE(SUM(size), 0) FROM history;
+"""
+
+class HistoryStore:
+    """
+    Conversion history in a SQLite database in WAL mode.
+
+    Each add is a single indexed INSERT, so its cost does not depend on how
+    many entries exist. WAL lets readers run alongside the writer, and
+    SQLite's file locking makes the store safe to share between server
+    processes. Every thread gets its own connection.
+
+    Stored outputs are limited to max_bytes: triggers keep their total in
+    history_usage, and adding an entry that goes over it deletes the oldest
+    entries until the outputs fit again.
+    """
+
+    def __init__(self, path, max_entries, max_bytes=0):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized_pid = None
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA busy_timeout = 30000')
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+
+        with self._init_lock:
+            if self._initialized_pid != os.getpid():
+                conn.executescript(SCHEMA)
+                self._add_columns(conn)
+                conn.executescript(INDEXES)
+                self._archive_legacy()
+                self._initialized_pid = os.getpid()
+        return conn
+
+    def _add_columns(self, conn):
+        """Add columns introduced after a database was created"""
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(history)')}
+        if 'client' not in columns:
+            try:
+                conn.execute('ALTER TABLE history ADD COLUMN client TEXT')
+            except sqlite3.OperationalError:
+                # Another server process added it first
+                pass
+
+    def _archive_legacy(self):
+        """
+        Set the old JSON history file aside, if there is one.
+
+        Its entries are not imported: they predate client tokens, so no client
+        could list or download them and they would only take up the quota.
+        """
+        if not os.path.exists(LEGACY_HISTORY_FILE):
+            return
+        try:
+            os.replace(LEGACY_HISTORY_FILE, LEGACY_HISTORY_FILE + '.archived')
+            print(f"Archived the old history file as {LEGACY_HISTORY_FILE}.archived; its entries are not shown")
+        except OSError:
+            # Another server process archived it first
+            pass
+
+    def _insert(self, conn, entry):
+        created = entry.get('created')
+        if created is None:
+            try:
+                created = datetime.fromisoformat(entry['timestamp']).timestamp()
+            except (KeyError, TypeError, ValueError):
+                created = time.time()
+        cursor = conn.execute(
+            'INSERT OR IGNORE INTO history (id, created, timestamp, kind, source_file, from_format, target_format, '
+            'status, error_message, output, size, cached, client) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (entry['id'], created, entry.get('timestamp') or datetime.fromtimestamp(created).isoformat(),
+             entry.get('kind'), entry.get('source_file'), entry.get('from_format'), entry.get('target_format'),
+             entry.get('status') or 'success', entry.get('error_message'), entry.get('output'),
+             entry.get('size') or 0, int(bool(entry.get('cached'))), entry.get('client'))
+        )
+        return cursor.lastrowid
+
+    def add(self, entry):
+        """Append an entry; keep outputs within max_bytes and, every PRUNE_INTERVAL inserts, the store to max_entries"""
+        conn = self._connect()
+        seq = self._insert(conn, entry)
+        if self.max_entries and seq and seq % PRUNE_INTERVAL == 0:
+            self.prune()
+        if self.max_bytes and seq and entry.get('size'):
+            self.enforce_quota(keep=seq)
+
+    def prune(self):
+        """Delete the oldest entries beyond max_entries, and their stored outputs"""
+        conn = self._connect()
+        row = conn.execute('SELECT seq FROM history ORDER BY seq DESC LIMIT 1 OFFSET ?',
+                           (self.max_entries,)).fetchone()
+        if row is not None:
+            self._drop(conn, row['seq'])
+
+    def enforce_quota(self, keep=None):
+        """Delete the oldest entries until the stored outputs fit in max_bytes; the entry `keep` always stays"""
+        conn = self._connect()
+        excess = conn.execute('SELECT bytes FROM history_usage').fetchone()['bytes'] - self.max_bytes
+        if excess <= 0:
+            return
+        freed, last = 0, None
+        for row in conn.execute('SELECT seq, size FROM history WHERE size > 0 ORDER BY seq'):
+            if row['seq'] == keep:
+                break
+            freed += row['size']
+            last = row['seq']
+            if freed >= excess:
+                break
+        if last is not None:
+            self._drop(conn, last)
+
+    def _drop(self, conn, last_seq):
+        """Delete the entries up to and including `last_seq`, and their stored outputs"""
+        dropped = [r['id'] for r in conn.execute('SELECT id FROM history WHERE seq <= ?', (last_seq,))]
+        conn.execute('DELETE FROM history WHERE seq <= ?', (last_seq,))
+        for entry_id in dropped:
+            shutil.rmtree(os.path.join(HISTORY_FOLDER, entry_id), ignore_errors=True)
+
+    def usage(self):
+        """Return the number of entries and the total size of their stored outputs"""
+        conn = self._connect()
+        return {
+            'entries': conn.execute('SELECT COUNT(*) FROM history').fetchone()[0],
+            'size_bytes': conn.execute('SELECT bytes FROM history_usage').fetchone()['bytes'],
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes
+        }
+
+    def get_many(self, ids, client):
+        """Return the client's entries by id, in the order requested (unknown and other clients' ids are skipped)"""
+        if not ids or not client:
+            return []
+        conn = self._connect()
+        found = {}
+        # Stay below SQLite's bound-parameter limit
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            for row in conn.execute(f'SELECT * FROM history WHERE client = ? AND id IN ({placeholders})',
+                                    [client] + chunk):
+                found[row['id']] = _row_to_entry(row)
+        return [found[entry_id] for entry_id in ids if entry_id in found]
+
+    def query(self, client, status=None, kind=None, from_format=None, to_format=None, since=None, until=None,
+              limit=50, cursor=None):
+        """
+        Page through a client's history, newest first.
+
+        Args:
+            client (str): Client id of the entries (see client_id())
+            status, kind, from_format, to_format (str, optional): Exact-match filters
+            since, until (float, optional): Unix time bounds on the entry's creation time
+            limit (int): Page size, at most MAX_PAGE_SIZE
+            cursor (int, optional): nextCursor of the previous page
+
+        Returns:
+            dict: {'items': [...], 'nextCursor': int or None}
+        """
+        if not client:
+            return {'items': [], 'nextCursor': None}
+        clauses, params = ['client = ?'], [client]
+        for column, value in (('status', status), ('kind', kind),
+                              ('from_format', from_format), ('target_format', to_format)):
+            if value:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        if since is not None:
+            clauses.append('created >= ?')
+            params.append(since)
+        if until is not None:
+            clauses.append('created < ?')
+            params.append(until)
+        if cursor is not None:
+            # Keyset pagination: cost does not grow with the page number
+            clauses.append('seq < ?')
+            params.append(cursor)
+
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        where = f'WHERE {" AND ".join(clauses)}'
+        rows = self._connect().execute(
+            f'SELECT * FROM history {where} ORDER BY seq DESC LIMIT ?', params + [limit + 1]
+        ).fetchall()
+
+        next_cursor = rows[limit - 1]['seq'] if len(rows) > limit else None
+        return {
+            'items': [_row_to_entry(row) for row in rows[:limit]],
+            'nextCursor': next_cursor
+        }
+
+def _row_to_entry(row):
+    entry = {column: row[column] for column in HISTORY_COLUMNS}
+    entry['cached'] = bool(entry['cached'])
+    return entry
+
+history_store = HistoryStore(HISTORY_DB, HISTORY_MAX_ENTRIES, HISTORY_MAX_BYTES)
+
+def client_id(create=False):
+    """
+    Identify the client of the current request for its history.
+
+    The token from the X-Client-Token header or the client_token cookie is
+    hashed, so the database never holds tokens that grant access.
+
+    Args:
+        create (bool): Give a client without a token a new one, sent back by issue_client_token()
+
+    Returns:
+        str: Client id, or None outside a request or without a token
+    """
+    if not has_request_context():
+        return None
+    token = (request.headers.get(CLIENT_HEADER) or request.cookies.get(CLIENT_COOKIE) or '').strip()
+    if len(token) > MAX_TOKEN_LENGTH:
+        token = ''
+    token = token or g.get('new_client_token')
+    if not token and create:
+        token = g.new_client_token = secrets.token_urlsafe(32)
+    return hashlib.sha256(token.encode('utf-8')).hexdigest() if token else None
+
+def issue_client_token(response):
+    """after_request hook: send a token created during the request to the client"""
+    token = g.get('new_client_token')
+    if token:
+        response.set_cookie(CLIENT_COOKIE, token, max_age=CLIENT_COOKIE_MAX_AGE, httponly=True, samesite='Lax')
+        response.headers[CLIENT_HEADER] = token
+    return response
+
+def add_to_history(source_file, target_format, status, error_message=None, **fields):
     """
     Add a conversion attempt to the history.
-    
+
     Args:
         source_file (str): Name of the source file
         target_format (str): Target format of the conversion
         status (str): Success or failure status
         error_message (str, optional): Error message if conversion failed
+        **fields: Extra fields stored with the entry (id, kind, output, ...)
+
+    Returns:
+        dict: The stored entry
     """
-    history = load_history()
-    
     entry = {
+        'id': uuid.uuid4().hex,
         'timestamp': datetime.now().isoformat(),
         'source_file': source_file,
         'target_format': target_format,
         'status': status,
         'error_message': error_message
     }
-    
-    history.append(entry)
-    save_history(history)
+    entry.update(fields)
+    history_store.add(entry)
+    return entry
+
+def get_history(client, **filters):
+    """Get one page of a client's conversion history, newest first (see HistoryStore.query)."""
+    return history_store.query(client, **filters)
 
-def load_history():
-    """Load the conversion history from file."""
-    if os.path.exists(HISTORY_FILE):
+def get_entries(ids, client):
+    """Return the client's history entries with the given ids, in the order requested (others are skipped)"""
+    return history_store.get_many(ids, client)
+
+def output_path(entry):
+    """Path of the stored output of a history entry, or None if it has none"""
+    if not entry.get('output'):
+        return None
+    path = os.path.join(HISTORY_FOLDER, entry['id'], entry['output'])
+    return path if os.path.exists(path) else None
+
+def record_conversion(kind, result, source_file, from_format, to_format, client=None):
+    """
+    Store a conversion result in the history, keeping a copy of its output.
+
+    The output is taken from the converted file when the result has a
+    download URL (hard-linked when possible, so nothing is copied), and from
+    the text or base64 returned inline otherwise. The stored output stays
+    available for history downloads after the upload folder is cleaned up.
+    The entry belongs to `client` (see client_id()).
+
+    Returns:
+        str: Id of the history entry
+    """
+    entry_id = uuid.uuid4().hex
+    if not result.get('success'):
+        add_to_history(source_file, to_format, 'failed', result.get('error'),
+                       id=entry_id, kind=kind, from_format=from_format, client=client)
+        return entry_id
+
+    base_name = os.path.splitext(os.path.basename(source_file or ''))[0] or kind
+    output_name = f'{base_name}.{to_format}'
+    target = os.path.join(HISTORY_FOLDER, entry_id, output_name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+
+    source = output_path_for(result['downloadUrl']) if result.get('downloadUrl') else None
+    if source and os.path.exists(source):
         try:
-            with open(HISTORY_FILE, 'r') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            return []
-    return []
+            os.link(source, target)
+        except OSError:
+            shutil.copyfile(source, target)
+    elif kind == 'base64' and result.get('result'):
+        with open(target, 'wb') as f:
+            f.write(base64.b64decode(result['result']))
+    elif result.get('content') is not None:
+        with open(target, 'w', encoding='utf-8') as f:
+            f.write(result['content'])
+    else:
+        output_name = None
 
-def save_history(history):
-    """Save the conversion history to file."""
-    with open(HISTORY_FILE, 'w') as f:
-        json.dump(history, f, indent=2)
+    add_to_history(source_file, to_format, 'success', id=entry_id, kind=kind, from_format=from_format,
+                   output=output_name, size=os.path.getsize(target) if output_name else 0,
+                   cached=bool(result.get('cached')), client=client)
+    return entry_id
+
+def recorded(func, kind, source_file, from_format, to_format):
+    """
+    Wrap a conversion function so that its result is recorded in the history.
 
-def get_history():
-    """Get the complete conversion history."""
-    return load_history() 
\ No newline at end of file
+    The history id is added to the result as `historyId`. Recording problems
+    are logged and never fail the conversion. Call it while handling the
+    request: the entry belongs to the request's client, also when the
+    conversion runs later as a job.
+    """
+    client = client_id(create=True)
+
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        result = func(*args, **kwargs)
+        try:
+            with stage('history'):
+                result['historyId'] = record_conversion(kind, result, source_file, from_format, to_format, client)
+        except Exception as e:
+            print(f"Failed to record conversion in history: {str(e)}")
+        return result
+    return run
@@ -0,0 +1,149 @@
+import os
+import re
+from src.config.config import IMAGE_ENGINE
+from src.utils.governor import limiters
+from src.utils.timing import stage
+
+IMAGE_ENGINES = ('auto', 'pillow', 'imagemagick')
+
+# Raster formats Pillow reads and writes without extra plugins, by file extension
+PILLOW_FORMATS = {
+    'png': 'PNG',
+    'jpg': 'JPEG',
+    'jpeg': 'JPEG',
+    'gif': 'GIF',
+    'webp': 'WEBP',
+    'bmp': 'BMP',
+    'tif': 'TIFF',
+    'tiff': 'TIFF',
+}
+
+# ImageMagick geometry subset: WxH, W, xH or N%, optionally followed by ! (exact) or > (shrink only)
+RESIZE_PATTERN = re.compile(r'^\s*(?:(?P<percent>\d+(?:\.\d+)?)%|(?P<width>\d+)?(?:x(?P<height>\d+))?)\s*(?P<flag>[!>]?)\s*$')
+
+def parse_resize(resize):
+    """
+    Parse an ImageMagick-style resize geometry.
+
+    Returns:
+        dict: Geometry fields, or None if the geometry uses features only
+        ImageMagick supports
+    """
+    if not resize:
+        return {}
+    match = RESIZE_PATTERN.match(resize.lower())
+    if not match or not (match.group('percent') or match.group('width') or match.group('height')):
+        return None
+    return {
+        'percent': float(match.group('percent')) if match.group('percent') else None,
+        'width': int(match.group('width')) if match.group('width') else None,
+        'height': int(match.group('height')) if match.group('height') else None,
+        'flag': match.group('flag')
+    }
+
+def target_size(size, geometry):
+    """Compute the output size for an image of `size` resized with a parsed geometry"""
+    width, height = size
+    if not geometry:
+        return size
+    if geometry['percent'] is not None:
+        scale = geometry['percent'] / 100.0
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    box_w, box_h = geometry['width'], geometry['height']
+    if geometry['flag'] == '!' and box_w and box_h:
+        return box_w, box_h
+
+    # Fit inside the box, keeping the aspect ratio, like ImageMagick's default
+    scales = []
+    if box_w:
+        scales.append(box_w / width)
+    if box_h:
+        scales.append(box_h / height)
+    scale = min(scales)
+    if geometry['flag'] == '>' and scale >= 1:
+        return size
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def select_image_engine(filepath, to_format, resize=None, options=None, engine=None):
+    """
+    Choose the engine for a raster conversion.
+
+    'auto' uses Pillow for common raster pairs with at most a resize and
+    quality setting and leaves everything else (vector formats, WMF/EMF,
+    extra ImageMagick options) to ImageMagick. 'pillow' and 'imagemagick'
+    force an engine, e.g. for benchmarking.
+
+    Returns:
+        str: 'pillow' or 'imagemagick'
+
+    Raises:
+        ValueError: If Pillow is forced for a conversion it cannot do
+    """
+    engine = (engine or IMAGE_ENGINE).lower()
+    if engine == 'imagemagick':
+        return 'imagemagick'
+
+    in_ext = os.path.splitext(filepath)[1].lstrip('.').lower()
+    supported = (
+        in_ext in PILLOW_FORMATS
+        and to_format.lower() in PILLOW_FORMATS
+        and not options
+        and parse_resize(resize) is not None
+    )
+    if engine == 'pillow' and not supported:
+        raise ValueError(f'The Pillow engine cannot convert {in_ext or "this file"} to {to_format} with these options')
+    return 'pillow' if supported else 'imagemagick'
+
+def convert_with_pillow(filepath, output_path, to_format, quality=100, resize=None):
+    """
+    Convert a raster image in-process with Pillow.
+
+    JPEG inputs being scaled down are decoded in draft mode, which lets libjpeg
+    decode directly at a reduced scale instead of decoding the full image
+    first. Animated inputs are rejected so that ImageMagick keeps handling them.
+
+    Raises:
+        ValueError: If the image or parameters need ImageMagick
+        OSError: If Pillow cannot read or write the image
+    """
+    from PIL import Image
+
+    geometry = parse_resize(resize)
+    if geometry is None:
+        raise ValueError(f'Resize geometry {resize!r} is not supported by the Pillow engine')
+    out_format = PILLOW_FORMATS[to_format.lower()]
+
+    # Pillow work counts against the same limit as ImageMagick processes
+    with limiters['imagemagick'].slot(), stage('pillow'):
+        with Image.open(filepath) as img:
+            if getattr(img, 'is_animated', False):
+                raise ValueError('Animated images are converted with ImageMagick')
+
+            size = target_size(img.size, geometry)
+            if img.format == 'JPEG' and size[0] < img.size[0] and size[1] < img.size[1]:
+                img.draft(img.mode, size)
+
+            info = img.info
+            if size != img.size:
+                img = img.resize(size, Image.LANCZOS)
+            else:
+                img.load()
+
+            if out_format in ('JPEG', 'BMP') and img.mode not in ('RGB', 'L'):
+                # No alpha channel in these formats: flatten onto white
+                rgba = img.convert('RGBA')
+                background = Image.new('RGB', rgba.size, (255, 255, 255))
+                background.paste(rgba, mask=rgba.getchannel('A'))
+                img = background
+
+            save_kwargs = {}
+            if info.get('icc_profile') and out_format in ('JPEG', 'PNG', 'WEBP', 'TIFF'):
+                save_kwargs['icc_profile'] = info['icc_profile']
+            if out_format in ('JPEG', 'WEBP'):
+                save_kwargs['quality'] = quality
+            elif out_format == 'PNG':
+                # ImageMagick maps -quality to zlib level for PNG (tens digit)
+                save_kwargs['compress_level'] = min(9, quality // 10)
+
+            img.save(output_path, format=out_format, **save_kwargs)
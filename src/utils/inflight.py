@@ -0,0 +1,226 @@
+"""
+Coalescing of identical conversions that are in flight at the same time.
+
+When the same document is submitted several times at once (clients retrying
+impatiently, fan-out from a publishing pipeline), only the first request
+converts it; the duplicates wait for it and share its result instead of
+running the same pandoc command again. Conversions are identified by their
+cache key: kind, input hash, formats and options.
+
+Within a server process duplicates wait for the first request to finish,
+which then runs each duplicate's `share` step (copying its output file into
+the duplicate's workspace) before letting them go: once the first request
+returns, its caller may delete or move the output.
+
+Across gunicorn workers, the first request in each worker takes a lock file
+named after the key in INFLIGHT_FOLDER; a worker that had to wait for the
+lock looks the result up in the conversion cache and only converts if it is
+not there (the other worker's conversion failed or bypassed the cache).
+Without fcntl (Windows) coalescing stays within each process.
+
+Tool runs have no time limit, so a duplicate waits at most TOOL_QUEUE_TIMEOUT
+seconds for the first request (or the other worker); after that it converts
+on its own rather than hang with a stuck conversion.
+"""
+import os
+import threading
+import time
+from src.config.config import COALESCE_ENABLED, INFLIGHT_FOLDER, TOOL_QUEUE_TIMEOUT
+from src.utils.metrics import COALESCED
+from src.utils.timing import stage
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+LOCK_POLL_INTERVAL = 0.05
+
+class _Call:
+    """One conversion in flight and the requests waiting for it"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.followers = []
+        self.settling = False  # the leader took the followers list; nobody may leave it any more
+
+class _Follower:
+    """A duplicate request waiting for a call, and the value prepared for it"""
+
+    def __init__(self, share):
+        self.share = share
+        self.value = None
+        self.error = None
+
+    def settle(self, value, error):
+        if error is not None:
+            self.error = error
+            return
+        try:
+            self.value = self.share(value) if self.share else value
+        except Exception as e:
+            self.error = e
+
+class SingleFlight:
+    """Runs identical calls once (see module docstring)"""
+
+    def __init__(self, folder=INFLIGHT_FOLDER, enabled=COALESCE_ENABLED, timeout=TOOL_QUEUE_TIMEOUT):
+        self.folder = folder
+        self.enabled = enabled
+        self.timeout = timeout
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, function, kind, recheck=None, share=None):
+        """
+        Call function() unless an identical call is in flight, otherwise wait for its value.
+
+        Args:
+            key (str): Identifies identical calls (a cache key)
+            function: Does the work; its return value is shared with the duplicates
+            kind (str): Conversion kind for the metrics (file, text, base64, image)
+            recheck: Called after waiting for another worker; returns that worker's
+                value (e.g. from the cache), or None to do the work after all
+            share: Turns a value produced for another request into this request's
+                value, e.g. by copying its output file; an exception fails this request
+
+        Returns:
+            tuple: (value, shared), shared being True when the value was produced
+            for another request (and passed through share)
+        """
+        if not self.enabled or key is None:
+            return function(), False
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                follower = _Follower(share)
+                call.followers.append(follower)
+
+        if not leader:
+            with stage('coalesce'):
+                finished = call.done.wait(self.timeout)
+            if not finished:
+                with self._lock:
+                    leave = not call.settling
+                    if leave:
+                        call.followers.remove(follower)
+                if leave:
+                    print(f"Gave up waiting for the identical conversion {key} after {self.timeout}s, converting")
+                    return function(), False
+                # The leader is already preparing this request's value
+                call.done.wait()
+            self._count(kind, 'process')
+            if follower.error is not None:
+                raise follower.error
+            return follower.value, True
+
+        value = error = None
+        try:
+            value, shared = self._run_locked(key, function, kind, recheck)
+        except BaseException as e:
+            # The duplicates fail the same way, e.g. with ServerBusy
+            error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                call.settling = True
+            # No duplicates join or leave any more; prepare theirs while this request's output is still in place
+            for waiting in call.followers:
+                waiting.settle(value, error)
+            call.done.set()
+        if shared and share:
+            return share(value), True
+        return value, shared
+
+    def _run_locked(self, key, function, kind, recheck):
+        # Waiting for another worker only pays off if its result can be picked up afterwards
+        if recheck is None or fcntl is None:
+            return function(), False
+        path = os.path.join(self.folder, f'{key}.lock')
+        try:
+            fd, waited = self._acquire(path)
+        except OSError as e:
+            print(f"Could not lock {path}, converting without coalescing: {str(e)}")
+            return function(), False
+        if fd is None:
+            print(f"Gave up waiting for the identical conversion {key} in another worker after {self.timeout}s, converting")
+            return function(), False
+        try:
+            if waited:
+                value = recheck()
+                if value is not None:
+                    self._count(kind, 'workers')
+                    return value, True
+            return function(), False
+        finally:
+            # Remove the file while still holding the lock, so nobody locks a file that is gone
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            os.close(fd)
+
+    def _acquire(self, path):
+        """
+        Lock `path` exclusively, polling for at most self.timeout seconds.
+
+        Returns:
+            tuple: (fd, whether another holder had to be waited for); fd is None
+            when the lock was still held at the deadline
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        while True:
+            fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o600)
+            try:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    waited = True
+                    if not self._wait_for_lock(fd, deadline):
+                        os.close(fd)
+                        return None, waited
+                # The previous holder may have removed the file in the meantime; lock the new one then
+                if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                    return fd, waited
+            except FileNotFoundError:
+                pass
+            except BaseException:
+                os.close(fd)
+                raise
+            os.close(fd)
+
+    def _wait_for_lock(self, fd, deadline):
+        """Retry flock() on `fd` until `deadline`; returns False if it stayed locked"""
+        with stage('coalesce'):
+            while time.monotonic() < deadline:
+                time.sleep(LOCK_POLL_INTERVAL)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return True
+                except BlockingIOError:
+                    pass
+        return False
+
+    def _count(self, kind, scope):
+        with self._lock:
+            self.coalesced += 1
+        COALESCED.labels(kind, scope).inc()
+
+    def stats(self):
+        """Return the number of conversions in flight in this process and how many were coalesced"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'in_flight': len(self._calls),
+                'coalesced': self.coalesced
+            }
+
+inflight = SingleFlight()
@@ -0,0 +1,100 @@
+import hashlib
+import os
+import tempfile
+from flask import Request
+from src.config.config import INGEST_FOLDER
+from src.utils.timing import stage
+
+CHUNK_SIZE = 1024 * 1024
+
+class HashingSpoolFile:
+    """
+    Disk-backed target for one uploaded file.
+
+    The multipart parser writes the upload into this object chunk by chunk as
+    it reads the request body, so the upload reaches disk exactly once and its
+    SHA-256 is known as soon as parsing finishes.
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix='upload-', suffix='.part')
+        self._file = os.fdopen(fd, 'w+b')
+        self._digest = hashlib.sha256()
+        self.size = 0
+        self.consumed = False
+
+    def write(self, data):
+        self._digest.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def discard(self):
+        """Delete the spooled data if it was never moved into place"""
+        self._file.close()
+        if not self.consumed and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getattr__(self, name):
+        # read(), seek(), close() etc. go to the underlying file
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+class IngestRequest(Request):
+    """Request class that streams file uploads into INGEST_FOLDER while hashing them"""
+
+    def _load_form_data(self):
+        # Parsing the form is where the upload is received, written and hashed
+        with stage('upload'):
+            super()._load_form_data()
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        spool = HashingSpoolFile(INGEST_FOLDER)
+        self.__dict__.setdefault('_ingest_spools', []).append(spool)
+        return spool
+
+    def close(self):
+        super().close()
+        for spool in self.__dict__.get('_ingest_spools', []):
+            spool.discard()
+
+def copy_stream(source, destination, digest=None):
+    """
+    Copy a binary stream into an open file in fixed-size chunks.
+
+    Returns:
+        int: Number of bytes copied
+    """
+    total = 0
+    for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+        if digest is not None:
+            digest.update(chunk)
+        destination.write(chunk)
+        total += len(chunk)
+    return total
+
+def ingest_upload(file_storage, dest_path):
+    """
+    Move an uploaded file to dest_path and return its SHA-256 hex digest.
+
+    Uploads parsed by IngestRequest are already on disk and hashed, so this is
+    a rename. Other streams (e.g. in tests or with a different request class)
+    are copied in chunks and hashed on the way.
+    """
+    stream = file_storage.stream
+    if isinstance(stream, HashingSpoolFile):
+        stream.flush()
+        stream.close()
+        os.replace(stream.path, dest_path)
+        stream.consumed = True
+        return stream.hexdigest()
+
+    digest = hashlib.sha256()
+    with open(dest_path, 'wb') as f:
+        copy_stream(stream, f, digest)
+    return digest.hexdigest()
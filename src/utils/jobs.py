@@ -0,0 +1,337 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from src.config.config import JOBS_FOLDER, JOB_WORKERS, JOB_MAX_PENDING, JOB_TTL, JOB_BUSY_TIMEOUT, JOB_ASYNC_THRESHOLD
+from src.utils.governor import ServerBusy, wait_out_busy
+from src.utils.metrics import JOBS
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+JOB_MODES = ('sync', 'async', 'auto')
+ACTIVE_STATUSES = ('queued', 'running')
+# Lock files of the server processes running jobs, named after their owner token
+OWNERS_DIR = '.owners'
+
+class JobQueueFull(ServerBusy):
+    """Raised when too many jobs are waiting for a worker"""
+
+def wants_async(mode, content_length):
+    """
+    Decide whether a request should run as a background job.
+
+    Args:
+        mode (str): Requested mode (sync, async or auto). Defaults to sync.
+        content_length (int): Size of the request body, if known
+
+    Returns:
+        bool: True if the conversion should be submitted as a job
+    """
+    mode = (mode or 'sync').strip().lower()
+    if mode == 'async':
+        return True
+    if mode == 'auto':
+        return (content_length or 0) > JOB_ASYNC_THRESHOLD
+    return False
+
+class JobManager:
+    """
+    Runs conversions on a bounded pool of worker threads.
+
+    Conversions spend their time waiting on pandoc/ImageMagick subprocesses, so
+    threads are enough to keep several of them running at once. Job state is
+    written to `<folder>/<job_id>.json` so that any server worker can answer
+    status requests, not just the one running the job.
+
+    Jobs live in the memory of the process that accepted them and are lost
+    when it exits (a recycled or crashed worker). Each process holds an
+    flock() on `<folder>/.owners/<token>.lock` and stamps its token on its
+    jobs; a queued or running job whose owner's lock is free again belongs
+    to a process that is gone, and is marked failed when it is looked up.
+    """
+
+    def __init__(self, folder, max_workers, max_pending):
+        self.folder = folder
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._pid = None
+        self._pending = 0
+        self._last_prune = 0
+        self._owner = None
+        self._owner_fd = None
+        self._draining = False
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Executors do not survive fork(), so create one per server process
+        with self._lock:
+            started = self._executor is None or self._pid != os.getpid()
+            if started:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='conversion-job')
+                self._pid = os.getpid()
+                self._pending = 0
+                self._claim_ownership()
+            executor = self._executor
+        if started:
+            self.recover()
+        return executor
+
+    def _owner_path(self, owner):
+        return os.path.join(self.folder, OWNERS_DIR, f'{owner}.lock')
+
+    def _claim_ownership(self):
+        """Hold the lock that tells other processes this one is alive (see class docstring)"""
+        self._owner = uuid.uuid4().hex
+        self._owner_fd = None
+        if fcntl is None:
+            return
+        try:
+            os.makedirs(os.path.join(self.folder, OWNERS_DIR), exist_ok=True)
+            fd = os.open(self._owner_path(self._owner), os.O_CREAT | os.O_RDWR, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            self._owner_fd = fd
+        except OSError as e:
+            print(f"Could not create job owner lock in {self.folder}: {str(e)}")
+
+    def _owner_alive(self, owner):
+        """Whether the server process with this owner token is still running"""
+        if owner is not None and owner == self._owner:
+            return True
+        if fcntl is None:
+            # No way to tell without flock(); keep the job as it is
+            return True
+        try:
+            fd = os.open(self._owner_path(owner or 'none'), os.O_RDWR)
+        except FileNotFoundError:
+            return False
+        except OSError:
+            return True
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            return False
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+
+    def _path(self, job_id):
+        return os.path.join(self.folder, f'{job_id}.json')
+
+    def _save(self, job):
+        os.makedirs(self.folder, exist_ok=True)
+        tmp_path = self._path(job['id']) + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, self._path(job['id']))
+
+    def submit(self, kind, func, *args, cleanup=None, **kwargs):
+        """
+        Queue a conversion and return its job record immediately.
+
+        Args:
+            kind (str): Conversion kind (file, text, base64, image)
+            func (callable): Conversion function returning a result dict
+            cleanup (list, optional): Paths to delete once the job has finished
+
+        Returns:
+            dict: The queued job
+        """
+        executor = self._get_executor()
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise JobQueueFull(f'Too many pending jobs ({self._pending}), try again later', retry_after=5)
+            self._pending += 1
+
+        job = {
+            'id': uuid.uuid4().hex,
+            'kind': kind,
+            'owner': self._owner,
+            'status': 'queued',
+            'progress': 0,
+            'created': time.time(),
+            'started': None,
+            'finished': None,
+            'result': None,
+            'error': None
+        }
+        snapshot = dict(job)
+        JOBS.labels('queued').inc()
+        try:
+            self._save(job)
+            executor.submit(self._run, job, func, args, kwargs, cleanup or [])
+        except Exception:
+            JOBS.labels('queued').dec()
+            with self._lock:
+                self._pending -= 1
+            raise
+        self.prune()
+        return snapshot
+
+    def _run(self, job, func, args, kwargs, cleanup):
+        JOBS.labels('queued').dec()
+        JOBS.labels('running').inc()
+        try:
+            job.update(status='running', progress=10, started=time.time())
+            self._save(job)
+
+            result = self._call(func, args, kwargs)
+            if result.get('error'):
+                job.update(status='failed', error=result['error'])
+            else:
+                job.update(status='done')
+            job.update(progress=100, finished=time.time(), result=result)
+            self._save(job)
+        except Exception as e:
+            print(f"Job {job['id']} could not be recorded: {str(e)}")
+        finally:
+            JOBS.labels('running').dec()
+            with self._lock:
+                self._pending -= 1
+            for path in cleanup:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _call(self, func, args, kwargs):
+        """Run a job's conversion; a busy server is waited out, as there is no client to send a 503 to"""
+        try:
+            return wait_out_busy(lambda: func(*args, **kwargs), JOB_BUSY_TIMEOUT, lambda: self._draining)
+        except ServerBusy as e:
+            return {'error': f'{str(e)}; gave up after {JOB_BUSY_TIMEOUT} seconds'}
+        except Exception as e:
+            return {'error': str(e)}
+
+    def get(self, job_id):
+        """Return a job record, or None if it does not exist"""
+        if not job_id or not all(c in '0123456789abcdef' for c in job_id):
+            return None
+        try:
+            with open(self._path(job_id), 'r', encoding='utf-8') as f:
+                job = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if job['status'] in ACTIVE_STATUSES and not self._owner_alive(job.get('owner')):
+            job.update(status='failed', progress=100, finished=time.time(),
+                       error='The server process running this job stopped before it finished; submit it again')
+            try:
+                self._save(job)
+            except OSError as e:
+                print(f"Job {job['id']} could not be recorded: {str(e)}")
+        return job
+
+    def recover(self):
+        """
+        Mark the queued and running jobs of server processes that are gone as failed.
+
+        Called when a process starts running jobs; get() does the same for
+        single jobs. The jobs cannot be requeued: their input and conversion
+        only existed in the memory of the process that died.
+
+        Returns:
+            int: Number of jobs marked failed
+        """
+        try:
+            scanned = list(os.scandir(self.folder))
+        except OSError:
+            return 0
+        failed = 0
+        for item in scanned:
+            if not item.name.endswith('.json'):
+                continue
+            try:
+                with open(item.path, 'r', encoding='utf-8') as f:
+                    status = json.load(f).get('status')
+            except (OSError, ValueError):
+                continue
+            if status in ACTIVE_STATUSES:
+                job = self.get(item.name[:-len('.json')])
+                if job is not None and job['status'] == 'failed':
+                    failed += 1
+        if failed:
+            print(f"Marked {failed} job(s) of stopped server processes as failed")
+        return failed
+
+    def prune(self):
+        """Delete records of jobs that finished more than JOB_TTL seconds ago"""
+        now = time.time()
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+
+        try:
+            scanned = list(os.scandir(self.folder))
+        except OSError:
+            return
+        for item in scanned:
+            try:
+                if item.name.endswith('.json') and now - item.stat().st_mtime > JOB_TTL:
+                    os.remove(item.path)
+            except OSError:
+                pass
+
+        # Owner locks of processes that are gone, once their jobs have expired too
+        try:
+            owners = list(os.scandir(os.path.join(self.folder, OWNERS_DIR)))
+        except OSError:
+            return
+        for item in owners:
+            try:
+                if now - item.stat().st_mtime > JOB_TTL and not self._owner_alive(item.name[:-len('.lock')]):
+                    os.remove(item.path)
+            except OSError:
+                pass
+
+    def drain(self, timeout):
+        """
+        Stop taking jobs and wait for the ones this process accepted to finish.
+
+        Called when a server worker exits. Jobs still unfinished after
+        `timeout` seconds are lost with the process and reported as failed
+        (see recover()); jobs waiting for a busy tool give up right away.
+
+        Returns:
+            bool: True if every job finished in time
+        """
+        with self._lock:
+            executor = self._executor if self._pid == os.getpid() else None
+            self._draining = True
+        if executor is None:
+            return True
+        # Queued jobs still run; only new submissions are refused
+        executor.shutdown(wait=False)
+        deadline = time.monotonic() + timeout
+        while self.stats()['pending'] and time.monotonic() < deadline:
+            time.sleep(0.5)
+        return not self.stats()['pending']
+
+    def stats(self):
+        """Return worker pool size and number of jobs waiting or running"""
+        with self._lock:
+            return {'workers': self.max_workers, 'pending': self._pending, 'max_pending': self.max_pending}
+
+def job_summary(job):
+    """Public view of a job record for status responses"""
+    summary = {
+        'jobId': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'progress': job['progress'],
+        'created': job['created'],
+        'started': job['started'],
+        'finished': job['finished'],
+        'statusUrl': f"/api/jobs/{job['id']}",
+        'resultUrl': f"/api/jobs/{job['id']}/result"
+    }
+    result = job.get('result') or {}
+    if result.get('downloadUrl'):
+        summary['downloadUrl'] = result['downloadUrl']
+    if job.get('error'):
+        summary['error'] = job['error']
+    return summary
+
+job_manager = JobManager(JOBS_FOLDER, JOB_WORKERS, JOB_MAX_PENDING)
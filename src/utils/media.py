@@ -0,0 +1,132 @@
+import base64
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.config.config import UPLOAD_FOLDER, MEDIA_WORKERS
+from src.utils.capabilities import capabilities
+from src.utils.cache import media_cache, make_cache_key, hash_file
+from src.utils.governor import run_tool, ServerBusy
+
+# ImageMagick arguments used to rasterize each kind of extracted media to PNG.
+# WMF/EMF are vector formats (mostly equations); keep a transparent background.
+VECTOR_MEDIA_EXTENSIONS = {'.wmf', '.emf'}
+VECTOR_RENDER_ARGS = ['-density', '300']
+VECTOR_OUTPUT_ARGS = ['-background', 'none', '-alpha', 'on']
+
+class MediaProcessor:
+    """
+    Converts media extracted from a document to embeddable PNG data URIs.
+
+    Files are hashed first so that identical images (the same equation used
+    many times) are converted and encoded once per document. The remaining
+    unique files are converted on a bounded thread pool shared by all requests
+    of the server process; each ImageMagick call still goes through the
+    admission limiter. Rendered PNGs are kept in `media_cache` by content hash,
+    so a WMF/EMF image seen in an earlier document is not rendered again.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max(1, max_workers)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Executors do not survive fork(), so create one per server process
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='media')
+                self._pid = os.getpid()
+            return self._executor
+
+    def embed(self, paths):
+        """
+        Convert media files to PNG and encode them for embedding.
+
+        Args:
+            paths (list): Filesystem paths of extracted media, duplicates allowed
+
+        Returns:
+            dict: Maps each convertible path to a PNG data URI, or to a path
+            relative to UPLOAD_FOLDER if the PNG could not be encoded. Paths
+            that could not be converted are left out.
+        """
+        unique_paths = [path for path in dict.fromkeys(paths) if os.path.exists(path)]
+        if not unique_paths:
+            return {}
+
+        executor = self._get_executor()
+        digests = dict(zip(unique_paths, executor.map(_safe_hash, unique_paths)))
+
+        # One representative file per distinct content
+        representatives = {}
+        for path, digest in digests.items():
+            if digest is not None:
+                representatives.setdefault(digest, path)
+
+        futures = {digest: executor.submit(_render, path, digest) for digest, path in representatives.items()}
+        rendered = {}
+        for digest, future in futures.items():
+            # Re-raises ServerBusy from a worker so the request is rejected as a whole
+            rendered[digest] = future.result()
+
+        return {
+            path: rendered[digest]
+            for path, digest in digests.items()
+            if digest is not None and rendered.get(digest)
+        }
+
+def _safe_hash(path):
+    try:
+        return hash_file(path)
+    except OSError:
+        return None
+
+def _png_data_uri(data):
+    return f"data:image/png;base64,{base64.b64encode(data).decode('utf-8')}"
+
+def _relative_src(path):
+    rel = os.path.relpath(path, UPLOAD_FOLDER)
+    return rel.replace('\\', '/').lstrip('\\/')
+
+def _render(image_path, digest):
+    """Convert one media file to PNG and return its data URI (see MediaProcessor.embed)"""
+    ext = os.path.splitext(image_path)[1].lower()
+    try:
+        if ext == '.png':
+            with open(image_path, 'rb') as f:
+                return _png_data_uri(f.read())
+
+        if ext in VECTOR_MEDIA_EXTENSIONS:
+            render_args, output_args = VECTOR_RENDER_ARGS, VECTOR_OUTPUT_ARGS
+        else:
+            render_args, output_args = [], []
+        key = make_cache_key('media', digest, ext.lstrip('.'), 'png', ' '.join(render_args + output_args))
+
+        cached = media_cache.get(key)
+        if cached and cached[1]:
+            try:
+                with open(cached[1], 'rb') as f:
+                    return _png_data_uri(f.read())
+            except OSError:
+                pass  # evicted meanwhile, render again
+
+        if not capabilities.imagemagick_reads(image_path):
+            return None
+        target_path = os.path.splitext(image_path)[0] + '.png'
+        run_tool(['convert'] + render_args + [image_path] + output_args + [target_path], check=True)
+        if not os.path.exists(target_path) or os.path.getsize(target_path) == 0:
+            return None
+        media_cache.put(key, {'source': ext.lstrip('.')}, target_path)
+
+        try:
+            with open(target_path, 'rb') as f:
+                return _png_data_uri(f.read())
+        except OSError:
+            return _relative_src(target_path)
+    except ServerBusy:
+        raise
+    except Exception:
+        return None
+
+media_processor = MediaProcessor(MEDIA_WORKERS)
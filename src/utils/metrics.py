@@ -0,0 +1,147 @@
+"""
+Prometheus metrics for the converter.
+
+Metrics are defined here and updated by the modules doing the work; the
+/metrics route (src/routes/metrics_routes.py) renders them. Under gunicorn
+every worker is a separate process, so when PROMETHEUS_MULTIPROC_DIR is set
+(gunicorn.conf.py does this) each process writes its values to files in that
+directory and /metrics aggregates all of them, whichever worker answers.
+
+prometheus_client is optional: without it every metric is a no-op and
+/metrics reports that it is unavailable.
+"""
+import os
+from src.config.config import (
+    METRICS_ENABLED, PANDOC_INPUT_FORMATS, PANDOC_OUTPUT_FORMATS, ALLOWED_IMAGE_EXTENSIONS
+)
+
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+    )
+    METRICS_AVAILABLE = METRICS_ENABLED
+except ImportError:
+    METRICS_AVAILABLE = False
+    CONTENT_TYPE_LATEST = 'text/plain; version=0.0.4; charset=utf-8'
+    # The metric definitions below name these; _metric() never calls them when unavailable
+    Counter = Gauge = Histogram = None
+
+MULTIPROCESS_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir')
+
+# Request latencies range from cached text conversions (milliseconds) to large DOCX/PDF jobs (minutes)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+WAIT_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30)
+
+# Format labels are limited to known formats so clients cannot create unbounded series
+KNOWN_FORMATS = (set(PANDOC_INPUT_FORMATS) | set(PANDOC_OUTPUT_FORMATS) | ALLOWED_IMAGE_EXTENSIONS
+                 | {'webp', 'svg', 'wmf', 'emf', 'ico', 'pdf', 'md', 'txt', 'tex'})
+
+class _NullMetric:
+    """Stands in for a metric when prometheus_client is not installed"""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+def _metric(kind, name, documentation, labels=(), **kwargs):
+    if not METRICS_AVAILABLE:
+        return _NullMetric()
+    if kind is Gauge:
+        # Sum the live processes' values; a dead worker's in-flight count must not linger
+        kwargs.setdefault('multiprocess_mode', 'livesum')
+    return kind(name, documentation, labels, **kwargs)
+
+REQUEST_SECONDS = _metric(
+    Histogram, 'docconv_http_request_duration_seconds',
+    'Time to produce a response (streamed bodies: time to the first byte)',
+    ('route', 'method', 'status', 'from_format', 'to_format'), buckets=LATENCY_BUCKETS)
+REQUEST_BYTES = _metric(Counter, 'docconv_http_request_bytes', 'Request body bytes received', ('route',))
+RESPONSE_BYTES = _metric(Counter, 'docconv_http_response_bytes', 'Response body bytes sent', ('route',))
+REQUESTS_IN_FLIGHT = _metric(Gauge, 'docconv_http_requests_in_flight', 'Requests being handled')
+
+TOOL_SECONDS = _metric(
+    Histogram, 'docconv_tool_duration_seconds', 'Wall time of external tool runs',
+    ('tool',), buckets=LATENCY_BUCKETS)
+TOOL_CPU_SECONDS = _metric(
+    Counter, 'docconv_tool_cpu_seconds', 'CPU time used by external tool processes', ('tool', 'mode'))
+TOOL_RUNS = _metric(Counter, 'docconv_tool_runs', 'External tool runs by outcome', ('tool', 'outcome'))
+TOOL_ACTIVE = _metric(Gauge, 'docconv_tool_active', 'Tool processes holding a limiter slot', ('group',))
+TOOL_QUEUED = _metric(Gauge, 'docconv_tool_queued', 'Conversions waiting for a limiter slot', ('group',))
+TOOL_WAIT_SECONDS = _metric(
+    Histogram, 'docconv_tool_wait_seconds', 'Time spent waiting for a limiter slot',
+    ('group',), buckets=WAIT_BUCKETS)
+TOOL_REJECTED = _metric(Counter, 'docconv_tool_rejected', 'Conversions rejected with 503 by a limiter', ('group',))
+
+STAGE_SECONDS = _metric(
+    Histogram, 'docconv_stage_duration_seconds', 'Time spent in each conversion stage (see Server-Timing)',
+    ('stage',), buckets=LATENCY_BUCKETS)
+
+JOBS = _metric(Gauge, 'docconv_jobs', 'Asynchronous jobs by state', ('state',))
+
+CACHE_EVENTS = _metric(
+    Counter, 'docconv_cache_events', 'Cache lookups (hit, miss) and evictions', ('cache', 'event'))
+
+COALESCED = _metric(
+    Counter, 'docconv_coalesced', 'Conversions that shared the result of an identical one in flight',
+    ('kind', 'scope'))
+
+STRATEGY_RUNS = _metric(
+    Counter, 'docconv_conversion_strategy', 'Attempts of each conversion strategy and fallback by outcome',
+    ('conversion', 'strategy', 'outcome'))
+
+def format_label(value):
+    """Normalize a client-supplied format for use as a label value"""
+    value = (value or '').strip().lower()
+    if not value:
+        return 'none'
+    return value if value in KNOWN_FORMATS else 'other'
+
+def observe_tool(tool, seconds, rusage=None, outcome='ok'):
+    """
+    Record one run of an external tool.
+
+    Args:
+        tool (str): Executable name (pandoc, convert, rsvg-convert, ...)
+        seconds (float): Wall time of the run
+        rusage: resource usage of the child as returned by os.wait4(), if known
+        outcome (str): ok, error or missing
+    """
+    TOOL_SECONDS.labels(tool).observe(seconds)
+    TOOL_RUNS.labels(tool, outcome).inc()
+    if rusage is not None:
+        TOOL_CPU_SECONDS.labels(tool, 'user').inc(rusage.ru_utime)
+        TOOL_CPU_SECONDS.labels(tool, 'system').inc(rusage.ru_stime)
+
+def record_strategy(conversion, strategy, succeeded):
+    """Count one attempt of a conversion strategy, e.g. ('wmf', 'wmf2svg', False)"""
+    STRATEGY_RUNS.labels(conversion, strategy, 'success' if succeeded else 'failure').inc()
+
+def render():
+    """
+    Render every metric in the Prometheus text format.
+
+    Returns:
+        tuple: (body bytes, content type)
+    """
+    if MULTIPROCESS_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+def mark_process_dead(pid):
+    """Drop the live gauges of a worker that exited (called from gunicorn's child_exit hook)"""
+    if METRICS_AVAILABLE and MULTIPROCESS_DIR:
+        multiprocess.mark_process_dead(pid)
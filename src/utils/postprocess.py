@@ -0,0 +1,101 @@
+import html
+import re
+
+# MathJax v3 with the SVG renderer: crisp formulas on a transparent background
+MATHJAX_CONFIG = (
+    "window.MathJax = {\n"
+    "  tex: { inlineMath: [['$','$'], ['\\\\(','\\\\)']], displayMath: [['$$','$$'], ['\\\\[','\\\\]']] },\n"
+    "  svg: { scale: 1.15, minScale: 1, fontCache: 'global' },\n"
+    "  options: { skipHtmlTags: ['script','noscript','style','textarea','pre','code'] }\n"
+    "};"
+)
+MATHJAX_SRC = 'https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-svg.js'
+MATHJAX_STYLE = (
+    'mjx-container { background: transparent !important; font-size: 110%; }\n'
+    'mjx-container, math { -webkit-font-smoothing: antialiased; -moz-osx-font-smoothing: grayscale; }\n'
+    'mjx-container[jax="SVG"] { direction: ltr; }'
+)
+MATHJAX_HEAD = (
+    f'<script>{MATHJAX_CONFIG}</script>'
+    f'<script src="{MATHJAX_SRC}"></script>'
+    f'<style>{MATHJAX_STYLE}</style>'
+)
+
+# Everything the post-processor rewrites, matched in document order by a single scan
+TOKEN_PATTERN = re.compile(
+    r'(?P<img><img\b[^>]*>)'
+    r'|(?P<script><script\b[^>]*\bsrc\s*=\s*["\']?[^"\'>]*mathjax[^>]*>\s*</script\s*>)'
+    r'|(?P<head_end></head\s*>)'
+    r'|(?P<html_start><html\b[^>]*>)',
+    re.IGNORECASE
+)
+SRC_PATTERN = re.compile(r'(\bsrc\s*=\s*)(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'>]+))', re.IGNORECASE)
+
+def image_sources(content):
+    """Return the src of every <img> in an HTML document, in order, with entities decoded"""
+    sources = []
+    for match in re.finditer(r'<img\b[^>]*>', content, re.IGNORECASE):
+        src = SRC_PATTERN.search(match.group(0))
+        if src:
+            sources.append(html.unescape(_attr_value(src)))
+    return sources
+
+def _attr_value(match):
+    return next(value for value in match.group(2, 3, 4) if value is not None)
+
+def rewrite_html(content, image_srcs=None, mathjax=True):
+    """
+    Rewrite pandoc HTML output in one pass.
+
+    Replaces <img> sources found in `image_srcs` and, when the document has a
+    <head> (or an <html> element to put one in), swaps any MathJax script for
+    the SVG renderer configuration. Everything else is copied through
+    untouched, so the document is not re-serialized.
+
+    Args:
+        content (str): HTML document or fragment
+        image_srcs (dict): Maps original src values to their replacements
+        mathjax (bool): Whether to inject the MathJax configuration
+
+    Returns:
+        str: The rewritten document
+    """
+    image_srcs = image_srcs or {}
+    lowered = content.lower()
+    has_head = '</head' in lowered
+    # A head is only synthesized for documents with an <html> element but no <head>
+    state = {'in_head': has_head and '<head' in lowered, 'injected': not mathjax}
+
+    def replace(match):
+        kind = match.lastgroup
+        text = match.group(0)
+        if kind == 'img':
+            return SRC_PATTERN.sub(lambda src: _replace_src(src, image_srcs), text, count=1)
+        if kind == 'script':
+            # Drop existing MathJax includes in the head to avoid duplicates or the CHTML renderer
+            return '' if state['in_head'] and not state['injected'] else text
+        if kind == 'head_end':
+            state['in_head'] = False
+            if not state['injected']:
+                state['injected'] = True
+                return MATHJAX_HEAD + text
+            return text
+        if not has_head and not state['injected']:
+            state['injected'] = True
+            return f'{text}<head>{MATHJAX_HEAD}</head>'
+        return text
+
+    pieces = []
+    position = 0
+    for match in TOKEN_PATTERN.finditer(content):
+        pieces.append(content[position:match.start()])
+        pieces.append(replace(match))
+        position = match.end()
+    pieces.append(content[position:])
+    return ''.join(pieces)
+
+def _replace_src(match, image_srcs):
+    original = html.unescape(_attr_value(match))
+    if original not in image_srcs:
+        return match.group(0)
+    return f'{match.group(1)}"{html.escape(image_srcs[original], quote=True)}"'
@@ -0,0 +1,91 @@
+import mimetypes
+import os
+from flask import jsonify, send_file
+from werkzeug.utils import safe_join
+from src.config.config import UPLOAD_FOLDER
+from src.utils.timing import stage
+
+RESPONSE_MODES = ('json', 'url', 'raw')
+
+# pandoc writer names that mimetypes cannot guess from an extension
+FORMAT_MIMETYPES = {
+    'markdown': 'text/markdown',
+    'commonmark': 'text/markdown',
+    'gfm': 'text/markdown',
+    'markdown_mmd': 'text/markdown',
+    'markdown_phpextra': 'text/markdown',
+    'markdown_strict': 'text/markdown',
+    'md': 'text/markdown',
+    'html4': 'text/html',
+    'html5': 'text/html',
+    'rst': 'text/x-rst',
+    'latex': 'application/x-latex',
+    'plain': 'text/plain',
+    'asciidoc': 'text/plain',
+    'org': 'text/plain',
+    'textile': 'text/plain',
+    'mediawiki': 'text/plain',
+    'zimwiki': 'text/plain',
+    'docbook': 'application/docbook+xml',
+    'docbook4': 'application/docbook+xml',
+    'docbook5': 'application/docbook+xml',
+    'jats': 'application/xml',
+    'opml': 'text/x-opml',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    'odt': 'application/vnd.oasis.opendocument.text',
+    'opendocument': 'application/xml',
+    'epub2': 'application/epub+zip',
+    'epub3': 'application/epub+zip',
+    'webp': 'image/webp',
+}
+
+def response_mode(request, data=None):
+    """Read the requested response mode (json, url or raw) from a form, query string or JSON body"""
+    mode = request.values.get('response')
+    if mode is None and data is not None:
+        mode = data.get('response')
+    return (mode or 'json').strip().lower()
+
+def mimetype_for(to_format):
+    """Content-Type for an output format name"""
+    to_format = (to_format or '').lower()
+    if to_format in FORMAT_MIMETYPES:
+        return FORMAT_MIMETYPES[to_format]
+    return mimetypes.guess_type(f'file.{to_format}')[0] or 'application/octet-stream'
+
+def output_path_for(download_url):
+    """Resolve a /download/<name> URL back to the file it serves"""
+    filename = download_url.split('/download/', 1)[-1]
+    return safe_join(UPLOAD_FOLDER, filename)
+
+def conversion_response(result, mode, to_format=None):
+    """
+    Render a conversion result in the requested mode.
+
+    json returns the result unchanged; url returns only the status and the
+    download URL; raw streams the output file with its Content-Type. Errors in
+    url and raw mode are returned as JSON with status 422, since those clients
+    do not expect a JSON body on success.
+    """
+    if mode == 'json':
+        with stage('serialize'):
+            return jsonify(result)
+
+    if not result.get('success'):
+        return jsonify(result), 422
+
+    if mode == 'url':
+        return jsonify({key: result[key] for key in ('success', 'downloadUrl', 'message', 'cached', 'historyId') if key in result})
+
+    path = output_path_for(result.get('downloadUrl', ''))
+    if not path or not os.path.exists(path):
+        return jsonify({'error': 'Converted file is no longer available'}), 410
+    if not to_format:
+        to_format = os.path.splitext(path)[1].lstrip('.')
+    response = send_file(path, mimetype=mimetype_for(to_format), download_name=os.path.basename(path))
+    if result.get('cached'):
+        response.headers['X-Conversion-Cache'] = 'hit'
+    if result.get('historyId'):
+        response.headers['X-History-Id'] = result['historyId']
+    return response
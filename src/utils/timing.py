@@ -0,0 +1,101 @@
+import io
+import os
+import re
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from flask import g, has_app_context
+from src.config.config import PROFILE_FOLDER, PROFILE_SLOW_REQUESTS
+from src.utils.metrics import STAGE_SECONDS
+
+def record_stage(name, seconds):
+    """
+    Add time spent in a named stage of the current request.
+
+    Stages repeated within a request (e.g. several pandoc runs) are summed.
+    Outside a request (jobs, batch workers) only the metrics are updated.
+    """
+    STAGE_SECONDS.labels(name).observe(seconds)
+    if not has_app_context():
+        return
+    timings = g.setdefault('stage_timings', {})
+    total, count = timings.get(name, (0.0, 0))
+    timings[name] = (total + seconds, count + 1)
+
+@contextmanager
+def stage(name):
+    """Time the with-block as stage `name` of the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+def server_timing(timings, total=None):
+    """
+    Format stage timings as a Server-Timing header value.
+
+    Args:
+        timings (dict): Stage name -> (seconds, count)
+        total (float, optional): Time of the whole request in seconds
+
+    Returns:
+        str: e.g. 'upload;dur=3.1, pandoc;dur=120.4;desc="2 runs", total;dur=130.9'
+    """
+    entries = []
+    for name, (seconds, count) in timings.items():
+        entry = f'{name};dur={seconds * 1000:.1f}'
+        if count > 1:
+            entry += f';desc="{count} runs"'
+        entries.append(entry)
+    if total is not None:
+        entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+class RequestProfiler:
+    """
+    cProfile of one request, kept only if the request turns out to be slow.
+
+    Enabled by PROFILE_SLOW_REQUESTS (a threshold in seconds, 0 disables).
+    Profiles of slower requests are written to PROFILE_FOLDER as a .prof file
+    (for pstats, snakeviz, ...) plus a .txt summary of the top functions by
+    cumulative time. cProfile only sees the thread that handles the request,
+    so time in tool subprocesses and worker pools shows up as waiting.
+    """
+
+    def __init__(self):
+        import cProfile  # only when profiling is enabled
+        self._profile = cProfile.Profile()
+        self.active = False
+
+    def start(self):
+        try:
+            self._profile.enable()
+            self.active = True
+        except ValueError:
+            # Only one profiler can be active at a time on Python 3.12+; skip this request
+            self.active = False
+        return self.active
+
+    def stop(self):
+        if self.active:
+            self._profile.disable()
+            self.active = False
+
+    def dump(self, label, seconds):
+        """Write the profile to PROFILE_FOLDER and return the path of the .prof file"""
+        os.makedirs(PROFILE_FOLDER, exist_ok=True)
+        name = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{re.sub(r'[^A-Za-z0-9]+', '_', label).strip('_')}"
+        path = os.path.join(PROFILE_FOLDER, f'{name}.prof')
+        self._profile.dump_stats(path)
+
+        import pstats
+        summary = io.StringIO()
+        summary.write(f'{label}: {seconds:.3f}s\n\n')
+        pstats.Stats(self._profile, stream=summary).sort_stats('cumulative').print_stats(40)
+        with open(os.path.join(PROFILE_FOLDER, f'{name}.txt'), 'w', encoding='utf-8') as f:
+            f.write(summary.getvalue())
+        return path
+
+def profiling_enabled():
+    return PROFILE_SLOW_REQUESTS > 0
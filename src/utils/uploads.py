@@ -0,0 +1,364 @@
+"""
+Chunked, resumable uploads.
+
+A client with a document too large to send comfortably in one request
+creates an upload session with the file's name and size, sends the bytes in
+chunks with PATCH requests that say at which offset each chunk starts, and
+then has the assembled file converted like a regular upload. Modelled on the
+tus protocol (https://tus.io): an interrupted transfer resumes by asking the
+server which byte ranges it already has.
+
+Each session is a directory in UPLOAD_SESSION_FOLDER holding meta.json, the
+file itself, created at its full (sparse) size up front, and an empty marker
+file per received chunk named after its byte range. Chunks are streamed from
+the request body straight to their offset, so memory use does not depend on
+chunk or file size, chunks may arrive in any order and in parallel, and any
+server process can take any chunk. A chunk cut off midway leaves no marker
+and is simply sent again.
+
+Chunks hold a shared flock() on meta.json while they write and finishing
+takes it exclusively, so once a session is locked for conversion no chunk
+can still be writing into the file that is linked into the workspace.
+Without fcntl (Windows) the file is copied into the workspace instead.
+"""
+import base64
+import binascii
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from werkzeug.utils import secure_filename
+from src.config.config import UPLOAD_SESSION_FOLDER, UPLOAD_SESSION_MAX_BYTES, MAX_CONTENT_LENGTH
+from src.utils.ingest import CHUNK_SIZE
+from src.utils.workspace import create_workspace, janitor
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+DATA_NAME = 'data.part'
+META_NAME = 'meta.json'
+RANGES_NAME = 'ranges'
+LOCK_NAME = 'converting'
+
+SESSION_ID = re.compile(r'^[0-9a-f]{32}$')
+SHA256_HEX = re.compile(r'^[0-9a-fA-F]{64}$')
+
+class UploadError(Exception):
+    """Raised when an upload request cannot be honoured; carries the HTTP status to answer with"""
+
+    def __init__(self, message, status=400, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+def parse_checksum(value):
+    """
+    Read a whole-file checksum given at creation.
+
+    Accepts a SHA-256 hex digest, optionally prefixed with 'sha256:'.
+
+    Returns:
+        str: Lower-case hex digest, or None if no checksum was given
+    """
+    if not value:
+        return None
+    value = str(value).strip()
+    if value.lower().startswith('sha256:'):
+        value = value[len('sha256:'):]
+    if not SHA256_HEX.match(value):
+        raise UploadError('Checksum must be a SHA-256 hex digest')
+    return value.lower()
+
+def parse_chunk_checksum(header):
+    """
+    Read a tus-style Upload-Checksum header: '<algorithm> <base64 digest>'.
+
+    Returns:
+        tuple: (hashlib object, expected digest bytes), or (None, None) without a header
+    """
+    if not header:
+        return None, None
+    try:
+        algorithm, encoded = header.split(None, 1)
+        expected = base64.b64decode(encoded.strip(), validate=True)
+    except (ValueError, binascii.Error):
+        raise UploadError('Upload-Checksum must be "<algorithm> <base64 digest>"')
+    if algorithm.lower() not in hashlib.algorithms_guaranteed:
+        raise UploadError(f'Unsupported checksum algorithm: {algorithm}')
+    return hashlib.new(algorithm.lower()), expected
+
+def _merge(ranges):
+    """Merge (start, end) ranges into sorted, non-overlapping ones"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+class UploadManager:
+    """Upload sessions on disk (see module docstring)"""
+
+    def __init__(self, folder=UPLOAD_SESSION_FOLDER, max_bytes=UPLOAD_SESSION_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+
+    def _path(self, upload_id, *parts):
+        if not SESSION_ID.match(upload_id or ''):
+            raise UploadError('Upload not found', 404)
+        return os.path.join(self.folder, upload_id, *parts)
+
+    def _meta(self, upload_id):
+        try:
+            with open(self._path(upload_id, META_NAME), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            raise UploadError('Upload not found', 404)
+
+    def _lock(self, upload_id, exclusive=False):
+        """
+        flock() a session's meta.json: shared for chunks, exclusive (and without waiting) to finish.
+
+        Returns:
+            The descriptor to pass to _unlock(), or None without fcntl
+
+        Raises:
+            BlockingIOError: If an exclusive lock is asked for while chunks hold it
+        """
+        if fcntl is None:
+            return None
+        operation = fcntl.LOCK_EX | fcntl.LOCK_NB if exclusive else fcntl.LOCK_SH
+        try:
+            fd = os.open(self._path(upload_id, META_NAME), os.O_RDONLY)
+        except OSError:
+            raise UploadError('Upload not found', 404)
+        try:
+            fcntl.flock(fd, operation)
+        except BaseException:
+            os.close(fd)
+            raise
+        return fd
+
+    def _unlock(self, fd):
+        if fd is not None:
+            os.close(fd)
+
+    def create(self, filename, size, checksum=None):
+        """
+        Start an upload session.
+
+        Args:
+            filename (str): Name of the file being uploaded
+            size (int): Its exact size in bytes
+            checksum (str): Optional SHA-256 of the whole file, checked when the upload is finished
+
+        Returns:
+            dict: The session's state (see state())
+        """
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            raise UploadError('Size must be the file size in bytes')
+        if size <= 0:
+            raise UploadError('Size must be the file size in bytes')
+        if self.max_bytes and size > self.max_bytes:
+            raise UploadError(f'File too large for a resumable upload (at most {self.max_bytes} bytes)', 413)
+        if not secure_filename(filename or ''):
+            raise UploadError('A file name is required')
+        checksum = parse_checksum(checksum)
+
+        os.makedirs(self.folder, exist_ok=True)
+        if shutil.disk_usage(self.folder).free < size:
+            raise UploadError('Not enough disk space for this upload', 507)
+
+        # Sessions sit in UPLOAD_FOLDER, whose janitor removes the abandoned ones
+        janitor.ensure_started()
+        upload_id = uuid.uuid4().hex
+        path = self._path(upload_id)
+        os.makedirs(os.path.join(path, RANGES_NAME))
+        with open(os.path.join(path, DATA_NAME), 'wb') as f:
+            f.truncate(size)
+        meta = {'filename': filename, 'size': size, 'checksum': checksum, 'created': time.time()}
+        # meta.json last: a session without it is incomplete and treated as missing
+        with open(os.path.join(path, META_NAME), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        return self.state(upload_id)
+
+    def write_chunk(self, upload_id, offset, length, stream, checksum_header=None):
+        """
+        Write one chunk of the request body at its offset.
+
+        Args:
+            offset (int): Byte offset of the chunk in the file
+            length (int): Chunk size (the request's Content-Length)
+            stream: Request body stream
+            checksum_header (str): Optional Upload-Checksum header for this chunk
+
+        Returns:
+            dict: The session's state after the chunk
+        """
+        meta = self._meta(upload_id)
+        if offset < 0 or length < 0 or offset + length > meta['size']:
+            raise UploadError(f"Chunk {offset}-{offset + length} is outside the file's {meta['size']} bytes",
+                              416 if offset + length > meta['size'] else 400)
+        if length > MAX_CONTENT_LENGTH:
+            raise UploadError(f'Chunks may be at most {MAX_CONTENT_LENGTH} bytes', 413)
+        digest, expected = parse_chunk_checksum(checksum_header)
+
+        lock = self._lock(upload_id)
+        try:
+            if os.path.exists(self._path(upload_id, LOCK_NAME)):
+                # The file may already be linked into a workspace; it must not change any more
+                raise UploadError('Upload is being converted', 409)
+            written = 0
+            # A descriptor of its own per chunk, so parallel chunks do not share a file position
+            with open(self._path(upload_id, DATA_NAME), 'r+b') as f:
+                f.seek(offset)
+                while written < length:
+                    data = stream.read(min(CHUNK_SIZE, length - written))
+                    if not data:
+                        break
+                    if digest is not None:
+                        digest.update(data)
+                    f.write(data)
+                    written += len(data)
+        except FileNotFoundError:
+            raise UploadError('Upload not found', 404)
+        finally:
+            self._unlock(lock)
+        if written < length:
+            raise UploadError(f'Chunk ended after {written} of {length} bytes; send it again')
+        if digest is not None and digest.digest() != expected:
+            raise UploadError('Chunk checksum mismatch; send it again', 460)
+
+        if length:
+            # The marker is written after the data, so it only ever names bytes that are in the file
+            open(self._path(upload_id, RANGES_NAME, f'{offset}-{offset + length}'), 'w').close()
+        return self.state(upload_id, meta)
+
+    def _ranges(self, upload_id):
+        ranges = []
+        try:
+            names = os.listdir(self._path(upload_id, RANGES_NAME))
+        except OSError:
+            raise UploadError('Upload not found', 404)
+        for name in names:
+            start, _, end = name.partition('-')
+            if start.isdigit() and end.isdigit():
+                ranges.append((int(start), int(end)))
+        return _merge(ranges)
+
+    def state(self, upload_id, meta=None):
+        """
+        Describe an upload session.
+
+        Returns:
+            dict: id, filename, size, offset (bytes received without a gap from the start),
+            received (bytes received in total), complete, missing (byte ranges still
+            to send, end exclusive)
+        """
+        meta = meta or self._meta(upload_id)
+        size = meta['size']
+        ranges = self._ranges(upload_id)
+        missing, position = [], 0
+        for start, end in ranges:
+            if start > position:
+                missing.append([position, start])
+            position = end
+        if position < size:
+            missing.append([position, size])
+        return {
+            'id': upload_id,
+            'filename': meta['filename'],
+            'size': size,
+            'offset': ranges[0][1] if ranges and ranges[0][0] == 0 else 0,
+            'received': sum(end - start for start, end in ranges),
+            'complete': not missing,
+            'missing': missing
+        }
+
+    def finish(self, upload_id):
+        """
+        Verify a complete upload and place it in a new conversion workspace.
+
+        The session is locked against further chunks and other finishes. The
+        caller owns the returned file and must release() the session: removing
+        it once the conversion started, or keeping it if the server was too
+        busy to start, so the client can ask again without re-sending the file.
+
+        Returns:
+            tuple: (file path, file name, SHA-256 hex digest)
+        """
+        meta = self._meta(upload_id)
+        state = self.state(upload_id, meta)
+        if not state['complete']:
+            raise UploadError('Upload is not complete', 409, missing=state['missing'])
+        try:
+            lock = self._lock(upload_id, exclusive=True)
+        except BlockingIOError:
+            raise UploadError('Chunks are still being written to this upload; try again', 409)
+        try:
+            os.close(os.open(self._path(upload_id, LOCK_NAME), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            raise UploadError('Upload is already being converted', 409)
+        finally:
+            self._unlock(lock)
+
+        try:
+            data_path = self._path(upload_id, DATA_NAME)
+            digest = hashlib.sha256()
+            with open(data_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+            input_hash = digest.hexdigest()
+            if meta.get('checksum') and meta['checksum'] != input_hash:
+                self.release(upload_id)
+                raise UploadError('File checksum mismatch; the upload was discarded, start a new one', 460)
+
+            filepath = os.path.join(create_workspace(), secure_filename(meta['filename']))
+            try:
+                if fcntl is None:
+                    # Late chunks are not locked out; a copy cannot change under the conversion
+                    shutil.copyfile(data_path, filepath)
+                else:
+                    # Same filesystem: a second name for the data, not a copy
+                    os.link(data_path, filepath)
+            except OSError:
+                shutil.copyfile(data_path, filepath)
+        except UploadError:
+            raise
+        except Exception:
+            self.release(upload_id, keep=True)
+            raise
+        return filepath, os.path.basename(filepath), input_hash
+
+    def release(self, upload_id, keep=False):
+        """
+        End the conversion of a finished session.
+
+        Args:
+            keep (bool): Unlock the session for another try (the conversion did
+                not start) instead of removing it
+        """
+        if keep:
+            try:
+                os.remove(self._path(upload_id, LOCK_NAME))
+            except OSError:
+                pass
+        else:
+            shutil.rmtree(self._path(upload_id), ignore_errors=True)
+
+    def discard(self, upload_id):
+        """Delete an upload session and everything received for it"""
+        path = self._path(upload_id)
+        if not os.path.isdir(path):
+            raise UploadError('Upload not found', 404)
+        shutil.rmtree(path, ignore_errors=True)
+
+upload_manager = UploadManager()
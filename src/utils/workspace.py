@@ -0,0 +1,204 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+from src.config.config import (
+    UPLOAD_FOLDER, INGEST_FOLDER, UPLOAD_SESSION_FOLDER, UPLOAD_SESSION_TTL,
+    WORKSPACE_TTL, WORKSPACE_MAX_BYTES, WORKSPACE_MIN_AGE, JANITOR_INTERVAL
+)
+
+def create_workspace():
+    """
+    Create a private directory in UPLOAD_FOLDER for one conversion.
+
+    Inputs, outputs and extracted media of the conversion go in it, so
+    concurrent uploads with the same file name cannot overwrite each other.
+    Starts the janitor of this server process on first use.
+
+    Returns:
+        str: Absolute path of the new directory
+    """
+    janitor.ensure_started()
+    path = os.path.join(UPLOAD_FOLDER, uuid.uuid4().hex)
+    os.makedirs(path)
+    return path
+
+def relative_path(path):
+    """Path of a file inside UPLOAD_FOLDER as used in /download/ URLs"""
+    return os.path.relpath(path, UPLOAD_FOLDER).replace(os.sep, '/')
+
+def touch(path):
+    """Mark the workspace holding `path` as recently used, so quota eviction keeps it longer"""
+    rel = relative_path(path)
+    top = rel.split('/', 1)[0]
+    if top and top not in ('.', '..'):
+        try:
+            os.utime(os.path.join(UPLOAD_FOLDER, top), None)
+        except OSError:
+            pass
+
+def _usage(path):
+    """Return (size in bytes, last modification time) of a file or directory tree"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return 0, 0
+    if not os.path.isdir(path):
+        return stat.st_size, stat.st_mtime
+
+    size, last_used = 0, stat.st_mtime
+    for root, dirs, files in os.walk(path):
+        for name in dirs:
+            try:
+                last_used = max(last_used, os.lstat(os.path.join(root, name)).st_mtime)
+            except OSError:
+                pass
+        for name in files:
+            try:
+                item = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            size += item.st_size
+            last_used = max(last_used, item.st_mtime)
+    return size, last_used
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+class Janitor:
+    """
+    Keeps UPLOAD_FOLDER bounded.
+
+    Every `interval` seconds a background thread removes workspaces (and
+    loose files left by older versions) not modified for `ttl` seconds,
+    then evicts the least recently used ones until the folder fits in
+    `max_bytes`. Nothing modified in the last `min_age` seconds is evicted
+    for quota, so running conversions keep their files. Upload spools in
+    INGEST_FOLDER are only subject to the TTL, and resumable upload sessions
+    in UPLOAD_SESSION_FOLDER only to UPLOAD_SESSION_TTL.
+
+    Each server process runs its own janitor; sweeps only delete, so running
+    them concurrently is harmless.
+    """
+
+    def __init__(self, folder, ttl, max_bytes, min_age, interval):
+        self.folder = folder
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.min_age = min_age
+        self.interval = interval
+        self.evicted_ttl = 0
+        self.evicted_quota = 0
+        self.last_sweep = None
+        self.last_sweep_seconds = None
+        self.size_bytes = None
+        self.workspaces = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        # Threads do not survive fork(), so start one per server process
+        with self._lock:
+            if self._pid == os.getpid() or not self.interval:
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._loop, name='upload-janitor', daemon=True).start()
+
+    def _loop(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Upload janitor sweep failed: {str(e)}")
+            time.sleep(self.interval)
+
+    def sweep(self):
+        """Apply the TTL and the size quota once"""
+        started = time.monotonic()
+        now = time.time()
+        entries = []
+        try:
+            scanned = list(os.scandir(self.folder))
+        except OSError:
+            return
+
+        for item in scanned:
+            if item.path == INGEST_FOLDER:
+                for spool in _scandir(INGEST_FOLDER):
+                    if self.ttl and now - _usage(spool.path)[1] > self.ttl:
+                        _remove(spool.path)
+                continue
+            if item.path == UPLOAD_SESSION_FOLDER:
+                # Never evicted for quota: the client may still be sending the rest
+                for session in _scandir(UPLOAD_SESSION_FOLDER):
+                    if UPLOAD_SESSION_TTL and now - _usage(session.path)[1] > UPLOAD_SESSION_TTL:
+                        _remove(session.path)
+                continue
+            size, last_used = _usage(item.path)
+            if self.ttl and now - last_used > self.ttl:
+                _remove(item.path)
+                self._count('evicted_ttl')
+                continue
+            entries.append((last_used, item.path, size))
+
+        total = sum(size for _, _, size in entries)
+        if self.max_bytes and total > self.max_bytes:
+            # Least recently used first
+            entries.sort()
+            for last_used, path, size in list(entries):
+                if total <= self.max_bytes:
+                    break
+                if now - last_used < self.min_age:
+                    continue
+                _remove(path)
+                entries.remove((last_used, path, size))
+                total -= size
+                self._count('evicted_quota')
+
+        with self._lock:
+            self.size_bytes = total
+            self.workspaces = len(entries)
+            self.last_sweep = now
+            self.last_sweep_seconds = round(time.monotonic() - started, 3)
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        """Return disk usage of UPLOAD_FOLDER and eviction counters"""
+        if self.last_sweep is None:
+            self.sweep()
+        try:
+            disk = shutil.disk_usage(self.folder)
+            disk_free, disk_total = disk.free, disk.total
+        except OSError:
+            disk_free = disk_total = None
+        with self._lock:
+            return {
+                'workspaces': self.workspaces,
+                'size_bytes': self.size_bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'evicted_ttl': self.evicted_ttl,
+                'evicted_quota': self.evicted_quota,
+                'last_sweep': self.last_sweep,
+                'last_sweep_seconds': self.last_sweep_seconds,
+                'disk_free_bytes': disk_free,
+                'disk_total_bytes': disk_total
+            }
+
+def _scandir(path):
+    try:
+        return list(os.scandir(path))
+    except OSError:
+        return []
+
+janitor = Janitor(UPLOAD_FOLDER, WORKSPACE_TTL, WORKSPACE_MAX_BYTES, WORKSPACE_MIN_AGE, JANITOR_INTERVAL)
@@ -0,0 +1,67 @@
+import io
+import json
+import zipfile
+from src.utils.ingest import CHUNK_SIZE
+
+class _ChunkBuffer(io.RawIOBase):
+    """Unseekable sink that collects what ZipFile writes until it is drained"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+class ZipStream:
+    """
+    Builds a ZIP archive incrementally for a streamed response.
+
+    ZipFile writes into an unseekable buffer (so sizes go into data
+    descriptors after each entry) and every method yields the bytes produced
+    so far. Only one chunk of a file is held in memory at a time.
+
+    Example:
+        zs = ZipStream()
+        yield from zs.add_file(path, 'result.html')
+        yield from zs.close()
+    """
+
+    def __init__(self, compression=zipfile.ZIP_DEFLATED):
+        self._buffer = _ChunkBuffer()
+        self._zip = zipfile.ZipFile(self._buffer, 'w', compression=compression)
+
+    def _drain(self):
+        data = self._buffer.drain()
+        if data:
+            yield data
+
+    def add_file(self, path, arcname):
+        """Add a file from disk, yielding archive bytes as they are produced"""
+        with open(path, 'rb') as source, self._zip.open(arcname, 'w', force_zip64=True) as target:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                target.write(chunk)
+                yield from self._drain()
+        yield from self._drain()
+
+    def add_bytes(self, data, arcname):
+        """Add an in-memory entry"""
+        self._zip.writestr(arcname, data)
+        yield from self._drain()
+
+    def add_json(self, obj, arcname):
+        yield from self.add_bytes(json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8'), arcname)
+
+    def close(self):
+        """Write the central directory and yield the remaining bytes"""
+        self._zip.close()
+        yield from self._drain()
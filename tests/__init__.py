@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# Keep the uploads, caches, history, job records and built assets of a test run out of the
+# working tree, and its tool slots apart from those of a server running on the same host
+_scratch = tempfile.mkdtemp(prefix='document-converter-tests-')
+for _name in ('UPLOAD_FOLDER', 'CACHE_FOLDER', 'HISTORY_FOLDER', 'JOBS_FOLDER', 'ASSETS_FOLDER', 'TOOL_SLOT_FOLDER'):
+    os.environ.setdefault(_name, os.path.join(_scratch, _name.split('_')[0].lower()))
+os.environ.setdefault('JANITOR_INTERVAL', '0')
@@ -0,0 +1,30 @@
+"""Stands in for `pandoc server` in tests: answers /version and wraps the input text in <p>"""
+import json
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/version':
+            self.reply({'version': 'stub'})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.reply({'output': f"<p>{request['text']}</p>", 'base64': False, 'messages': []})
+
+    def reply(self, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+if __name__ == '__main__':
+    port = int(sys.argv[sys.argv.index('--port') + 1])
+    ThreadingHTTPServer(('127.0.0.1', port), Handler).serve_forever()
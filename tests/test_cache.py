@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+from src.utils.cache import ConversionCache, make_cache_key
+
+class CacheKeyTest(unittest.TestCase):
+    def test_equivalent_requests_share_a_key(self):
+        key = make_cache_key('file', 'abc', 'markdown', 'html', '--standalone  --toc')
+        self.assertEqual(key, make_cache_key('file', 'abc', ' Markdown', 'HTML ', ' --standalone --toc '))
+
+    def test_differences_that_change_the_output_do_not(self):
+        key = make_cache_key('file', 'abc', 'markdown', 'html', '--standalone --toc')
+        for other in [('text', 'abc', 'markdown', 'html', '--standalone --toc'),
+                      ('file', 'abd', 'markdown', 'html', '--standalone --toc'),
+                      ('file', 'abc', 'markdown', 'docx', '--standalone --toc'),
+                      ('file', 'abc', 'markdown', 'html', '--toc --standalone')]:
+            self.assertNotEqual(key, make_cache_key(*other), other)
+
+class ConversionCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder, True)
+        self.payload = os.path.join(self.folder, 'payload')
+        with open(self.payload, 'wb') as f:
+            f.write(b'x' * 1000)
+
+    def put(self, cache, key, mtime=None):
+        cache.put(key, {'success': True, 'key': key}, self.payload)
+        if mtime is not None:
+            os.utime(os.path.join(cache.folder, f'{key}.json'), (mtime, mtime))
+
+    def test_hit_returns_result_and_payload(self):
+        cache = ConversionCache(os.path.join(self.folder, 'cache'), 10 ** 6, 3600)
+        self.assertIsNone(cache.get('a'))
+        self.put(cache, 'a')
+        result, payload = cache.get('a')
+        self.assertEqual(result, {'success': True, 'key': 'a'})
+        with open(payload, 'rb') as f:
+            self.assertEqual(f.read(), b'x' * 1000)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        # Room for two entries (1000-byte payload plus the JSON file each), not three
+        cache = ConversionCache(os.path.join(self.folder, 'cache'), 2500, 3600)
+        now = time.time()
+        self.put(cache, 'a', now - 20)
+        self.put(cache, 'b', now - 10)
+        self.assertIsNotNone(cache.get('a'))  # a is now the most recently used
+        self.put(cache, 'c')
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertEqual(cache.evictions, 1)
+        self.assertLessEqual(cache.stats()['size_bytes'], 2500)
+
+    def test_expired_entry_is_a_miss_and_removed(self):
+        cache = ConversionCache(os.path.join(self.folder, 'cache'), 10 ** 6, 60)
+        self.put(cache, 'a')
+        with mock.patch('src.utils.cache.time.time', return_value=time.time() + 120):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(os.listdir(cache.folder), [])
+
+    def test_eviction_drops_expired_entries(self):
+        cache = ConversionCache(os.path.join(self.folder, 'cache'), 10 ** 6, 60)
+        self.put(cache, 'old', time.time() - 120)
+        self.put(cache, 'new')
+        cache.evict()
+        self.assertEqual(sorted(os.listdir(cache.folder)), ['new.bin', 'new.json'])
+        self.assertEqual(cache.evictions, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import gzip
+import json
+import unittest
+from flask import Flask, Response, jsonify
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+from src.utils import compression
+from src.utils.compression import PREFERRED_ENCODINGS, compress_response, negotiate
+
+BIG = {'content': '<p>Converted paragraph</p>\n' * 2000}
+
+def accept(header):
+    return parse_accept_header(header, Accept)
+
+def decode(encoding, body):
+    if encoding == 'gzip':
+        return gzip.decompress(body)
+    if encoding == 'br':
+        return compression.brotli.decompress(body)
+    return compression.zstandard.ZstdDecompressor().decompressobj().decompress(body)
+
+class NegotiateTest(unittest.TestCase):
+    def test_server_preference_among_equal_qualities(self):
+        self.assertEqual(negotiate(accept('gzip, deflate, br, zstd')), PREFERRED_ENCODINGS[0])
+        self.assertEqual(negotiate(accept('*')), PREFERRED_ENCODINGS[0])
+
+    def test_client_quality_wins(self):
+        self.assertEqual(negotiate(accept('zstd;q=0.2, br;q=0.5, gzip')), 'gzip')
+
+    def test_nothing_acceptable(self):
+        self.assertIsNone(negotiate(accept('')))
+        self.assertIsNone(negotiate(accept('identity')))
+        self.assertIsNone(negotiate(accept('gzip;q=0, deflate')))
+
+class CompressResponseTest(unittest.TestCase):
+    def setUp(self):
+        app = Flask(__name__)
+        app.after_request(compress_response)
+        app.add_url_rule('/json', 'json', lambda: jsonify(BIG))
+        app.add_url_rule('/small', 'small', lambda: jsonify({'ok': True}))
+        app.add_url_rule('/zip', 'zip', lambda: Response(b'PK' * 4000, mimetype='application/zip'))
+        app.add_url_rule('/png', 'png', lambda: Response(b'\x89PNG' * 2000, mimetype='image/png'))
+        app.add_url_rule('/encoded', 'encoded', lambda: Response(
+            gzip.compress(b'x' * 8000), mimetype='text/css', headers={'Content-Encoding': 'gzip'}))
+        app.add_url_rule('/stream', 'stream', lambda: Response(
+            (line for line in ['chunk of text\n'] * 5000), mimetype='text/plain'))
+        self.client = app.test_client()
+
+    def test_every_available_encoding_round_trips(self):
+        for encoding in PREFERRED_ENCODINGS:
+            with self.subTest(encoding=encoding):
+                response = self.client.get('/json', headers={'Accept-Encoding': encoding})
+                self.assertEqual(response.headers['Content-Encoding'], encoding)
+                self.assertIn('Accept-Encoding', response.headers['Vary'])
+                self.assertNotIn('Content-Length', response.headers)
+                self.assertEqual(json.loads(decode(encoding, response.data)), BIG)
+
+    def test_streamed_body_is_compressed(self):
+        response = self.client.get('/stream', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.data), b'chunk of text\n' * 5000)
+
+    def test_uncompressed_without_accept_encoding(self):
+        response = self.client.get('/json')
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.get_json(), BIG)
+
+    def test_already_compressed_and_small_bodies_are_left_alone(self):
+        for path in ('/zip', '/png', '/small'):
+            with self.subTest(path=path):
+                response = self.client.get(path, headers={'Accept-Encoding': 'gzip, br, zstd'})
+                self.assertNotIn('Content-Encoding', response.headers)
+
+        response = self.client.get('/encoded', headers={'Accept-Encoding': 'br, zstd'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.data), b'x' * 8000)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import os
+import shutil
+import unittest
+from app import create_app
+from src.config.config import UPLOAD_FOLDER
+
+@unittest.skipUnless(shutil.which('pandoc'), 'pandoc is not installed')
+class SavedOutputCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.client = create_app().test_client()
+
+    def convert_text(self):
+        response = self.client.post('/convert', json={
+            'conversion_type': 'text',
+            'text': '# Cached\n\nSaved output served from the cache.',
+            'from_format': 'markdown',
+            'to_format': 'html',
+            'response': 'url'
+        })
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def test_cache_hit_gets_its_own_download_url(self):
+        first = self.convert_text()
+        second = self.convert_text()
+        self.assertTrue(second.get('cached'))
+        self.assertNotEqual(first['downloadUrl'], second['downloadUrl'])
+
+        # The janitor removes the first workspace long before the cache entry expires
+        workspace = first['downloadUrl'].split('/download/', 1)[1].split('/', 1)[0]
+        shutil.rmtree(os.path.join(UPLOAD_FOLDER, workspace))
+
+        self.assertEqual(self.client.get(first['downloadUrl']).status_code, 404)
+        download = self.client.get(second['downloadUrl'])
+        self.assertEqual(download.status_code, 200)
+        self.assertIn(b'Saved output served from the cache.', download.data)
+        download.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import shlex
+import sys
+import time
+import unittest
+from unittest import mock
+from src.utils import engines
+from src.utils.engines import PandocServerEngine, PandocServerError
+
+STUB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pandoc_server_stub.py')
+
+class PandocServerEngineTest(unittest.TestCase):
+    def setUp(self):
+        command = f'{shlex.quote(sys.executable)} {shlex.quote(STUB)}'
+        self.engine = PandocServerEngine(command, size=1, timeout=5, health_interval=0.2)
+
+    def tearDown(self):
+        self.engine.shutdown()
+
+    def test_converts_through_the_server(self):
+        self.assertEqual(self.engine.convert(b'hello', 'markdown', 'html', '--standalone'), b'<p>hello</p>')
+        self.assertEqual(self.engine.stats(), {'available': True, 'size': 1, 'restarts': 0})
+
+    def test_dead_server_is_replaced(self):
+        self.engine.convert(b'first', 'markdown', 'html', '')
+        dead = self.engine.servers[0]
+        dead.process.kill()
+
+        deadline = time.monotonic() + 15
+        while self.engine.stats()['restarts'] == 0 and time.monotonic() < deadline:
+            time.sleep(0.1)
+        self.assertEqual(self.engine.stats()['restarts'], 1)
+        self.assertIsNot(self.engine.servers[0], dead)
+        self.assertEqual(self.engine.convert(b'second', 'markdown', 'html', ''), b'<p>second</p>')
+
+    def test_non_utf8_input_falls_back_to_the_cli(self):
+        with self.assertRaises(PandocServerError):
+            self.engine.convert(b'caf\xe9', 'markdown', 'html', '')
+
+        with mock.patch.object(engines, 'server_engine', self.engine), \
+                mock.patch.dict(engines.ENGINES, {'server': self.engine}), \
+                mock.patch.object(engines.cli_engine, 'convert', return_value=b'<p>cli</p>') as cli:
+            self.assertEqual(engines.convert_bytes(b'caf\xe9', 'markdown', 'html', '', engine='server'), b'<p>cli</p>')
+        cli.assert_called_once()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+from app import create_app
+from src.utils import governor
+from src.utils.governor import ServerBusy, ToolLimiter, run_tool
+
+class RunToolTest(unittest.TestCase):
+    def test_pipes_stay_in_memory(self):
+        # More output than a pipe buffer holds, on both streams, while the input is still being written
+        script = ('import sys\n'
+                  'data = sys.stdin.read()\n'
+                  'sys.stdout.write(data * 4)\n'
+                  'sys.stderr.write("x" * 200000)\n')
+        text = 'é' * 100000
+        completed = run_tool([sys.executable, '-c', script], input=text, capture_output=True,
+                             text=True, encoding='utf-8')
+        self.assertEqual(completed.returncode, 0)
+        self.assertEqual(completed.stdout, text * 4)
+        self.assertEqual(len(completed.stderr), 200000)
+
+    def test_check_and_binary_output(self):
+        with self.assertRaises(subprocess.CalledProcessError) as raised:
+            run_tool([sys.executable, '-c', 'import sys; sys.stdout.buffer.write(b"\\xff"); sys.exit(3)'],
+                     capture_output=True, check=True)
+        self.assertEqual(raised.exception.returncode, 3)
+        self.assertEqual(raised.exception.stdout, b'\xff')
+
+    def test_timeout_kills_the_tool(self):
+        started = time.monotonic()
+        with self.assertRaises(subprocess.TimeoutExpired):
+            run_tool([sys.executable, '-c', 'import time; time.sleep(30)'], capture_output=True, timeout=0.5)
+        self.assertLess(time.monotonic() - started, 10)
+
+class ToolLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder, True)
+
+    def test_full_queue_is_rejected_at_once(self):
+        limiter = ToolLimiter('pandoc', 1, 0, 30, self.folder)
+        with limiter.slot():
+            started = time.monotonic()
+            with self.assertRaises(ServerBusy) as raised:
+                with limiter.slot():
+                    pass
+            self.assertLess(time.monotonic() - started, 1)
+        self.assertGreaterEqual(raised.exception.retry_after, 1)
+        self.assertEqual(limiter.stats()['rejected'], 1)
+        with limiter.slot():
+            pass
+
+    def test_queued_caller_times_out(self):
+        limiter = ToolLimiter('pandoc', 1, 5, 0.2, self.folder)
+        with limiter.slot():
+            with self.assertRaisesRegex(ServerBusy, 'Timed out'):
+                with limiter.slot():
+                    pass
+
+    def test_slots_are_shared_between_processes(self):
+        # Separate limiters on one folder stand in for separate server processes
+        first = ToolLimiter('pandoc', 1, 0, 30, self.folder)
+        second = ToolLimiter('pandoc', 1, 0, 30, self.folder)
+        self.assertEqual(first.stats()['scope'], 'host')
+        with first.slot():
+            with self.assertRaises(ServerBusy):
+                with second.slot():
+                    pass
+        with second.slot():
+            pass
+
+    def test_saturated_server_answers_503_with_retry_after(self):
+        limiter = ToolLimiter('pandoc', 1, 0, 30, self.folder)
+        client = create_app().test_client()
+        with mock.patch.dict(governor.limiters, {'pandoc': limiter}), limiter.slot():
+            response = client.post('/convert', json={
+                'conversion_type': 'text',
+                'text': '# Busy',
+                'from_format': 'markdown',
+                'to_format': 'html',
+                'cache': False
+            })
+        self.assertEqual(response.status_code, 503)
+        self.assertGreaterEqual(int(response.headers['Retry-After']), 1)
+        self.assertIn('error', response.get_json())
+
+if __name__ == '__main__':
+    unittest.main()
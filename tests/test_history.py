@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+from app import create_app
+from src.utils.history import HistoryStore, CLIENT_HEADER, CLIENT_COOKIE
+
+@unittest.skipUnless(shutil.which('pandoc'), 'pandoc is not installed')
+class HistoryScopeTest(unittest.TestCase):
+    def setUp(self):
+        self.client = create_app().test_client()
+
+    def convert_text(self, headers=None):
+        response = self.client.post('/convert', headers=headers, json={
+            'conversion_type': 'text',
+            'text': f'# History {uuid.uuid4().hex}',
+            'from_format': 'markdown',
+            'to_format': 'html'
+        })
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_entries_are_only_served_to_their_client(self):
+        owner = {CLIENT_HEADER: uuid.uuid4().hex}
+        other = {CLIENT_HEADER: uuid.uuid4().hex}
+        history_id = self.convert_text(owner).get_json()['historyId']
+
+        listed = self.client.get('/api/history', headers=owner).get_json()['items']
+        self.assertEqual([entry['id'] for entry in listed], [history_id])
+        self.assertEqual(self.client.get(f'/api/history/{history_id}', headers=owner).status_code, 200)
+
+        self.assertEqual(self.client.get('/api/history', headers=other).get_json()['items'], [])
+        self.assertEqual(self.client.get('/api/history').get_json()['items'], [])
+        self.assertEqual(self.client.get(f'/api/history/{history_id}', headers=other).status_code, 404)
+        self.assertEqual(self.client.get(f'/api/history/download?ids={history_id}', headers=other).status_code, 404)
+
+    def test_client_without_token_gets_one(self):
+        response = self.convert_text()
+        token = response.headers[CLIENT_HEADER]
+        self.assertIn(f'{CLIENT_COOKIE}={token}', response.headers['Set-Cookie'])
+
+        # The test client sends the cookie back, like a browser
+        listed = self.client.get('/api/history').get_json()['items']
+        self.assertEqual([entry['id'] for entry in listed], [response.get_json()['historyId']])
+
+class HistoryQuotaTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.store = HistoryStore(os.path.join(self.folder, 'history.db'), max_entries=0, max_bytes=1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def add(self, size):
+        entry_id = uuid.uuid4().hex
+        self.store.add({'id': entry_id, 'status': 'success', 'output': 'out.txt', 'size': size, 'client': 'c'})
+        return entry_id
+
+    def test_oldest_outputs_are_dropped_beyond_the_quota(self):
+        first, second = self.add(400), self.add(400)
+        self.assertEqual(self.store.usage()['size_bytes'], 800)
+
+        third = self.add(400)
+        self.assertEqual([e['id'] for e in self.store.get_many([first, second, third], 'c')], [second, third])
+        self.assertEqual(self.store.usage()['size_bytes'], 800)
+
+    def test_newest_entry_is_kept_even_if_larger_than_the_quota(self):
+        self.add(400)
+        large = self.add(5000)
+        self.assertEqual([e['id'] for e in self.store.get_many([large], 'c')], [large])
+        self.assertEqual(self.store.usage()['entries'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from src.utils.inflight import SingleFlight
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('condition not met in time')
+        time.sleep(0.01)
+
+class SingleFlightTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder, True)
+        self.pool = ThreadPoolExecutor(4)
+        self.addCleanup(self.pool.shutdown)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.runs = []
+
+    def flight(self, timeout=30):
+        return SingleFlight(folder=self.folder, enabled=True, timeout=timeout)
+
+    def convert(self, value='output'):
+        def function():
+            self.runs.append(value)
+            self.release.wait(10)
+            if isinstance(value, Exception):
+                raise value
+            return value
+        return function
+
+    def followers(self, flight, key='key'):
+        call = flight._calls.get(key)
+        return len(call.followers) if call else 0
+
+    def test_duplicates_share_the_leaders_value(self):
+        flight = self.flight()
+        leader = self.pool.submit(flight.run, 'key', self.convert(), 'text')
+        wait_until(lambda: self.runs)
+        follower = self.pool.submit(flight.run, 'key', self.convert('duplicate'), 'text',
+                                    share=lambda value: value + ' (copy)')
+        wait_until(lambda: self.followers(flight) == 1)
+        self.release.set()
+
+        self.assertEqual(leader.result(5), ('output', False))
+        self.assertEqual(follower.result(5), ('output (copy)', True))
+        self.assertEqual(self.runs, ['output'])
+        self.assertEqual(flight.stats()['coalesced'], 1)
+
+    def test_leader_error_fails_the_duplicates(self):
+        flight = self.flight()
+        error = ValueError('pandoc failed')
+        leader = self.pool.submit(flight.run, 'key', self.convert(error), 'text')
+        wait_until(lambda: self.runs)
+        follower = self.pool.submit(flight.run, 'key', self.convert('duplicate'), 'text')
+        wait_until(lambda: self.followers(flight) == 1)
+        self.release.set()
+
+        self.assertIs(leader.exception(5), error)
+        self.assertIs(follower.exception(5), error)
+        self.assertEqual(self.runs, [error])
+
+    def test_stuck_leader_is_given_up_on(self):
+        flight = self.flight(timeout=0.2)
+        self.pool.submit(flight.run, 'key', self.convert(), 'text')
+        wait_until(lambda: self.runs)
+        self.assertEqual(flight.run('key', lambda: 'own', 'text'), ('own', False))
+
+    def test_other_worker_result_is_picked_up_from_the_cache(self):
+        # Two instances on one folder stand in for two gunicorn workers
+        first, second = self.flight(), self.flight()
+        leader = self.pool.submit(first.run, 'key', self.convert(), 'file', recheck=lambda: None)
+        wait_until(lambda: self.runs)
+        waiting = self.pool.submit(second.run, 'key', self.convert('duplicate'), 'file', recheck=lambda: 'cached')
+        time.sleep(0.2)
+        self.assertFalse(waiting.done())
+        self.release.set()
+
+        self.assertEqual(leader.result(5), ('output', False))
+        self.assertEqual(waiting.result(5), ('cached', True))
+        self.assertEqual(self.runs, ['output'])
+
+    def test_other_worker_without_a_cached_result_converts(self):
+        first, second = self.flight(), self.flight()
+        self.pool.submit(first.run, 'key', self.convert(), 'file', recheck=lambda: None)
+        wait_until(lambda: self.runs)
+        waiting = self.pool.submit(second.run, 'key', lambda: 'own', 'file', recheck=lambda: None)
+        self.release.set()
+        self.assertEqual(waiting.result(5), ('own', False))
+
+    def test_stuck_worker_is_given_up_on(self):
+        first, second = self.flight(), self.flight(timeout=0.2)
+        self.pool.submit(first.run, 'key', self.convert(), 'file', recheck=lambda: None)
+        wait_until(lambda: self.runs)
+        self.assertEqual(second.run('key', lambda: 'own', 'file', recheck=lambda: 'cached'), ('own', False))
+
+if __name__ == '__main__':
+    unittest.main()
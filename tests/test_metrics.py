@@ -0,0 +1,23 @@
+import subprocess
+import sys
+import unittest
+
+class MetricsFallbackTest(unittest.TestCase):
+    def test_app_imports_without_prometheus_client(self):
+        # A None entry in sys.modules makes the import raise ImportError, as if the package were missing
+        script = (
+            "import sys\n"
+            "sys.modules['prometheus_client'] = None\n"
+            "import tests\n"
+            "from app import create_app\n"
+            "from src.utils import metrics\n"
+            "assert not metrics.METRICS_AVAILABLE\n"
+            "metrics.observe_tool('pandoc', 0.1)\n"
+            "response = create_app().test_client().get('/metrics')\n"
+            "assert response.status_code == 501, response.status_code\n"
+        )
+        result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, timeout=120)
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from src.utils.postprocess import MATHJAX_CONFIG, MATHJAX_SRC, MATHJAX_STYLE, image_sources, rewrite_html
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+def beautifulsoup_rewrite(content, image_srcs):
+    """The BeautifulSoup post-processing rewrite_html() replaced, kept as the reference"""
+    soup = BeautifulSoup(content, 'html.parser')
+    for img in soup.find_all('img'):
+        if img.get('src') in image_srcs:
+            img['src'] = image_srcs[img['src']]
+    soup_head = soup.head
+    if soup_head is None and soup.html is not None:
+        soup_head = soup.new_tag('head')
+        soup.html.insert(0, soup_head)
+    if soup_head is not None:
+        for script in soup_head.find_all('script'):
+            if 'mathjax' in script.get('src', '').lower():
+                script.decompose()
+        cfg = soup.new_tag('script')
+        cfg.string = MATHJAX_CONFIG
+        soup_head.append(cfg)
+        soup_head.append(soup.new_tag('script', src=MATHJAX_SRC))
+        style_tag = soup.new_tag('style')
+        style_tag.string = MATHJAX_STYLE
+        soup_head.append(style_tag)
+    return str(soup)
+
+@unittest.skipUnless(BeautifulSoup and Image and shutil.which('pandoc'), 'needs beautifulsoup4, Pillow and pandoc')
+class RewriteHtmlTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        for name, color in (('red.png', 'red'), ('blue.png', 'blue')):
+            Image.new('RGB', (4, 4), color).save(os.path.join(cls.folder, name))
+        with open(os.path.join(cls.folder, 'doc.md'), 'w', encoding='utf-8') as f:
+            f.write('# Report\n\nInline $e^{i\\pi} + 1 = 0$ and a figure:\n\n'
+                    '![Red](red.png)\n\n$$\\int_0^1 x\\,dx$$\n\n| A | B |\n|---|---|\n| ![Blue](blue.png) | <x> & y |\n')
+        cls.docx = os.path.join(cls.folder, 'doc.docx')
+        subprocess.run(['pandoc', 'doc.md', '-o', cls.docx], cwd=cls.folder, check=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.folder, True)
+
+    def docx_to_html(self, *options):
+        # The same pandoc command as the DOCX to HTML conversion
+        return subprocess.run(
+            ['pandoc', self.docx, '-f', 'docx', '-t', 'html', f'--extract-media={self.folder}/media',
+             '--mathjax', *options],
+            check=True, capture_output=True, text=True, encoding='utf-8').stdout
+
+    def assert_same_document(self, content):
+        sources = image_sources(content)
+        self.assertEqual(len(sources), 2)
+        image_srcs = {src: f'data:image/png;base64,{index}AAA="&<' for index, src in enumerate(sources)}
+
+        expected = beautifulsoup_rewrite(content, image_srcs)
+        actual = rewrite_html(content, image_srcs)
+        # Both parsed the same way: rewrite_html() keeps the original serialization, BeautifulSoup does not
+        self.assertEqual(str(BeautifulSoup(actual, 'html.parser')), str(BeautifulSoup(expected, 'html.parser')))
+        return actual
+
+    def test_standalone_document(self):
+        content = self.docx_to_html('--standalone')
+        self.assertIn('mathjax', content.lower())
+        actual = self.assert_same_document(content)
+        self.assertEqual(actual.lower().count('mathjax@3/es5/'), 1)
+
+    def test_fragment(self):
+        actual = self.assert_same_document(self.docx_to_html())
+        self.assertNotIn(MATHJAX_SRC, actual)
+
+    def test_html_without_head(self):
+        content = '<html><body><p>x</p><img src="a.png" alt="a"></body></html>'
+        self.assertEqual(str(BeautifulSoup(rewrite_html(content, {'a.png': 'data:,1'}), 'html.parser')),
+                         str(BeautifulSoup(beautifulsoup_rewrite(content, {'a.png': 'data:,1'}), 'html.parser')))
+
+if __name__ == '__main__':
+    unittest.main()
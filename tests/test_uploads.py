@@ -0,0 +1,122 @@
+import base64
+import hashlib
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from app import create_app
+from src.utils import governor
+from src.utils.governor import ToolLimiter
+
+DOCUMENT = ''.join(f'Paragraph {index} of a resumable upload.\n\n' for index in range(400)).encode('utf-8')
+CHUNK = 1000
+
+class ResumableUploadTest(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.client = self.app.test_client()
+
+    def create(self, checksum=None):
+        response = self.client.post('/api/uploads', json={
+            'filename': 'report.md',
+            'size': len(DOCUMENT),
+            'checksum': checksum or hashlib.sha256(DOCUMENT).hexdigest()
+        })
+        self.assertEqual(response.status_code, 201, response.get_json())
+        return response.get_json()['id']
+
+    def patch(self, upload_id, offset, data, checksum=None, client=None):
+        headers = {'Upload-Offset': str(offset), 'Content-Type': 'application/offset+octet-stream'}
+        if checksum:
+            headers['Upload-Checksum'] = checksum
+        return (client or self.client).patch(f'/api/uploads/{upload_id}', data=data, headers=headers)
+
+    def send(self, upload_id, start, end, client=None):
+        response = self.patch(upload_id, start, DOCUMENT[start:end], client=client)
+        self.assertEqual(response.status_code, 200, response.get_json())
+        return response.get_json()
+
+    def state(self, upload_id):
+        return self.client.get(f'/api/uploads/{upload_id}').get_json()
+
+    def convert(self, upload_id):
+        return self.client.post(f'/api/uploads/{upload_id}/convert', json={
+            'from_format': 'markdown',
+            'to_format': 'html',
+            'cache': False
+        })
+
+    def test_chunks_out_of_order_and_in_parallel(self):
+        upload_id = self.create()
+        state = self.send(upload_id, 2 * CHUNK, 3 * CHUNK)
+        self.assertEqual((state['offset'], state['received']), (0, CHUNK))
+        self.send(upload_id, 0, CHUNK)
+        state = self.state(upload_id)
+        self.assertEqual(state['offset'], CHUNK)
+        self.assertEqual(state['missing'], [[CHUNK, 2 * CHUNK], [3 * CHUNK, len(DOCUMENT)]])
+
+        ranges = [(start, min(start + CHUNK, len(DOCUMENT))) for start in range(3 * CHUNK, len(DOCUMENT), CHUNK)]
+        ranges.append((CHUNK, 2 * CHUNK))
+        # One test client per thread, as separate connections would be
+        with ThreadPoolExecutor(4) as pool:
+            list(pool.map(lambda r: self.send(upload_id, *r, client=self.app.test_client()), ranges))
+
+        state = self.state(upload_id)
+        self.assertTrue(state['complete'])
+        self.assertEqual((state['offset'], state['received'], state['missing']), (len(DOCUMENT), len(DOCUMENT), []))
+        # A chunk sent twice (a retry) changes nothing
+        self.assertEqual(self.send(upload_id, 0, CHUNK)['received'], len(DOCUMENT))
+
+    def test_chunk_past_the_end_is_416(self):
+        upload_id = self.create()
+        response = self.patch(upload_id, len(DOCUMENT) - 10, b'x' * 20)
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(self.state(upload_id)['received'], 0)
+
+    def test_chunk_checksum_mismatch_is_460(self):
+        upload_id = self.create()
+        data = DOCUMENT[:CHUNK]
+        wrong = base64.b64encode(hashlib.sha256(b'other').digest()).decode('ascii')
+        self.assertEqual(self.patch(upload_id, 0, data, f'sha256 {wrong}').status_code, 460)
+        self.assertEqual(self.state(upload_id)['received'], 0)
+
+        right = base64.b64encode(hashlib.sha256(data).digest()).decode('ascii')
+        self.assertEqual(self.patch(upload_id, 0, data, f'sha256 {right}').status_code, 200)
+
+    def test_file_checksum_mismatch_is_460_and_discards_the_upload(self):
+        upload_id = self.create(checksum=hashlib.sha256(b'something else').hexdigest())
+        self.send(upload_id, 0, len(DOCUMENT))
+        self.assertEqual(self.convert(upload_id).status_code, 460)
+        self.assertEqual(self.client.get(f'/api/uploads/{upload_id}').status_code, 404)
+
+    def test_incomplete_upload_cannot_be_converted(self):
+        upload_id = self.create()
+        self.send(upload_id, 0, CHUNK)
+        response = self.convert(upload_id)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.get_json()['missing'], [[CHUNK, len(DOCUMENT)]])
+
+    def test_busy_server_keeps_the_upload(self):
+        upload_id = self.create()
+        self.send(upload_id, 0, len(DOCUMENT))
+
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder, True)
+        limiter = ToolLimiter('pandoc', 1, 0, 30, folder)
+        with mock.patch.dict(governor.limiters, {'pandoc': limiter}):
+            with limiter.slot():
+                response = self.convert(upload_id)
+            self.assertEqual(response.status_code, 503)
+            self.assertIn('Retry-After', response.headers)
+            self.assertTrue(self.state(upload_id)['complete'])
+
+            # Chunks are accepted again, and the upload converts without being sent again
+            self.send(upload_id, 0, CHUNK)
+            if shutil.which('pandoc'):
+                response = self.convert(upload_id)
+                self.assertEqual(response.status_code, 200, response.get_json())
+                self.assertEqual(self.client.get(f'/api/uploads/{upload_id}').status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()